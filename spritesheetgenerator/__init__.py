@@ -1,4 +1,10 @@
-import krita
-from .spritesheetgeneratorextension import SpritesheetGeneratorExtension
+try:
+    import krita
+except ImportError:
+    # Outside of Krita (e.g. batch jobs using the image sequence backend) there's no extension to register.
+    krita = None
 
-Scripter.addExtension(SpritesheetGeneratorExtension(krita.Krita.instance()))
+if krita is not None:
+    from .spritesheetgeneratorextension import SpritesheetGeneratorExtension
+
+    Scripter.addExtension(SpritesheetGeneratorExtension(krita.Krita.instance()))
@@ -0,0 +1,105 @@
+import sys
+import queue
+import argparse
+from pathlib import Path
+from collections import namedtuple
+from .spritesheetgenerator import SpritesheetGenerator, OUTPUT_FILE_EXTENSIONS
+from .exportinstrumentation import ExportInstrumentation, LogSink, JsonTraceSink
+from .exportoptions import addExportArguments, getConfigureArguments
+
+# Exports spritesheets for many documents in a single session.
+#
+# .kra files are opened with Krita, so they can only be processed from within Krita (e.g. through kritarunner).
+# Directories of PNG files (one file per frame) and single PNG files are opened with the image sequence backend,
+# which doesn't need Krita at all:
+#
+#   python -m spritesheetgenerator.batch path/to/walk/ path/to/run/ --type "Horizontal Strip" --output-directory out/
+
+BatchJob = namedtuple("BatchJob", ["inputPath", "exportFilePath"])
+
+KRITA_DOCUMENT_SUFFIXES = (".kra", ".kra~")
+
+def createJobs(inputPaths, outputDirectory=None, fileExtension=".png"):
+    jobs = []
+    for inputPath in inputPaths:
+        path = Path(inputPath)
+        exportDirectory = Path(outputDirectory) if outputDirectory is not None else path.parent
+        jobs.append(BatchJob(str(path), str(exportDirectory.joinpath(path.stem + fileExtension))))
+
+    return jobs
+
+def getBackendForPath(inputPath, backends):
+    # Backends are created on demand and shared between jobs, so a single Krita session handles every .kra file.
+    if Path(inputPath).suffix in KRITA_DOCUMENT_SUFFIXES:
+        if "krita" not in backends:
+            from .kritabackend import KritaBackend
+            backends["krita"] = KritaBackend()
+
+        return backends["krita"]
+    else:
+        if "imagesequence" not in backends:
+            from .inmemorybackend import ImageSequenceBackend
+            backends["imagesequence"] = ImageSequenceBackend()
+
+        return backends["imagesequence"]
+
+def runJobs(jobs, options):
+    # Process every job in the queue, even if some of them fail. Returns the jobs that failed.
+    jobQueue = queue.Queue()
+    for job in jobs:
+        jobQueue.put(job)
+
+    backends = {}
+    failedJobs = []
+    while not jobQueue.empty():
+        job = jobQueue.get()
+        print(f"Exporting {job.inputPath} to {job.exportFilePath} ({jobQueue.qsize()} jobs remaining)")
+
+        document = None
+        try:
+            backend = getBackendForPath(job.inputPath, backends)
+            document = backend.openDocument(job.inputPath)
+            Path(job.exportFilePath).parent.mkdir(parents=True, exist_ok=True)
+
+            # Optionally record a trace of each export next to its spritesheet.
+            instrumentation = ExportInstrumentation([LogSink()])
+            if options.trace:
+                instrumentation.addSink(JsonTraceSink(str(Path(job.exportFilePath).with_suffix(".trace.json"))))
+
+            spritesheetGenerator = SpritesheetGenerator(backend, instrumentation)
+            spritesheetGenerator.configure(
+                job.exportFilePath,
+                targetSpriteWidth=options.width if options.width is not None else document.width(),
+                targetSpriteHeight=options.height if options.height is not None else document.height(),
+                document=document,
+                **getConfigureArguments(options))
+            spritesheetGenerator.export()
+        except Exception as exception:
+            print(f"Failed to export {job.inputPath}: {exception}")
+            failedJobs.append(job)
+        finally:
+            if document is not None:
+                backend.closeDocument(document)
+
+            jobQueue.task_done()
+
+    print(f"Batch export completed: {len(jobs) - len(failedJobs)} succeeded, {len(failedJobs)} failed")
+    return failedJobs
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(prog="spritesheetgenerator.batch", description="Export spritesheets for multiple documents or image sequences.")
+    parser.add_argument("inputs", nargs="+", help=".kra files, PNG files or directories of PNG frames")
+    parser.add_argument("--output-directory", help="Directory the spritesheets are exported to. Defaults to the directory of each input.")
+    parser.add_argument("--width", type=int, help="Width of each sprite. Defaults to the width of the document.")
+    parser.add_argument("--height", type=int, help="Height of each sprite. Defaults to the height of the document.")
+    addExportArguments(parser)
+    parser.add_argument("--trace", action="store_true", help="Write a trace of each export next to its spritesheet, which can be opened in chrome://tracing or Perfetto")
+    return parser
+
+def main(arguments=None):
+    options = createArgumentParser().parse_args(arguments)
+    failedJobs = runJobs(createJobs(options.inputs, options.output_directory, OUTPUT_FILE_EXTENSIONS[options.output_format]), options)
+    return 1 if len(failedJobs) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+import io
+import sys
+import json
+import time
+import array
+import struct
+import platform
+import argparse
+import tempfile
+import resource
+import tracemalloc
+import contextlib
+from pathlib import Path
+from collections import Counter
+from .spritesheetgenerator import SpritesheetGenerator
+from .exportinstrumentation import ExportInstrumentation, LogSink
+from .exportoptions import addExportArguments, getConfigureArguments
+from .inmemorybackend import InMemoryBackend, InMemoryDocument, InMemoryNode
+from .pngfile import isSupportedColorSpace
+from .optionalnumpy import numpy
+
+# Measures SpritesheetGenerator.export() on synthetic in-memory documents, so it runs without Krita:
+#
+#   python -m spritesheetgenerator.benchmark --frames 120 --width 512 --height 512 --depth 2 --breadth 4 --output results.json
+#
+# Every phase of the export is timed, along with the number of calls made into the document API
+# and the peak memory usage, and the results are written as JSON so they can be compared between releases.
+
+# Methods of the generator that are measured as phases, in the order they are called during an export.
+PHASES = [
+    "_createTemporaryDocument",
+    "_useActiveDocumentAsSource",
+    "_resizeSprites",
+    "_createKeyframeIndex",
+    "_renderSpriteVariantFrames",
+    "_renderNodeSheetFrames",
+    "_streamSpritesheetToFile",
+    "_prepareSpritesheetCells",
+    "_createSpritesheetAtlasForPage",
+    "_releaseSourceDocument",
+    "_writeAtlasToFile",
+    "_createSpritesheetDocumentFromAtlas",
+    "_exportToFile",
+    "_exportFrameMapToFile"
+]
+
+# Names used in the call counts for each of the classes standing in for Krita's API.
+API_CLASS_NAMES = {InMemoryDocument: "Document", InMemoryNode: "Node"}
+
+class ApiCallCounter():
+    # Counts the calls made into documents, nodes and the backend. Documents and nodes returned
+    # by a call are wrapped as well, so every call made by the generator is counted.
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def wrap(self, target, className=None):
+        if isinstance(target, list):
+            return [self.wrap(item) for item in target]
+
+        if className is None:
+            className = API_CLASS_NAMES.get(type(target))
+            if className is None:
+                return target
+
+        return _CountingProxy(target, className, self)
+
+class _CountingProxy():
+
+    def __init__(self, target, className, counter):
+        self._target = target
+        self._className = className
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        def countedMethod(*arguments):
+            self._counter.counts[f"{self._className}.{name}"] += 1
+            result = attribute(*[_unwrap(argument) for argument in arguments])
+            return self._counter.wrap(result)
+
+        return countedMethod
+
+def _unwrap(value):
+    return value._target if isinstance(value, _CountingProxy) else value
+
+class BenchmarkBackend(InMemoryBackend):
+    # Floating point documents can't be written to PNG files without Krita, so their projection
+    # is written to the file as raw pixel data instead, which still reads every pixel of the document.
+
+    def exportImage(self, document, filePath):
+        if isSupportedColorSpace(document.colorModel(), document.colorDepth()):
+            super().exportImage(document, filePath)
+            return
+
+        with open(filePath, "wb") as file:
+            file.write(document.pixelData(0, 0, document.width(), document.height()))
+
+def createFramePixelData(width, height, colorDepth, seed):
+    # An opaque gradient, surrounded by a transparent border whose size depends on the seed,
+    # so that frames differ from each other and have transparent pixels to trim.
+    if colorDepth == "U8":
+        maximum = 255
+        values = array.array("B", (((x * 4 + channel * 64 + seed * 16) % 256) if channel < 3 else maximum for x in range(width) for channel in range(4)))
+        row = values.tobytes()
+    elif colorDepth == "U16":
+        maximum = 65535
+        values = array.array("H", (((x * 1024 + channel * 16384 + seed * 4096) % 65536) if channel < 3 else maximum for x in range(width) for channel in range(4)))
+        if sys.byteorder != "little":
+            values.byteswap()
+
+        row = values.tobytes()
+    elif colorDepth in ("F16", "F32"):
+        valueFormat = "<e" if colorDepth == "F16" else "<f"
+        row = b"".join(struct.pack(valueFormat, ((x + seed) % width) / width if channel < 3 else 1.0) for x in range(width) for channel in range(4))
+    else:
+        raise Exception(f"Unsupported color depth: {colorDepth}")
+
+    pixelSize = len(row) // width
+    border = min(seed % 8, width // 4, height // 4)
+    transparentRow = bytes(len(row))
+    opaqueRow = bytes(border * pixelSize) + row[border * pixelSize:(width - border) * pixelSize] + bytes(border * pixelSize)
+    return transparentRow * border + opaqueRow * (height - border * 2) + transparentRow * border
+
+def createSyntheticDocument(frameCount, width, height, depth, breadth, keyframeDensity, colorDepth):
+    # A tree of group layers, "depth" levels deep with "breadth" children per group, where every
+    # leaf is a paint layer with keyframes placed every 1 / keyframeDensity frames.
+    document = InMemoryDocument(width, height, "RGBA", colorDepth, endTime=frameCount - 1, name="Benchmark")
+    keyframeInterval = max(1, round(1 / keyframeDensity)) if keyframeDensity > 0 else frameCount
+
+    # Frames are shared between layers, since only the number of keyframes affects the work done by the generator.
+    framePool = [createFramePixelData(width, height, colorDepth, seed) for seed in range(8)]
+
+    leafCount = 0
+    def createChildren(parent, level):
+        nonlocal leafCount
+        for index in range(breadth):
+            if level < depth:
+                group = InMemoryNode(f"Group {level}.{index}", "grouplayer")
+                parent.addChildNode(group, None)
+                createChildren(group, level + 1)
+            else:
+                keyframes = {time: framePool[(leafCount + time) % len(framePool)] for time in range(0, frameCount, keyframeInterval)}
+                parent.addChildNode(InMemoryNode(f"Layer {leafCount}", keyframes=keyframes), None)
+                leafCount += 1
+
+    createChildren(document.rootNode(), 1)
+    return document
+
+def runBenchmark(options):
+    document = createSyntheticDocument(options.frames, options.width, options.height, options.depth, options.breadth,
+                                       options.keyframe_density, options.color_depth)
+
+    counter = ApiCallCounter()
+    backend = counter.wrap(BenchmarkBackend(), "Backend")
+    instrumentation = ExportInstrumentation([LogSink()])
+    spritesheetGenerator = SpritesheetGenerator(backend, instrumentation)
+    phases = []
+
+    # Replace every phase of this generator with a version that measures it.
+    def measurePhase(name, method):
+        def measuredMethod(*arguments):
+            countsBefore = Counter(counter.counts)
+            if options.trace_memory:
+                tracemalloc.reset_peak()
+
+            startTime = time.perf_counter()
+            result = method(*arguments)
+            wallTime = time.perf_counter() - startTime
+
+            phases.append({
+                "name": name,
+                "wallTime": wallTime,
+                "apiCalls": dict(counter.counts - countsBefore),
+                "tracemallocPeak": tracemalloc.get_traced_memory()[1] if options.trace_memory else None,
+                "maxRss": _getMaxRss()
+            })
+            return result
+
+        return measuredMethod
+
+    for name in PHASES:
+        setattr(spritesheetGenerator, name, measurePhase(name, getattr(spritesheetGenerator, name)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        if options.trace_memory:
+            tracemalloc.start()
+
+        # The generator reports every step with print(), which is hidden while measuring.
+        log = io.StringIO()
+        startTime = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            spritesheetGenerator.configure(
+                str(Path(directory).joinpath("spritesheet.png")),
+                targetSpriteWidth=max(1, round(options.width * options.sprite_scale)),
+                targetSpriteHeight=max(1, round(options.height * options.sprite_scale)),
+                document=counter.wrap(document),
+                **getConfigureArguments(options))
+            spritesheetGenerator.export()
+
+        totalWallTime = time.perf_counter() - startTime
+        tracemallocPeak = None
+        if options.trace_memory:
+            tracemallocPeak = max([phase["tracemallocPeak"] for phase in phases] + [tracemalloc.get_traced_memory()[1]])
+            tracemalloc.stop()
+
+        outputSize = sum(path.stat().st_size for path in Path(directory).iterdir() if path.is_file())
+
+    return {
+        "totalWallTime": totalWallTime,
+        "apiCalls": dict(counter.counts),
+        "tracemallocPeak": tracemallocPeak,
+        "maxRss": _getMaxRss(),
+        "outputSize": outputSize,
+        "frameCounters": instrumentation.counters,
+        "phases": phases
+    }
+
+def _getMaxRss():
+    # Peak resident set size of the process in bytes. Linux reports it in kilobytes, macOS in bytes.
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(prog="spritesheetgenerator.benchmark", description="Measure spritesheet exports of synthetic documents.")
+    parser.add_argument("--frames", type=int, default=48, help="Number of frames in the animation")
+    parser.add_argument("--width", type=int, default=256, help="Width of the document")
+    parser.add_argument("--height", type=int, default=256, help="Height of the document")
+    parser.add_argument("--depth", type=int, default=2, help="Number of levels in the layer tree")
+    parser.add_argument("--breadth", type=int, default=4, help="Number of layers in each group of the layer tree")
+    parser.add_argument("--keyframe-density", type=float, default=0.25, help="Fraction of frames with a keyframe on each layer")
+    parser.add_argument("--color-depth", default="U8", choices=["U8", "U16", "F16", "F32"], help="Color depth of the document")
+    parser.add_argument("--sprite-scale", type=float, default=0.5, help="Size of the sprites relative to the document")
+    addExportArguments(parser)
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false", help="Don't trace Python memory allocations, which slows down the export")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of times the export is run")
+    parser.add_argument("--output", help="JSON file the results are written to. Defaults to the standard output.")
+    return parser
+
+def main(arguments=None):
+    options = createArgumentParser().parse_args(arguments)
+
+    runs = []
+    for index in range(options.repeat):
+        print(f"Running benchmark {index + 1} of {options.repeat}", file=sys.stderr)
+        runs.append(runBenchmark(options))
+        print(f"Export took {runs[-1]['totalWallTime']:.3f} s", file=sys.stderr)
+
+    results = {
+        "parameters": vars(options),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy.__version__ if numpy is not None else None
+        },
+        "runs": runs
+    }
+
+    if options.output is not None:
+        with open(options.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=4)
+
+        print(f"Benchmark results written to {options.output}", file=sys.stderr)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import struct
+
+# Without NumPy, floating point frames are converted one value at a time, which is a lot slower.
+from .optionalnumpy import numpy
+
+# Krita stores 8 and 16 bit RGBA pixels as BGRA, while floating point RGBA pixels are stored as RGBA.
+FLOAT_FORMATS = {"F16": "e", "F32": "f"}
+
+def isEightBitConversionSupported(colorModel, colorDepth):
+    return colorModel in ("RGBA", "GRAYA") and colorDepth in ("U8", "U16", "F16", "F32")
+
+def isLinearProfile(colorProfile):
+    # Krita's default profiles for floating point documents have a linear gamma, which is marked by "g10" in their name.
+    if colorProfile is None:
+        return False
+
+    return "g10" in colorProfile or "linear" in colorProfile.lower()
+
+def convertToEightBit(pixelData, colorModel, colorDepth, linear=False):
+    # Convert the pixels of a frame to 8 bits per channel, in the same layout as Krita's 8 bit pixels.
+    # Linear floating point colors are encoded with the sRGB transfer function, since 8 bits aren't enough for linear colors.
+    if colorDepth == "U8":
+        return pixelData
+
+    if colorDepth == "U16":
+        # 16 bit values are scaled to 8 bits and rounded, rather than keeping their high byte, which always rounds down.
+        if numpy is not None:
+            values = numpy.frombuffer(pixelData, dtype="<u2").astype(numpy.uint32)
+            return ((values * 255 + 32767) // 65535).astype(numpy.uint8).tobytes()
+
+        valueCount = len(pixelData) // 2
+        values = struct.unpack(f"<{valueCount}H", pixelData)
+        return bytes((value * 255 + 32767) // 65535 for value in values)
+
+    channelCount = 4 if colorModel == "RGBA" else 2
+    if numpy is not None:
+        values = numpy.frombuffer(pixelData, dtype="<" + FLOAT_FORMATS[colorDepth]).astype(numpy.float32).reshape(-1, channelCount)
+        values = numpy.nan_to_num(values)
+        if linear:
+            values[:, :-1] = _encodeSrgbArray(numpy.clip(values[:, :-1], 0.0, 1.0))
+
+        values = numpy.clip(numpy.rint(values * 255.0), 0, 255).astype(numpy.uint8)
+        if colorModel == "RGBA":
+            values = values[:, [2, 1, 0, 3]]
+
+        return values.tobytes()
+
+    valueCount = len(pixelData) // struct.calcsize(FLOAT_FORMATS[colorDepth])
+    values = struct.unpack(f"<{valueCount}{FLOAT_FORMATS[colorDepth]}", pixelData)
+    eightBitPixels = bytearray(valueCount)
+    for index, value in enumerate(values):
+        # Clamping before rounding also takes care of NaN and infinite values.
+        value = min(1.0, max(0.0, value))
+        if linear and index % channelCount != channelCount - 1:
+            value = _encodeSrgb(value)
+
+        eightBitPixels[index] = round(value * 255.0)
+
+    if colorModel == "RGBA":
+        # Swap the red and blue channels with strided slice assignments.
+        red = eightBitPixels[0::4]
+        eightBitPixels[0::4] = eightBitPixels[2::4]
+        eightBitPixels[2::4] = red
+
+    return bytes(eightBitPixels)
+
+def _encodeSrgb(value):
+    if value <= 0.0031308:
+        return value * 12.92
+
+    return 1.055 * (value ** (1.0 / 2.4)) - 0.055
+
+def _encodeSrgbArray(values):
+    return numpy.where(values <= 0.0031308, values * 12.92, 1.055 * numpy.power(values, 1.0 / 2.4) - 0.055)
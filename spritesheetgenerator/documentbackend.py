@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+
+class DocumentBackend(ABC):
+    # The host application that documents are opened, created and exported with.
+    #
+    # The documents returned by a backend follow the parts of Krita's Document API that the generator uses:
+    # clone(), scaleImage(), pixelData(), setCurrentTime(), currentTime(), refreshProjection(), waitForDone(),
+    # width(), height(), colorModel(), colorDepth(), colorProfile(), resolution(), fullClipRangeStartTime(),
+    # fullClipRangeEndTime(), topLevelNodes(), rootNode(), createNode(), setBatchmode(), setModified() and close().
+    #
+    # Their nodes follow the parts of Krita's Node API that the generator uses:
+    # name(), type(), visible(), animated(), hasKeyframeAtTime(), childNodes(), projectionPixelData(),
+    # setPixelData(), addChildNode() and remove().
+
+    @abstractmethod
+    def activeDocument(self):
+        pass
+
+    @abstractmethod
+    def openDocument(self, filePath):
+        pass
+
+    @abstractmethod
+    def createDocument(self, width, height, name, colorModel, colorDepth, colorProfile, resolution):
+        pass
+
+    @abstractmethod
+    def exportImage(self, document, filePath):
+        pass
+
+    def closeDocument(self, document):
+        # Set "modified" to false to prevent a popup from showing when closing the document
+        document.setModified(False)
+        document.close()
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from .pngfile import CompressedBand
+
+# Name of the directory, next to the exported spritesheets, that holds the cache.
+CACHE_DIRECTORY_NAME = ".spritesheetcache"
+
+# Once the cache grows beyond this size, the least recently used entries are removed.
+DEFAULT_MAX_CACHE_SIZE = 512 * 1024 * 1024
+
+class ExportCache():
+    # Stores the compressed rows of sprites of a previous export, along with the content hash and
+    # position of every frame in them. A row of sprites whose frames are all unchanged is copied from
+    # the cache instead of being composited and compressed again. The whole cache is discarded
+    # whenever the parameters that affect the layout of the spritesheet change.
+
+    def __init__(self, exportFilePath, layoutParameters, maxCacheSize=DEFAULT_MAX_CACHE_SIZE, log=print):
+        exportPath = Path(exportFilePath).resolve()
+        self.directory = exportPath.parent.joinpath(CACHE_DIRECTORY_NAME)
+        self.maxCacheSize = maxCacheSize
+        self.layoutParameters = layoutParameters
+        self.log = log
+
+        # Each exported file has its own cache entry.
+        key = hashlib.sha1(str(exportPath).encode("utf-8")).hexdigest()
+        self.metadataPath = self.directory.joinpath(key + ".json")
+        self.bandsPath = self.directory.joinpath(key + ".bands")
+        self.newBandsPath = self.directory.joinpath(key + ".bands.tmp")
+
+        self.cachedBands = {}
+        self.newBands = {}
+        self.cachedBandsFile = None
+        self.newBandsFile = None
+        self.newBandsSize = 0
+        self._load()
+
+    def getBand(self, bandIndex, frameHashes):
+        # Returns the compressed band if it was cached with exactly the same frames, otherwise None.
+        cachedBand = self.cachedBands.get(bandIndex)
+        if cachedBand is None or cachedBand["frameHashes"] != frameHashes:
+            return None
+
+        self.cachedBandsFile.seek(cachedBand["offset"])
+        return CompressedBand(self.cachedBandsFile.read(cachedBand["size"]), cachedBand["checksum"], cachedBand["length"])
+
+    def storeBand(self, bandIndex, frameHashes, cells, band):
+        if self.newBandsFile is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.newBandsFile = open(self.newBandsPath, "wb")
+
+        self.newBands[bandIndex] = {
+            "frameHashes": frameHashes,
+            "cells": cells,
+            "offset": self.newBandsSize,
+            "size": len(band.data),
+            "checksum": band.checksum,
+            "length": band.length
+        }
+
+        self.newBandsFile.write(band.data)
+        self.newBandsSize += len(band.data)
+
+    def save(self):
+        # Replace the previous entry with the bands stored during this export.
+        if self.cachedBandsFile is not None:
+            self.cachedBandsFile.close()
+            self.cachedBandsFile = None
+
+        if self.newBandsFile is None:
+            return
+
+        self.newBandsFile.close()
+        self.newBandsFile = None
+        os.replace(self.newBandsPath, self.bandsPath)
+
+        with open(self.metadataPath, "w") as metadataFile:
+            json.dump({"layoutParameters": self.layoutParameters, "bands": {str(index): band for index, band in self.newBands.items()}}, metadataFile)
+
+        self._evictEntries()
+
+    def discard(self):
+        # Keep the previous entry and throw away the bands stored during this export.
+        if self.cachedBandsFile is not None:
+            self.cachedBandsFile.close()
+            self.cachedBandsFile = None
+
+        if self.newBandsFile is not None:
+            self.newBandsFile.close()
+            self.newBandsFile = None
+            os.remove(self.newBandsPath)
+
+    def _load(self):
+        if not self.metadataPath.exists() or not self.bandsPath.exists():
+            return
+
+        try:
+            with open(self.metadataPath, "r") as metadataFile:
+                metadata = json.load(metadataFile)
+        except (OSError, ValueError):
+            self.log("Export cache is unreadable and will be rebuilt")
+            return
+
+        if metadata.get("layoutParameters") != self.layoutParameters:
+            self.log("Spritesheet layout changed, the export cache will be rebuilt")
+            return
+
+        self.cachedBands = {int(index): band for index, band in metadata["bands"].items()}
+        self.cachedBandsFile = open(self.bandsPath, "rb")
+
+        # Mark the entry as recently used.
+        os.utime(self.metadataPath)
+
+    def _evictEntries(self):
+        entries = []
+        totalSize = 0
+        for metadataPath in self.directory.glob("*.json"):
+            bandsPath = metadataPath.with_suffix(".bands")
+            size = metadataPath.stat().st_size + (bandsPath.stat().st_size if bandsPath.exists() else 0)
+            entries.append((metadataPath.stat().st_mtime, metadataPath, bandsPath, size))
+            totalSize += size
+
+        # Remove the least recently used entries first, but never the entry that was just written.
+        entries.sort()
+        for modifiedTime, metadataPath, bandsPath, size in entries:
+            if totalSize <= self.maxCacheSize:
+                break
+
+            if metadataPath == self.metadataPath:
+                continue
+
+            metadataPath.unlink()
+            if bandsPath.exists():
+                bandsPath.unlink()
+
+            totalSize -= size
+            self.log(f"Removed {metadataPath.stem} from the export cache")
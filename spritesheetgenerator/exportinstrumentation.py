@@ -0,0 +1,165 @@
+import json
+import time
+import contextlib
+
+class ExportCancelled(Exception):
+    # Raised by the generator when an export is cancelled between two frames.
+    pass
+
+class ExportSink():
+    # Receives the progress of an export. Every hook does nothing by default,
+    # so sinks only need to implement the hooks they are interested in.
+
+    def onLog(self, message):
+        pass
+
+    def onPhaseStarted(self, name):
+        pass
+
+    def onPhaseFinished(self, name, wallTime):
+        pass
+
+    def onFrameRendered(self, time, renderTime, byteCount, reused):
+        pass
+
+    def onRowsEncoded(self, rowCount, encodeTime):
+        pass
+
+    def onProgress(self, completedFrameCount, frameCount):
+        pass
+
+    def onExportFinished(self, counters, cancelled):
+        pass
+
+class LogSink(ExportSink):
+    # Prints every message, along with the duration of each phase and a summary of the frame counters.
+
+    def onLog(self, message):
+        print(message)
+
+    def onPhaseFinished(self, name, wallTime):
+        print(f"{name} took {wallTime:.3f} s")
+
+    def onExportFinished(self, counters, cancelled):
+        print(f"Rendered {counters['renderedFrames']} frames ({counters['pixelDataBytes']} bytes) in {counters['renderTime']:.3f} s, " +
+              f"reused {counters['reusedFrames']} held frames")
+        print(f"Encoded {counters['encodedRows']} rows in {counters['encodeTime']:.3f} s")
+
+class JsonTraceSink(ExportSink):
+    # Records phases, frames and encoded rows as a trace in the Trace Event Format,
+    # which can be opened in chrome://tracing or Perfetto. The file is written when the export finishes.
+
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.startTime = time.perf_counter()
+        self.events = []
+
+    def onLog(self, message):
+        self.events.append({"name": message, "cat": "log", "ph": "i", "s": "g", "ts": self._getTimestamp(0.0), "pid": 0, "tid": 0})
+
+    def onPhaseFinished(self, name, wallTime):
+        self._addCompleteEvent(name, "phase", wallTime, {})
+
+    def onFrameRendered(self, time, renderTime, byteCount, reused):
+        self._addCompleteEvent(f"Frame {time}", "frame", renderTime, {"time": time, "bytes": byteCount, "reused": reused})
+
+    def onRowsEncoded(self, rowCount, encodeTime):
+        self._addCompleteEvent(f"Encode {rowCount} rows", "encode", encodeTime, {"rows": rowCount})
+
+    def onExportFinished(self, counters, cancelled):
+        with open(self.filePath, "w") as traceFile:
+            json.dump({"traceEvents": self.events, "otherData": {"counters": counters, "cancelled": cancelled}}, traceFile)
+
+    def _addCompleteEvent(self, name, category, duration, arguments):
+        # Events are reported once they are finished, so they started "duration" seconds ago.
+        self.events.append({"name": name, "cat": category, "ph": "X", "ts": self._getTimestamp(duration), "dur": duration * 1e6,
+                            "pid": 0, "tid": 0, "args": arguments})
+
+    def _getTimestamp(self, duration):
+        return (time.perf_counter() - self.startTime - duration) * 1e6
+
+class ExportInstrumentation():
+    # Dispatches the progress of an export to every sink, keeps the per-frame counters
+    # and holds the cancellation flag, which the generator checks between frames.
+
+    def __init__(self, sinks=None):
+        self.sinks = sinks if sinks is not None else [LogSink()]
+        self.cancelled = False
+        self.frameCount = 0
+        self.completedFrameCount = 0
+        self.resetCounters()
+
+    def addSink(self, sink):
+        self.sinks.append(sink)
+
+    def resetCancelled(self):
+        # A cancel that arrived after the last check of an export doesn't carry over to the next one.
+        self.cancelled = False
+
+    def resetCounters(self):
+        self.counters = {
+            "renderedFrames": 0,
+            "reusedFrames": 0,
+            "renderTime": 0.0,
+            "pixelDataBytes": 0,
+            "encodedRows": 0,
+            "encodeTime": 0.0
+        }
+
+    def log(self, message):
+        for sink in self.sinks:
+            sink.onLog(message)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        for sink in self.sinks:
+            sink.onPhaseStarted(name)
+
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            wallTime = time.perf_counter() - startTime
+            for sink in self.sinks:
+                sink.onPhaseFinished(name, wallTime)
+
+    def setFrameCount(self, frameCount):
+        self.frameCount = frameCount
+        self.completedFrameCount = 0
+        self._reportProgress()
+
+    def frameRendered(self, time, renderTime, byteCount, reused):
+        if reused:
+            self.counters["reusedFrames"] += 1
+        else:
+            self.counters["renderedFrames"] += 1
+            self.counters["renderTime"] += renderTime
+            self.counters["pixelDataBytes"] += byteCount
+
+        for sink in self.sinks:
+            sink.onFrameRendered(time, renderTime, byteCount, reused)
+
+        self.completedFrameCount += 1
+        self._reportProgress()
+
+    def rowsEncoded(self, rowCount, encodeTime):
+        self.counters["encodedRows"] += rowCount
+        self.counters["encodeTime"] += encodeTime
+        for sink in self.sinks:
+            sink.onRowsEncoded(rowCount, encodeTime)
+
+    def exportFinished(self, cancelled):
+        for sink in self.sinks:
+            sink.onExportFinished(dict(self.counters), cancelled)
+
+    def cancel(self):
+        # Can be called at any time, e.g. from a sink or a button, and takes effect before the next frame.
+        self.cancelled = True
+
+    def checkCancelled(self):
+        if self.cancelled:
+            raise ExportCancelled("The export was cancelled")
+
+    def _reportProgress(self):
+        for sink in self.sinks:
+            sink.onProgress(self.completedFrameCount, self.frameCount)
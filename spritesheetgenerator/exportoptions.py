@@ -0,0 +1,48 @@
+from .spritesheetgenerator import parseSpriteVariants, OUTPUT_FILE_EXTENSIONS, DEFAULT_PNG_COMPRESSION_LEVEL
+from .pngfile import PNG_FILTER_TYPES
+
+# Command line options for the export options of the dialog, shared by the batch exporter and the benchmark.
+# The size of the sprites isn't included, since each command has its own default for it.
+
+def addExportArguments(parser):
+    parser.add_argument("--type", default="Rows", choices=["Rows", "Columns", "Horizontal Strip", "Vertical Strip", "Packed"], help="Spritesheet layout")
+    parser.add_argument("--padding", type=int, default=0, help="Padding around each sprite")
+    parser.add_argument("--filter", default="Auto", help="Filter used to resize sprites")
+    parser.add_argument("--extrude-padding", action="store_true", help="Fill the padding with the edge pixels of each sprite")
+    parser.add_argument("--resize-frames-individually", action="store_true", help="Resize each rendered frame instead of the whole document")
+    parser.add_argument("--variants", default="", help="Comma separated scale factors (e.g. 1,2,0.5) or sizes (e.g. 64x64) to also export the spritesheet at")
+    parser.add_argument("--include-empty-frames", dest="ignore_empty_frames", action="store_false", help="Include frames without keyframes")
+    parser.add_argument("--reuse-held-frames", action="store_true", help="Reuse the previous frame for frames without raster keyframes instead of rendering them again")
+    parser.add_argument("--merge-identical-frames", action="store_true", help="Store identical frames only once")
+    parser.add_argument("--power-of-two-size", action="store_true", help="Round the size of the spritesheet up to powers of two")
+    parser.add_argument("--max-page-size", type=int, default=0, help="Maximum width and height of each page of the spritesheet, 0 for unlimited")
+    parser.add_argument("--low-memory", action="store_true", help="Write the spritesheet one row of sprites at a time")
+    parser.add_argument("--output-format", default="PNG", choices=list(OUTPUT_FILE_EXTENSIONS), help="File format of the spritesheet")
+    parser.add_argument("--eight-bit", action="store_true", help="Convert frames to 8 bit as they are rendered")
+    parser.add_argument("--png-compression-level", type=int, default=DEFAULT_PNG_COMPRESSION_LEVEL, choices=range(10), metavar="{0-9}", help="Compression level of PNG files")
+    parser.add_argument("--png-filter", default="None", choices=list(PNG_FILTER_TYPES), help="Filter applied to each row of PNG files")
+    parser.add_argument("--layer-sheets", nargs="*", metavar="LAYER", help="Export a spritesheet for each of the named top-level layers, or for every visible top-level layer if no names are given")
+    parser.add_argument("--compression-threads", type=int, default=1, help="Number of threads used to compress the spritesheet")
+
+def getConfigureArguments(options):
+    # The keyword arguments of SpritesheetGenerator.configure for the parsed export options.
+    return {
+        "spritesheetType": options.type,
+        "ignoreEmptyFrames": options.ignore_empty_frames,
+        "spritePadding": options.padding,
+        "filterStrategy": options.filter,
+        "reuseHeldFrames": options.reuse_held_frames,
+        "deduplicateFrames": options.merge_identical_frames,
+        "powerOfTwoSize": options.power_of_two_size,
+        "streamToFile": options.low_memory,
+        "compressionWorkerCount": options.compression_threads,
+        "resizeFramesIndividually": options.resize_frames_individually,
+        "extrudePadding": options.extrude_padding,
+        "maxPageSize": options.max_page_size,
+        "spriteVariants": parseSpriteVariants(options.variants),
+        "convertToEightBit": options.eight_bit,
+        "outputFormat": options.output_format,
+        "pngCompressionLevel": options.png_compression_level,
+        "pngFilter": options.png_filter,
+        "nodeSheets": options.layer_sheets
+    }
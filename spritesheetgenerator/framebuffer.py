@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+# Functions operating on the raw pixel data of a single frame, as returned by Krita's pixelData().
+# Pixels are stored row by row, with the alpha channel always being the last channel of a pixel.
+
+Rect = namedtuple("Rect", ["x", "y", "width", "height"])
+
+def getContentBounds(pixelData, width, height, pixelSize, alphaSize):
+    # Find the smallest rectangle containing every pixel that isn't fully transparent.
+    # Returns None if the whole frame is transparent.
+    left = width
+    top = height
+    right = -1
+    bottom = -1
+
+    # Each byte of the alpha channel is checked as its own plane of bytes. Scanning is
+    # done with strip() on whole planes and rows, so no per-pixel work is done in Python.
+    for alphaByteOffset in range(pixelSize - alphaSize, pixelSize):
+        plane = pixelData[alphaByteOffset::pixelSize]
+
+        firstOpaqueIndex = len(plane) - len(plane.lstrip(b"\x00"))
+        if firstOpaqueIndex == len(plane):
+            continue
+
+        lastOpaqueIndex = len(plane.rstrip(b"\x00")) - 1
+        planeTop = firstOpaqueIndex // width
+        planeBottom = lastOpaqueIndex // width
+        top = min(top, planeTop)
+        bottom = max(bottom, planeBottom)
+
+        for row in range(planeTop, planeBottom + 1):
+            line = plane[row * width:(row + 1) * width]
+            remainder = line.lstrip(b"\x00")
+            if len(remainder) == 0:
+                continue
+
+            left = min(left, width - len(remainder))
+            right = max(right, len(line.rstrip(b"\x00")) - 1)
+
+    if right < 0:
+        return None
+
+    return Rect(left, top, right - left + 1, bottom - top + 1)
+
+def cropPixelData(pixelData, width, pixelSize, rect):
+    rowSize = width * pixelSize
+    cropRowSize = rect.width * pixelSize
+    rows = []
+    for row in range(rect.y, rect.y + rect.height):
+        start = row * rowSize + rect.x * pixelSize
+        rows.append(pixelData[start:start + cropRowSize])
+
+    return b"".join(rows)
+
+def expandCanvas(pixelData, width, height, pixelSize, newWidth, newHeight, x, y):
+    # Place the frame at (x, y) on a new, transparent canvas. Parts of the frame
+    # that fall outside of the new canvas are discarded.
+    canvas = bytearray(newWidth * newHeight * pixelSize)
+    sourceLeft = max(0, -x)
+    sourceRight = min(width, newWidth - x)
+    if sourceRight <= sourceLeft:
+        return bytes(canvas)
+
+    rowSize = (sourceRight - sourceLeft) * pixelSize
+    for row in range(max(0, -y), min(height, newHeight - y)):
+        sourceStart = (row * width + sourceLeft) * pixelSize
+        destinationStart = ((row + y) * newWidth + sourceLeft + x) * pixelSize
+        canvas[destinationStart:destinationStart + rowSize] = pixelData[sourceStart:sourceStart + rowSize]
+
+    return bytes(canvas)
+
+def resizePixelDataNearest(pixelData, width, height, pixelSize, newWidth, newHeight):
+    # Each row of the new frame is built once and reused for every destination row mapping to the same source row.
+    columnOffsets = [min(width - 1, (column * width) // newWidth) * pixelSize for column in range(newWidth)]
+    rows = []
+    lastSourceRow = -1
+    for row in range(newHeight):
+        sourceRow = min(height - 1, (row * height) // newHeight)
+        if sourceRow != lastSourceRow:
+            line = pixelData[sourceRow * width * pixelSize:(sourceRow + 1) * width * pixelSize]
+            resizedLine = b"".join(line[offset:offset + pixelSize] for offset in columnOffsets)
+            lastSourceRow = sourceRow
+
+        rows.append(resizedLine)
+
+    return b"".join(rows)
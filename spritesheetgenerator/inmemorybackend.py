@@ -0,0 +1,315 @@
+import copy
+import bisect
+from pathlib import Path
+from .documentbackend import DocumentBackend
+from .spritesheetatlas import SpritesheetAtlas
+from .framebuffer import expandCanvas
+from .resampling import resamplePixelData, isResamplingAvailable
+from .pngfile import PngWriter, readPng
+
+class InMemoryNode():
+    # A stand-in for a Krita node. Animated nodes hold the pixel data of each of their keyframes,
+    # and static nodes hold a single image. Pixel data always covers the whole document.
+
+    def __init__(self, name, nodeType="paintlayer", keyframes=None, pixelData=None, visible=True, children=None):
+        self.nodeName = name
+        self.nodeType = nodeType
+        self.keyframes = keyframes
+        self.staticPixelData = pixelData
+        self.isVisible = visible
+        self.children = []
+        self.parent = None
+        self.document = None
+
+        for child in children or []:
+            self.addChildNode(child, None)
+
+    def name(self):
+        return self.nodeName
+
+    def type(self):
+        return self.nodeType
+
+    def visible(self):
+        return self.isVisible
+
+    def setVisible(self, visible):
+        self.isVisible = visible
+
+    def animated(self):
+        return self.keyframes is not None
+
+    def hasKeyframeAtTime(self, time):
+        return self.keyframes is not None and time in self.keyframes
+
+    def childNodes(self):
+        return list(self.children)
+
+    def addChildNode(self, child, above):
+        # New nodes are placed on top of their siblings, unless a sibling to place them above is given.
+        child.parent = self
+        child._setDocument(self.document)
+        if above is not None and above in self.children:
+            self.children.insert(self.children.index(above) + 1, child)
+        else:
+            self.children.append(child)
+
+        return True
+
+    def remove(self):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+            self.parent = None
+
+        return True
+
+    def pixelData(self, x, y, width, height):
+        # Like Krita, only the node's own pixels are returned. Group layers don't have any pixels of their own.
+        if self.nodeType == "grouplayer":
+            return b""
+
+        return self.document._cropProjection(self._getPixelDataAtTime(self.document.currentTime()), x, y, width, height)
+
+    def projectionPixelData(self, x, y, width, height):
+        return self.document._cropProjection(self._getProjection(self.document.currentTime()), x, y, width, height)
+
+    def setPixelData(self, pixelData, x, y, width, height):
+        document = self.document
+        currentPixelData = self._getPixelDataAtTime(document.currentTime())
+        canvas = SpritesheetAtlas(document.width(), document.height(), document._getPixelSize())
+        if currentPixelData is not None:
+            canvas.pixels[:] = currentPixelData
+
+        canvas.blit(pixelData, x, y, width, height)
+
+        if self.keyframes is not None:
+            self.keyframes[document.currentTime()] = bytes(canvas.pixels)
+        else:
+            self.staticPixelData = bytes(canvas.pixels)
+
+        return True
+
+    def _setDocument(self, document):
+        self.document = document
+        for child in self.children:
+            child._setDocument(document)
+
+    def _getPixelDataAtTime(self, time):
+        if self.keyframes is None:
+            return self.staticPixelData
+
+        # Keyframes are held until the next keyframe.
+        times = sorted(self.keyframes)
+        index = bisect.bisect_right(times, time)
+        if index == 0:
+            return None
+
+        return self.keyframes[times[index - 1]]
+
+    def _getProjection(self, time):
+        # Layers are not blended together. The projection of a node is its own pixel data,
+        # or the projection of its top-most visible child that has any pixel data.
+        if not self.isVisible:
+            return None
+
+        pixelData = self._getPixelDataAtTime(time)
+        if pixelData is not None:
+            return pixelData
+
+        for child in reversed(self.children):
+            pixelData = child._getProjection(time)
+            if pixelData is not None:
+                return pixelData
+
+        return None
+
+    def _transformPixelData(self, transform):
+        if self.staticPixelData is not None:
+            self.staticPixelData = transform(self.staticPixelData)
+
+        if self.keyframes is not None:
+            for time in self.keyframes:
+                self.keyframes[time] = transform(self.keyframes[time])
+
+        for child in self.children:
+            child._transformPixelData(transform)
+
+class InMemoryDocument():
+    # A stand-in for a Krita document, which holds all of its pixel data in memory.
+    # The projection of the document can either be given explicitly for each keyframe,
+    # or it is taken from the top-most visible node that has any pixel data.
+
+    def __init__(self, width, height, colorModel="RGBA", colorDepth="U8", startTime=0, endTime=0, projectionKeyframes=None, name="Document"):
+        self.documentWidth = width
+        self.documentHeight = height
+        self.documentColorModel = colorModel
+        self.documentColorDepth = colorDepth
+        self.startTime = startTime
+        self.endTime = endTime
+        self.time = startTime
+        self.filePath = None
+        self.documentName = name
+        self.root = InMemoryNode("root", "grouplayer")
+        self.root._setDocument(self)
+        self.projection = InMemoryNode("projection", keyframes=projectionKeyframes) if projectionKeyframes is not None else None
+
+    def name(self):
+        return self.documentName
+
+    def fileName(self):
+        return self.filePath
+
+    def width(self):
+        return self.documentWidth
+
+    def height(self):
+        return self.documentHeight
+
+    def colorModel(self):
+        return self.documentColorModel
+
+    def colorDepth(self):
+        return self.documentColorDepth
+
+    def colorProfile(self):
+        return None
+
+    def resolution(self):
+        return 72
+
+    def fullClipRangeStartTime(self):
+        return self.startTime
+
+    def fullClipRangeEndTime(self):
+        return self.endTime
+
+    def currentTime(self):
+        return self.time
+
+    def setCurrentTime(self, time):
+        self.time = time
+
+    def rootNode(self):
+        return self.root
+
+    def topLevelNodes(self):
+        return self.root.childNodes()
+
+    def createNode(self, name, nodeType):
+        node = InMemoryNode(name, nodeType)
+        node._setDocument(self)
+        return node
+
+    def clone(self):
+        return copy.deepcopy(self)
+
+    def pixelData(self, x, y, width, height):
+        if self.projection is not None:
+            pixelData = self.projection._getPixelDataAtTime(self.time)
+        else:
+            pixelData = self.root._getProjection(self.time)
+
+        return self._cropProjection(pixelData, x, y, width, height)
+
+    def scaleImage(self, width, height, xResolution, yResolution, filterStrategy):
+        # Every frame is resized with the given filter, or with nearest neighbour sampling if the filter isn't available.
+        if not isResamplingAvailable(filterStrategy):
+            filterStrategy = "NearestNeighbor"
+
+        oldWidth = self.documentWidth
+        oldHeight = self.documentHeight
+        colorModel = self.documentColorModel
+        colorDepth = self.documentColorDepth
+        self._transformPixelData(lambda pixelData: resamplePixelData(pixelData, oldWidth, oldHeight, colorModel, colorDepth, width, height, filterStrategy))
+        self.documentWidth = width
+        self.documentHeight = height
+        return True
+
+    def refreshProjection(self):
+        pass
+
+    def waitForDone(self):
+        pass
+
+    def setBatchmode(self, batchmode):
+        pass
+
+    def setModified(self, modified):
+        pass
+
+    def close(self):
+        return True
+
+    def exportImage(self, filePath, exportConfiguration):
+        pngWriter = PngWriter(filePath, self.documentWidth, self.documentHeight, self.documentColorModel, self.documentColorDepth)
+        pngWriter.writeRows(self.pixelData(0, 0, self.documentWidth, self.documentHeight), self.documentHeight)
+        pngWriter.close()
+        return True
+
+    def _getPixelSize(self):
+        return SpritesheetAtlas.getPixelSize(self.documentColorModel, self.documentColorDepth)
+
+    def _cropProjection(self, pixelData, x, y, width, height):
+        if pixelData is None:
+            return bytes(width * height * self._getPixelSize())
+
+        if x == 0 and y == 0 and width == self.documentWidth and height == self.documentHeight:
+            return pixelData
+
+        # Areas outside of the document are transparent.
+        return expandCanvas(pixelData, self.documentWidth, self.documentHeight, self._getPixelSize(), width, height, -x, -y)
+
+    def _transformPixelData(self, transform):
+        if self.projection is not None:
+            self.projection._transformPixelData(transform)
+
+        self.root._transformPixelData(transform)
+
+class InMemoryBackend(DocumentBackend):
+    # A backend that doesn't require Krita, where every document is held in memory.
+
+    def __init__(self, activeDocument=None):
+        self.currentDocument = activeDocument
+
+    def activeDocument(self):
+        return self.currentDocument
+
+    def openDocument(self, filePath):
+        raise Exception(f"Documents can't be opened by the in-memory backend: {filePath}")
+
+    def createDocument(self, width, height, name, colorModel, colorDepth, colorProfile, resolution):
+        return InMemoryDocument(width, height, colorModel, colorDepth, name=name)
+
+    def exportImage(self, document, filePath):
+        document.exportImage(filePath, None)
+
+class ImageSequenceBackend(InMemoryBackend):
+    # A backend that opens a directory of PNG files as an animation, with one frame per file in alphabetical order.
+    # A single PNG file is opened as an animation with a single frame.
+
+    def openDocument(self, filePath):
+        path = Path(filePath)
+        if path.is_dir():
+            framePaths = sorted(path.glob("*.png"))
+        else:
+            framePaths = [path]
+
+        if len(framePaths) == 0:
+            raise Exception(f"No PNG files were found in: {filePath}")
+
+        keyframes = {}
+        for time, framePath in enumerate(framePaths):
+            width, height, colorModel, colorDepth, pixelData = readPng(framePath)
+            if time == 0:
+                documentFormat = (width, height, colorModel, colorDepth)
+            elif (width, height, colorModel, colorDepth) != documentFormat:
+                raise Exception(f"{framePath} doesn't have the same size and format as {framePaths[0]}")
+
+            keyframes[time] = pixelData
+
+        width, height, colorModel, colorDepth = documentFormat
+        document = InMemoryDocument(width, height, colorModel, colorDepth, endTime=len(framePaths) - 1, name=path.stem)
+        document.filePath = str(path)
+        document.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+        self.currentDocument = document
+        return document
@@ -0,0 +1,65 @@
+import bisect
+
+class KeyframeIndex():
+
+    # Node types whose content can change from one frame to the next without having keyframes of their own.
+    # Transform masks are animated through transform channels, which hasKeyframeAtTime() doesn't report.
+    UNKEYED_NODE_TYPES = ("clonelayer", "filterlayer", "filllayer", "filelayer", "transformmask")
+
+    def __init__(self, document, startTime, endTime):
+        self.startTime = startTime
+        self.endTime = endTime
+
+        # Sorted keyframe times of each top-level node (including all of its visible children),
+        # stored in the same order as the document's top-level nodes.
+        self.topLevelNodes = document.topLevelNodes()
+        self.topLevelNodeKeyframeTimes = []
+        self.hasUnkeyedContent = False
+
+        # Walk the node tree once, querying each node's visibility, children and keyframes a single time.
+        for node in self.topLevelNodes:
+            keyframeTimes = set()
+            self._collectKeyframeTimes(node, keyframeTimes)
+            self.topLevelNodeKeyframeTimes.append(sorted(keyframeTimes))
+
+        allKeyframeTimes = set()
+        for keyframeTimes in self.topLevelNodeKeyframeTimes:
+            allKeyframeTimes.update(keyframeTimes)
+
+        self.allKeyframeTimes = sorted(allKeyframeTimes)
+
+    def keyframeTimes(self):
+        # The distinct frames of the document, i.e. every time at which any visible node has a keyframe.
+        return self.allKeyframeTimes
+
+    def nodeKeyframeTimes(self, topLevelNodeIndex):
+        return self.topLevelNodeKeyframeTimes[topLevelNodeIndex]
+
+    def hasKeyframeBetween(self, startTime, endTime):
+        # Checks for a keyframe after startTime, up to and including endTime.
+        index = bisect.bisect_right(self.allKeyframeTimes, startTime)
+        return index < len(self.allKeyframeTimes) and self.allKeyframeTimes[index] <= endTime
+
+    def nodeHasKeyframeBetween(self, topLevelNodeIndex, startTime, endTime):
+        # Same as hasKeyframeBetween, for the keyframes of a single top-level node.
+        keyframeTimes = self.topLevelNodeKeyframeTimes[topLevelNodeIndex]
+        index = bisect.bisect_right(keyframeTimes, startTime)
+        return index < len(keyframeTimes) and keyframeTimes[index] <= endTime
+
+    def _collectKeyframeTimes(self, node, keyframeTimes):
+        # Hidden nodes, along with all of their children, do not contribute any frames.
+        if not node.visible():
+            return
+
+        if node.type() in KeyframeIndex.UNKEYED_NODE_TYPES:
+            self.hasUnkeyedContent = True
+
+        # Only animated nodes can have keyframes, which avoids querying
+        # every time in the clip range for static layers.
+        if node.animated():
+            for time in range(self.startTime, self.endTime + 1, 1):
+                if node.hasKeyframeAtTime(time):
+                    keyframeTimes.add(time)
+
+        for child in node.childNodes():
+            self._collectKeyframeTimes(child, keyframeTimes)
@@ -0,0 +1,24 @@
+import krita
+from .documentbackend import DocumentBackend
+
+class KritaBackend(DocumentBackend):
+
+    def __init__(self):
+        self.krita = krita.Krita.instance()
+
+    def activeDocument(self):
+        return self.krita.activeDocument()
+
+    def openDocument(self, filePath):
+        document = self.krita.openDocument(filePath)
+        if document is None:
+            raise Exception(f"Unable to open document: {filePath}")
+
+        document.setBatchmode(True)
+        return document
+
+    def createDocument(self, width, height, name, colorModel, colorDepth, colorProfile, resolution):
+        return self.krita.createDocument(width, height, name, colorModel, colorDepth, colorProfile, resolution)
+
+    def exportImage(self, document, filePath):
+        document.exportImage(filePath, krita.InfoObject())
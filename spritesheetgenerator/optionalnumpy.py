@@ -0,0 +1,6 @@
+# NumPy is optional, since it isn't bundled with every Krita installation.
+# Modules that use it import it from here and fall back to plain Python when it is None.
+try:
+    import numpy
+except ImportError:
+    numpy = None
@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+# Without NumPy, spritesheets can't be reduced to a palette.
+from .optionalnumpy import numpy
+
+# A palette of 8 bit BGRA colors, and the palette index of every pixel of an image.
+PalettedImage = namedtuple("PalettedImage", ["palette", "indices"])
+
+# A box of colors used by the median cut algorithm, along with the channel with the widest range of values.
+ColorBox = namedtuple("ColorBox", ["indices", "channel", "range"])
+
+def isPaletteAvailable():
+    return numpy is not None
+
+def createPalettedImage(pixelData, maxColorCount=256):
+    # Reduce 8 bit BGRA pixels to a palette of at most maxColorCount colors. Images with few enough colors
+    # get an exact palette, while the colors of other images are reduced with the median cut algorithm.
+    if numpy is None:
+        raise Exception("Reducing an image to a palette requires NumPy")
+
+    colors = numpy.frombuffer(pixelData, dtype="<u4").copy()
+
+    # Fully transparent pixels share a single color, whatever their color channels contain.
+    colors[(colors >> 24) == 0] = 0
+
+    uniqueColors, inverse, counts = numpy.unique(colors, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    if len(uniqueColors) <= maxColorCount:
+        return PalettedImage(uniqueColors.astype("<u4").tobytes(), inverse.astype(numpy.uint8).tobytes())
+
+    channels = uniqueColors.astype("<u4").view(numpy.uint8).reshape(-1, 4)
+    palette = numpy.zeros((maxColorCount, 4), dtype=numpy.uint8)
+    colorIndices = numpy.zeros(len(uniqueColors), dtype=numpy.uint8)
+
+    # Every color is mapped to the palette color of the box it ended up in.
+    boxes = _splitIntoBoxes(channels, counts, maxColorCount)
+    for index, box in enumerate(boxes):
+        palette[index] = numpy.rint(numpy.average(channels[box.indices], axis=0, weights=counts[box.indices]))
+        colorIndices[box.indices] = index
+
+    return PalettedImage(palette[:len(boxes)].tobytes(), colorIndices[inverse].tobytes())
+
+def _splitIntoBoxes(channels, counts, maxColorCount):
+    # Repeatedly split the box with the widest range of values in any channel,
+    # at the median of that channel weighted by the number of pixels of each color.
+    boxes = [_createBox(channels, numpy.arange(len(channels)))]
+    while len(boxes) < maxColorCount:
+        widestIndex = max(range(len(boxes)), key=lambda index: boxes[index].range)
+        box = boxes[widestIndex]
+        if box.range == 0:
+            break
+
+        order = box.indices[numpy.argsort(channels[box.indices, box.channel], kind="stable")]
+        weights = numpy.cumsum(counts[order])
+        split = int(numpy.searchsorted(weights, weights[-1] / 2)) + 1
+        split = min(max(split, 1), len(order) - 1)
+
+        boxes[widestIndex] = _createBox(channels, order[:split])
+        boxes.append(_createBox(channels, order[split:]))
+
+    return boxes
+
+def _createBox(channels, indices):
+    ranges = channels[indices].max(axis=0).astype(int) - channels[indices].min(axis=0)
+    channel = int(numpy.argmax(ranges))
+    return ColorBox(indices, channel, int(ranges[channel]))
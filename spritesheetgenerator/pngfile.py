@@ -0,0 +1,575 @@
+import os
+import zlib
+import struct
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Without NumPy, only the "None", "Sub" and "Up" filters are available.
+from .optionalnumpy import numpy
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG color types for each of the supported Krita color models.
+PNG_COLOR_TYPES = {"GRAYA": 4, "RGBA": 6}
+
+# PNG bit depths for each of the supported Krita color depths.
+PNG_BIT_DEPTHS = {"U8": 8, "U16": 16}
+
+# PNG filter types. Filters other than "None" store each byte as the difference from a
+# prediction based on its neighbours, which usually makes the image compress better.
+PNG_FILTER_TYPES = {"None": 0, "Sub": 1, "Up": 2, "Average": 3, "Paeth": 4}
+
+# PNG color type of images with a palette.
+PNG_PALETTE_COLOR_TYPE = 3
+
+# Amount of compressed data that is collected before it is written as an IDAT chunk.
+IDAT_CHUNK_SIZE = 1 << 16
+
+# Amount of uncompressed data in each independently compressed deflate block.
+# Blocks always have this size (except for the last one), so the output doesn't
+# depend on the number of workers or on how the rows were handed to the writer.
+DEFLATE_BLOCK_SIZE = 1 << 18
+
+# Size of the sliding window used by deflate, which is how much of the
+# previous block is used as the dictionary of the next one.
+DEFLATE_WINDOW_SIZE = 1 << 15
+
+def isSupportedColorSpace(colorModel, colorDepth):
+    return colorModel in PNG_COLOR_TYPES and colorDepth in PNG_BIT_DEPTHS
+
+def isPngFilterAvailable(filterName):
+    # The "Sub" and "Up" filters work on whole rows as integers, while the others need NumPy.
+    return filterName in ("None", "Sub", "Up") or (numpy is not None and filterName in PNG_FILTER_TYPES)
+
+def getPixelSize(colorModel, colorDepth):
+    channelCount = 4 if colorModel == "RGBA" else 2
+    channelSize = PNG_BIT_DEPTHS[colorDepth] // 8
+    return channelCount * channelSize
+
+def convertToPngPixels(pixelData, colorModel, colorDepth):
+    # Krita stores 8 and 16 bit RGBA pixels as little endian BGRA, while PNG expects big endian RGBA.
+    # Channels are reordered with strided slice assignments, which copy whole planes at once.
+    channelSize = PNG_BIT_DEPTHS[colorDepth] // 8
+    pixelSize = getPixelSize(colorModel, colorDepth)
+
+    if colorModel == "RGBA":
+        channelOrder = [2, 1, 0, 3]
+    else:
+        channelOrder = [0, 1]
+
+    # Skip the copy when the byte order already matches.
+    if channelSize == 1 and colorModel != "RGBA":
+        return pixelData
+
+    pngPixels = bytearray(len(pixelData))
+    for pngChannel, kritaChannel in enumerate(channelOrder):
+        for pngByte in range(channelSize):
+            kritaByte = channelSize - 1 - pngByte
+            pngOffset = pngChannel * channelSize + pngByte
+            kritaOffset = kritaChannel * channelSize + kritaByte
+            pngPixels[pngOffset::pixelSize] = pixelData[kritaOffset::pixelSize]
+
+    return pngPixels
+
+def _subtractBytes(minuend, subtrahend):
+    # Subtract every byte of a row from the matching byte of another row, modulo 256. Both rows are
+    # handled as big integers, using the borrow-free subtraction of packed bytes from Hacker's Delight.
+    length = len(minuend)
+    highBits = int.from_bytes(b"\x80" * length, "big")
+    first = int.from_bytes(minuend, "big")
+    second = int.from_bytes(subtrahend, "big")
+    difference = ((first | highBits) - (second & ~highBits)) ^ ((first ^ ~second) & highBits)
+    return difference.to_bytes(length, "big")
+
+def _filterRow(row, previousRow, filterType, bytesPerPixel):
+    if filterType == PNG_FILTER_TYPES["None"]:
+        return row
+    elif filterType == PNG_FILTER_TYPES["Sub"]:
+        return _subtractBytes(row, bytes(bytesPerPixel) + row[:-bytesPerPixel])
+    elif filterType == PNG_FILTER_TYPES["Up"]:
+        return _subtractBytes(row, previousRow)
+
+    current = numpy.frombuffer(row, dtype=numpy.uint8).astype(numpy.int16)
+    above = numpy.frombuffer(previousRow, dtype=numpy.uint8).astype(numpy.int16)
+    left = numpy.concatenate((numpy.zeros(bytesPerPixel, dtype=numpy.int16), current[:-bytesPerPixel]))
+    if filterType == PNG_FILTER_TYPES["Average"]:
+        prediction = (left + above) >> 1
+    else:
+        # Paeth picks whichever of the left, above and upper left bytes is closest to left + above - upper left.
+        aboveLeft = numpy.concatenate((numpy.zeros(bytesPerPixel, dtype=numpy.int16), above[:-bytesPerPixel]))
+        estimate = left + above - aboveLeft
+        leftDistance = numpy.abs(estimate - left)
+        aboveDistance = numpy.abs(estimate - above)
+        aboveLeftDistance = numpy.abs(estimate - aboveLeft)
+        prediction = numpy.where((leftDistance <= aboveDistance) & (leftDistance <= aboveLeftDistance), left,
+                                 numpy.where(aboveDistance <= aboveLeftDistance, above, aboveLeft))
+
+    return ((current - prediction) & 0xff).astype(numpy.uint8).tobytes()
+
+# A band of scanlines compressed independently of every other band,
+# along with the Adler-32 checksum and length of its uncompressed data.
+CompressedBand = namedtuple("CompressedBand", ["data", "checksum", "length"])
+
+ADLER32_BASE = 65521
+
+def combineAdler32(firstChecksum, secondChecksum, secondLength):
+    # The checksum of two pieces of data concatenated together, based on adler32_combine() from zlib.
+    remainder = secondLength % ADLER32_BASE
+    firstSum = firstChecksum & 0xffff
+    secondSum = (remainder * firstSum) % ADLER32_BASE
+    firstSum += (secondChecksum & 0xffff) + ADLER32_BASE - 1
+    secondSum += ((firstChecksum >> 16) & 0xffff) + ((secondChecksum >> 16) & 0xffff) + ADLER32_BASE - remainder
+    firstSum %= ADLER32_BASE
+    secondSum %= ADLER32_BASE
+    return firstSum | (secondSum << 16)
+
+def _getZlibHeader(compressionLevel):
+    # The header describes a deflate stream with a 32K window,
+    # along with a hint about the compression level that was used.
+    if compressionLevel < 2 and compressionLevel != -1:
+        levelFlag = 0
+    elif compressionLevel < 6 and compressionLevel != -1:
+        levelFlag = 1
+    elif compressionLevel == 6 or compressionLevel == -1:
+        levelFlag = 2
+    else:
+        levelFlag = 3
+
+    compressionMethod = 0x78
+    flags = levelFlag << 6
+    flags += 31 - ((compressionMethod * 256 + flags) % 31)
+    return bytes([compressionMethod, flags])
+
+def _getZlibTrailer(compressionLevel, checksum):
+    # Terminate the stream with an empty final block, followed by the checksum of the uncompressed data.
+    finalBlock = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+    return finalBlock + struct.pack(">I", checksum & 0xffffffff)
+
+def _deflateBlock(compressionLevel, block, dictionary):
+    # Compress a block as raw deflate data that ends on a byte boundary without being the final block,
+    # so that blocks compressed separately can be concatenated into a single stream.
+    if len(dictionary) > 0:
+        compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class ParallelDeflater():
+    # A drop-in replacement for zlib.compressobj() that compresses fixed size blocks on a pool of threads
+    # and stitches them into a single zlib stream. zlib releases the GIL while compressing, so the
+    # blocks are compressed in parallel. Each block is primed with the end of the previous block,
+    # which keeps the compression ratio close to compressing the data in a single pass.
+
+    def __init__(self, compressionLevel, workerCount):
+        self.compressionLevel = compressionLevel
+        self.workerCount = workerCount
+        self.executor = ThreadPoolExecutor(max_workers=workerCount)
+        self.pendingBlocks = deque()
+        self.buffer = bytearray()
+        self.dictionary = b""
+        self.checksum = zlib.adler32(b"")
+        self.headerWritten = False
+
+    def compress(self, data):
+        self.buffer += data
+        self.checksum = zlib.adler32(data, self.checksum)
+
+        while len(self.buffer) >= DEFLATE_BLOCK_SIZE:
+            self._submitBlock(bytes(self.buffer[:DEFLATE_BLOCK_SIZE]))
+            del self.buffer[:DEFLATE_BLOCK_SIZE]
+
+        # Limit the number of blocks in flight, which also limits memory usage.
+        output = [self._getHeader()]
+        while len(self.pendingBlocks) > 0 and (self.pendingBlocks[0].done() or len(self.pendingBlocks) > self.workerCount * 2):
+            output.append(self.pendingBlocks.popleft().result())
+
+        return b"".join(output)
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self._submitBlock(bytes(self.buffer))
+            self.buffer = bytearray()
+
+        output = [self._getHeader()]
+        while len(self.pendingBlocks) > 0:
+            output.append(self.pendingBlocks.popleft().result())
+
+        self.executor.shutdown()
+
+        output.append(_getZlibTrailer(self.compressionLevel, self.checksum))
+        return b"".join(output)
+
+    def cancel(self):
+        # Stop compressing without producing a stream, e.g. when the export is cancelled.
+        for pendingBlock in self.pendingBlocks:
+            pendingBlock.cancel()
+
+        self.pendingBlocks.clear()
+        self.executor.shutdown()
+
+    def _submitBlock(self, block):
+        self.pendingBlocks.append(self.executor.submit(_deflateBlock, self.compressionLevel, block, self.dictionary))
+        self.dictionary = block[-DEFLATE_WINDOW_SIZE:]
+
+    def _getHeader(self):
+        if self.headerWritten:
+            return b""
+
+        self.headerWritten = True
+        return _getZlibHeader(self.compressionLevel)
+
+class BandDeflater():
+    # A drop-in replacement for zlib.compressobj() that compresses each piece of data it is given
+    # independently of the others. Compressed bands don't depend on their neighbours, so they can
+    # be stored and stitched into a later stream without being compressed again.
+
+    def __init__(self, compressionLevel):
+        self.compressionLevel = compressionLevel
+        self.checksum = zlib.adler32(b"")
+        self.headerWritten = False
+
+    def compressBand(self, data):
+        return CompressedBand(_deflateBlock(self.compressionLevel, data, b""), zlib.adler32(data), len(data))
+
+    def appendBand(self, band):
+        self.checksum = combineAdler32(self.checksum, band.checksum, band.length)
+        return self._getHeader() + band.data
+
+    def compress(self, data):
+        if len(data) == 0:
+            return b""
+
+        return self.appendBand(self.compressBand(data))
+
+    def flush(self):
+        return self._getHeader() + _getZlibTrailer(self.compressionLevel, self.checksum)
+
+    def _getHeader(self):
+        if self.headerWritten:
+            return b""
+
+        self.headerWritten = True
+        return _getZlibHeader(self.compressionLevel)
+
+class PngWriter():
+    # Writes a PNG file incrementally, a band of rows at a time, so that the
+    # whole image never has to be held in memory at once.
+
+    def __init__(self, filePath, width, height, colorModel, colorDepth, compressionLevel=6, workerCount=1, independentBands=False, filterName="None", palette=None):
+        if not isSupportedColorSpace(colorModel, colorDepth):
+            raise Exception(f"Unsupported PNG color space: {colorModel} {colorDepth}")
+
+        if palette is not None and (colorModel != "RGBA" or colorDepth != "U8"):
+            raise Exception(f"Only RGBA U8 images can be written with a palette, not {colorModel} {colorDepth}")
+
+        if not isPngFilterAvailable(filterName):
+            raise Exception(f"The {filterName} PNG filter is not available")
+
+        self.width = width
+        self.height = height
+        self.colorModel = colorModel
+        self.colorDepth = colorDepth
+        self.palette = palette
+
+        # Images with a palette are written as a single palette index per pixel.
+        self.bytesPerPixel = 1 if palette is not None else getPixelSize(colorModel, colorDepth)
+        self.rowSize = width * self.bytesPerPixel
+        self.rowsWritten = 0
+        self.filterType = PNG_FILTER_TYPES[filterName]
+        self.independentBands = independentBands
+        self.previousRow = bytes(self.rowSize)
+        if independentBands:
+            self.compressor = BandDeflater(compressionLevel)
+        elif workerCount > 1:
+            self.compressor = ParallelDeflater(compressionLevel, workerCount)
+        else:
+            self.compressor = zlib.compressobj(compressionLevel)
+        self.pendingData = []
+        self.pendingSize = 0
+
+        self.filePath = filePath
+        self.file = open(filePath, "wb")
+        self.file.write(PNG_SIGNATURE)
+        if palette is None:
+            self._writeChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, PNG_BIT_DEPTHS[colorDepth], PNG_COLOR_TYPES[colorModel], 0, 0, 0))
+        else:
+            self._writeChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_PALETTE_COLOR_TYPE, 0, 0, 0))
+            self._writePalette(palette)
+
+    def writeRows(self, pixelData, rowCount):
+        # Write rows of pixels in Krita's pixel format, or rows of palette indices for images with a palette.
+
+        self._writeCompressedData(self.compressor.compress(self._createScanlines(pixelData, rowCount)))
+        self.rowsWritten += rowCount
+
+    def compressRows(self, pixelData, rowCount):
+        # Compress rows of pixels in Krita's pixel format without writing them, which is
+        # only available when the writer was created with independent bands.
+        return self.compressor.compressBand(self._createScanlines(pixelData, rowCount))
+
+    def writeCompressedRows(self, band, rowCount):
+        # Write rows that were previously compressed by compressRows(), possibly by another writer.
+        self._writeCompressedData(self.compressor.appendBand(band))
+        self.rowsWritten += rowCount
+
+    def writeEmptyRows(self, rowCount):
+        # Empty rows are fully transparent, which is all zeros in every supported format.
+        for row in range(rowCount):
+            self._writeCompressedData(self.compressor.compress(bytes(self.rowSize + 1)))
+
+        self.previousRow = bytes(self.rowSize)
+        self.rowsWritten += rowCount
+
+    def close(self):
+        if self.rowsWritten != self.height:
+            self.file.close()
+            raise Exception(f"PNG has {self.height} rows but {self.rowsWritten} were written")
+
+        self._writeCompressedData(self.compressor.flush())
+        self._flushPendingData()
+        self._writeChunk(b"IEND", b"")
+        self.file.close()
+
+    def abort(self):
+        # Stop writing and remove the incomplete file.
+        if isinstance(self.compressor, ParallelDeflater):
+            self.compressor.cancel()
+
+        self.file.close()
+        os.remove(self.filePath)
+
+    def _createScanlines(self, pixelData, rowCount):
+        if self.palette is None:
+            pngPixels = convertToPngPixels(pixelData, self.colorModel, self.colorDepth)
+        else:
+            pngPixels = pixelData
+
+        # Every row starts with its filter type, which is "None" unless another filter was chosen.
+        scanlines = bytearray((self.rowSize + 1) * rowCount)
+        if self.filterType == PNG_FILTER_TYPES["None"]:
+            for row in range(rowCount):
+                start = row * (self.rowSize + 1) + 1
+                scanlines[start:start + self.rowSize] = pngPixels[row * self.rowSize:(row + 1) * self.rowSize]
+
+            return scanlines
+
+        for row in range(rowCount):
+            rowPixels = bytes(pngPixels[row * self.rowSize:(row + 1) * self.rowSize])
+
+            # Independently compressed bands can be reused after the rows above them have changed,
+            # so the first row of a band can't be predicted from the row above it.
+            filterType = self.filterType
+            if row == 0 and self.independentBands and filterType != PNG_FILTER_TYPES["Sub"]:
+                filterType = PNG_FILTER_TYPES["Sub"]
+
+            start = row * (self.rowSize + 1)
+            scanlines[start] = filterType
+            scanlines[start + 1:start + 1 + self.rowSize] = _filterRow(rowPixels, self.previousRow, filterType, self.bytesPerPixel)
+            self.previousRow = rowPixels
+
+        return scanlines
+
+    def _writePalette(self, palette):
+        # The palette is made of BGRA colors, which are written as RGB colors along with their alpha values.
+        paletteColors = bytearray((len(palette) // 4) * 3)
+        paletteColors[0::3] = palette[2::4]
+        paletteColors[1::3] = palette[1::4]
+        paletteColors[2::3] = palette[0::4]
+        self._writeChunk(b"PLTE", bytes(paletteColors))
+        self._writeChunk(b"tRNS", bytes(palette[3::4]))
+
+    def _writeCompressedData(self, data):
+        if len(data) == 0:
+            return
+
+        self.pendingData.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= IDAT_CHUNK_SIZE:
+            self._flushPendingData()
+
+    def _flushPendingData(self):
+        if self.pendingSize == 0:
+            return
+
+        self._writeChunk(b"IDAT", b"".join(self.pendingData))
+        self.pendingData = []
+        self.pendingSize = 0
+
+    def _writeChunk(self, chunkType, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunkType)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunkType)) & 0xffffffff))
+
+def _unfilterScanlines(data, height, rowSize, bytesPerPixel):
+    if numpy is not None:
+        return _unfilterScanlinesWithNumpy(data, height, rowSize, bytesPerPixel)
+
+    pixels = bytearray(rowSize * height)
+    previousRow = bytearray(rowSize)
+    position = 0
+
+    for row in range(height):
+        filterType = data[position]
+        line = bytearray(data[position + 1:position + 1 + rowSize])
+        position += rowSize + 1
+
+        if filterType == 1:
+            for index in range(bytesPerPixel, rowSize):
+                line[index] = (line[index] + line[index - bytesPerPixel]) & 0xff
+        elif filterType == 2:
+            for index in range(rowSize):
+                line[index] = (line[index] + previousRow[index]) & 0xff
+        elif filterType == 3:
+            for index in range(rowSize):
+                left = line[index - bytesPerPixel] if index >= bytesPerPixel else 0
+                line[index] = (line[index] + ((left + previousRow[index]) >> 1)) & 0xff
+        elif filterType == 4:
+            for index in range(rowSize):
+                left = line[index - bytesPerPixel] if index >= bytesPerPixel else 0
+                up = previousRow[index]
+                upperLeft = previousRow[index - bytesPerPixel] if index >= bytesPerPixel else 0
+                estimate = left + up - upperLeft
+                distanceLeft = abs(estimate - left)
+                distanceUp = abs(estimate - up)
+                distanceUpperLeft = abs(estimate - upperLeft)
+                if distanceLeft <= distanceUp and distanceLeft <= distanceUpperLeft:
+                    predictor = left
+                elif distanceUp <= distanceUpperLeft:
+                    predictor = up
+                else:
+                    predictor = upperLeft
+                line[index] = (line[index] + predictor) & 0xff
+        elif filterType != 0:
+            raise Exception(f"Invalid PNG filter type: {filterType}")
+
+        pixels[row * rowSize:(row + 1) * rowSize] = line
+        previousRow = line
+
+    return pixels
+
+def _unfilterScanlinesWithNumpy(data, height, rowSize, bytesPerPixel):
+    scanlines = numpy.frombuffer(data, dtype=numpy.uint8, count=height * (rowSize + 1)).reshape(height, rowSize + 1)
+    filterTypes = scanlines[:, 0]
+    if (filterTypes > PNG_FILTER_TYPES["Paeth"]).any():
+        raise Exception(f"Invalid PNG filter type: {int(filterTypes.max())}")
+
+    # Without the Average and Paeth filters, every row only depends on the row above it, so rows are unfiltered
+    # one at a time. The Sub filter is a running sum of each channel, which wraps around like the filter does.
+    if not numpy.isin(filterTypes, (PNG_FILTER_TYPES["Average"], PNG_FILTER_TYPES["Paeth"])).any():
+        pixels = scanlines[:, 1:].copy()
+        for row in range(height):
+            if filterTypes[row] == PNG_FILTER_TYPES["Sub"]:
+                pixels[row] = numpy.cumsum(pixels[row].reshape(-1, bytesPerPixel), axis=0, dtype=numpy.uint8).reshape(-1)
+            elif filterTypes[row] == PNG_FILTER_TYPES["Up"] and row > 0:
+                pixels[row] += pixels[row - 1]
+
+        return pixels.tobytes()
+
+    # The Average and Paeth filters depend on the pixels to the left, above and to the upper left, which have all been
+    # unfiltered once every pixel on the previous diagonal has. The rows are skewed so that every diagonal becomes a
+    # column, with a border of zeros above and to the left, and each diagonal is unfiltered at once, choosing the
+    # predictor of every pixel from the filter of its row.
+    width = rowSize // bytesPerPixel
+    filtered = scanlines[:, 1:].reshape(height, width, bytesPerPixel)
+    skewedFiltered = numpy.zeros((height + width + 1, height + 1, bytesPerPixel), dtype=numpy.int16)
+    skewedPixels = numpy.zeros_like(skewedFiltered)
+    for row in range(height):
+        skewedFiltered[row + 2:row + 2 + width, row + 1] = filtered[row]
+
+    rowFilterTypes = filterTypes[:, None]
+    for diagonal in range(height + width - 1):
+        firstRow = max(0, diagonal - width + 1)
+        lastRow = min(height - 1, diagonal) + 1
+        left = skewedPixels[diagonal + 1, firstRow + 1:lastRow + 1]
+        above = skewedPixels[diagonal + 1, firstRow:lastRow]
+        aboveLeft = skewedPixels[diagonal, firstRow:lastRow]
+
+        estimate = left + above - aboveLeft
+        leftDistance = numpy.abs(estimate - left)
+        aboveDistance = numpy.abs(estimate - above)
+        aboveLeftDistance = numpy.abs(estimate - aboveLeft)
+        paeth = numpy.where((leftDistance <= aboveDistance) & (leftDistance <= aboveLeftDistance), left,
+                            numpy.where(aboveDistance <= aboveLeftDistance, above, aboveLeft))
+
+        predictor = numpy.choose(rowFilterTypes[firstRow:lastRow], (0, left, above, (left + above) >> 1, paeth))
+        skewedPixels[diagonal + 2, firstRow + 1:lastRow + 1] = (skewedFiltered[diagonal + 2, firstRow + 1:lastRow + 1] + predictor) & 0xff
+
+    pixels = numpy.empty((height, width, bytesPerPixel), dtype=numpy.uint8)
+    for row in range(height):
+        pixels[row] = skewedPixels[row + 2:row + 2 + width, row + 1]
+
+    return pixels.tobytes()
+
+def readPng(filePath):
+    # Read a non-interlaced PNG file and convert its pixels to Krita's pixel format.
+    # Returns the width, height, color model, color depth and pixel data of the image.
+    with open(filePath, "rb") as file:
+        data = file.read()
+
+    if data[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+        raise Exception(f"Not a PNG file: {filePath}")
+
+    position = len(PNG_SIGNATURE)
+    header = None
+    compressedData = []
+    palette = None
+    transparency = None
+    while position < len(data):
+        length, = struct.unpack(">I", data[position:position + 4])
+        chunkType = data[position + 4:position + 8]
+        chunkData = data[position + 8:position + 8 + length]
+        position += length + 12
+
+        if chunkType == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunkData)
+        elif chunkType == b"PLTE":
+            palette = chunkData
+        elif chunkType == b"tRNS":
+            transparency = chunkData
+        elif chunkType == b"IDAT":
+            compressedData.append(chunkData)
+        elif chunkType == b"IEND":
+            break
+
+    if header is None:
+        raise Exception(f"PNG file without an IHDR chunk: {filePath}")
+
+    width, height, bitDepth, colorType, compression, filterMethod, interlace = header
+    if interlace != 0:
+        raise Exception(f"Interlaced PNG files are not supported: {filePath}")
+
+    channelCounts = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+    if colorType not in channelCounts or bitDepth not in (8, 16) or (colorType == 3 and bitDepth != 8):
+        raise Exception(f"Unsupported PNG format (color type {colorType}, bit depth {bitDepth}): {filePath}")
+
+    channelSize = bitDepth // 8
+    bytesPerPixel = channelCounts[colorType] * channelSize
+    pixels = _unfilterScanlines(zlib.decompress(b"".join(compressedData)), height, width * bytesPerPixel, bytesPerPixel)
+    pixelCount = width * height
+    colorDepth = "U16" if bitDepth == 16 else "U8"
+
+    # Expand palette, RGB and grayscale images to formats with an alpha channel.
+    if colorType == 3:
+        colors = []
+        for index in range(len(palette) // 3):
+            alpha = transparency[index] if transparency is not None and index < len(transparency) else 0xff
+            colors.append(bytes([palette[index * 3 + 2], palette[index * 3 + 1], palette[index * 3], alpha]))
+
+        return width, height, "RGBA", "U8", b"".join(colors[index] for index in pixels)
+
+    if colorType == 2 or colorType == 0:
+        channelCount = channelCounts[colorType]
+        expandedPixels = bytearray(b"\xff" * (pixelCount * (channelCount + 1) * channelSize))
+        expandedPixelSize = (channelCount + 1) * channelSize
+        for byteOffset in range(channelCount * channelSize):
+            expandedPixels[byteOffset::expandedPixelSize] = pixels[byteOffset::bytesPerPixel]
+
+        pixels = expandedPixels
+        colorType = 6 if colorType == 2 else 4
+
+    colorModel = "RGBA" if colorType == 6 else "GRAYA"
+
+    # Converting from PNG to Krita's format is the same reordering of bytes as converting from Krita to PNG.
+    return width, height, colorModel, colorDepth, bytes(convertToPngPixels(pixels, colorModel, colorDepth))
@@ -0,0 +1,114 @@
+import os
+import struct
+
+# Without NumPy, pixels are premultiplied one at a time, which is a lot slower.
+from .optionalnumpy import numpy
+
+# Header of raw RGBA files: a magic number, the width and height of the image and a set of flags.
+# The pixel data starts right after the header, aligned to 16 bytes.
+RAW_RGBA_MAGIC = b"RGBA"
+RAW_RGBA_PREMULTIPLIED_ALPHA = 1
+
+# Flags of the DDS header describing an uncompressed 32 bit A8R8G8B8 texture.
+DDS_MAGIC = b"DDS "
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PITCH = 0x8
+DDSD_PIXELFORMAT = 0x1000
+DDPF_ALPHAPIXELS = 0x1
+DDPF_RGB = 0x40
+DDSCAPS_TEXTURE = 0x1000
+
+# Tables of each color value multiplied by every alpha value, created when first needed.
+_premultiplyTables = None
+
+def premultiplyPixels(pixelData):
+    # Convert 8 bit BGRA pixels to RGBA pixels with premultiplied alpha.
+    if numpy is not None:
+        pixels = numpy.frombuffer(pixelData, dtype=numpy.uint8).reshape(-1, 4).astype(numpy.uint16)
+        premultipliedPixels = numpy.empty(pixels.shape, dtype=numpy.uint8)
+        premultipliedPixels[:, :3] = (pixels[:, [2, 1, 0]] * pixels[:, 3:4] + 127) // 255
+        premultipliedPixels[:, 3] = pixels[:, 3]
+        return premultipliedPixels.tobytes()
+
+    global _premultiplyTables
+    if _premultiplyTables is None:
+        _premultiplyTables = [bytes((value * alpha + 127) // 255 for value in range(256)) for alpha in range(256)]
+
+    # Reorder the channels with strided slice assignments, then premultiply the pixels that aren't opaque.
+    premultipliedPixels = bytearray(len(pixelData))
+    premultipliedPixels[0::4] = pixelData[2::4]
+    premultipliedPixels[1::4] = pixelData[1::4]
+    premultipliedPixels[2::4] = pixelData[0::4]
+    premultipliedPixels[3::4] = pixelData[3::4]
+
+    for index, alpha in enumerate(pixelData[3::4]):
+        if alpha != 255:
+            table = _premultiplyTables[alpha]
+            offset = index * 4
+            premultipliedPixels[offset] = table[premultipliedPixels[offset]]
+            premultipliedPixels[offset + 1] = table[premultipliedPixels[offset + 1]]
+            premultipliedPixels[offset + 2] = table[premultipliedPixels[offset + 2]]
+
+    return bytes(premultipliedPixels)
+
+class UncompressedImageWriter():
+    # Writes 8 bit RGBA pixels without any compression, a band of rows at a time, in a layout
+    # that can be memory mapped and uploaded to the GPU without decoding it first.
+
+    def __init__(self, filePath, width, height):
+        self.width = width
+        self.height = height
+        self.rowSize = width * 4
+        self.rowsWritten = 0
+
+        self.filePath = filePath
+        self.file = open(filePath, "wb")
+        self.file.write(self._getHeader())
+
+    def writeRows(self, pixelData, rowCount):
+        # Write rows of pixels in Krita's pixel format.
+        self.file.write(self._convertPixels(pixelData))
+        self.rowsWritten += rowCount
+
+    def writeEmptyRows(self, rowCount):
+        # Empty rows are fully transparent, which is all zeros.
+        self.file.write(bytes(self.rowSize * rowCount))
+        self.rowsWritten += rowCount
+
+    def close(self):
+        self.file.close()
+        if self.rowsWritten != self.height:
+            raise Exception(f"Image has {self.height} rows but {self.rowsWritten} were written")
+
+    def abort(self):
+        # Stop writing and remove the incomplete file.
+        self.file.close()
+        os.remove(self.filePath)
+
+    def _getHeader(self):
+        return b""
+
+    def _convertPixels(self, pixelData):
+        return pixelData
+
+class RawRgbaWriter(UncompressedImageWriter):
+    # Writes RGBA pixels with premultiplied alpha after a 16 byte header.
+
+    def _getHeader(self):
+        return struct.pack("<4sIII", RAW_RGBA_MAGIC, self.width, self.height, RAW_RGBA_PREMULTIPLIED_ALPHA)
+
+    def _convertPixels(self, pixelData):
+        return premultiplyPixels(pixelData)
+
+class DdsWriter(UncompressedImageWriter):
+    # Writes an uncompressed DDS texture. Krita's 8 bit BGRA pixels are stored as they are,
+    # since they already match the A8R8G8B8 format when read as little endian 32 bit values.
+
+    def _getHeader(self):
+        return struct.pack("<4s7I44x8I5I", DDS_MAGIC,
+                           124, DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PITCH | DDSD_PIXELFORMAT,
+                           self.height, self.width, self.rowSize, 0, 0,
+                           32, DDPF_RGB | DDPF_ALPHAPIXELS, 0, 32, 0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000,
+                           DDSCAPS_TEXTURE, 0, 0, 0, 0)
@@ -0,0 +1,221 @@
+import math
+from collections import namedtuple
+
+PackResult = namedtuple("PackResult", ["width", "height", "positions"])
+PackedPage = namedtuple("PackedPage", ["width", "height", "indices", "positions"])
+
+# Largest sheet dimension that will be tried when searching for a power of two size.
+MAX_POWER_OF_TWO_SIZE = 1 << 16
+
+class SkylinePacker():
+    # Packs rectangles into a bin of a fixed size using the skyline bottom-left heuristic.
+    # The skyline is a list of [x, y, width] segments describing the top edge of the packed area.
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+
+    def insert(self, width, height):
+        bestIndex = -1
+        bestX = 0
+        bestY = 0
+        bestTop = None
+
+        for index in range(len(self.skyline)):
+            y = self._fit(index, width, height)
+            if y is None:
+                continue
+
+            # Prefer the position with the lowest top edge, then the left-most one.
+            top = y + height
+            if bestTop is None or top < bestTop or (top == bestTop and self.skyline[index][0] < bestX):
+                bestIndex = index
+                bestX = self.skyline[index][0]
+                bestY = y
+                bestTop = top
+
+        if bestIndex < 0:
+            return None
+
+        self._addSegment(bestIndex, bestX, bestY + height, width)
+        return (bestX, bestY)
+
+    def _fit(self, index, width, height):
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+
+        y = 0
+        remainingWidth = width
+        while remainingWidth > 0:
+            y = max(y, self.skyline[index][1])
+            if y + height > self.height:
+                return None
+
+            remainingWidth -= self.skyline[index][2]
+            index += 1
+
+        return y
+
+    def _addSegment(self, index, x, y, width):
+        self.skyline.insert(index, [x, y, width])
+
+        # Shrink or remove the segments now covered by the new one.
+        index += 1
+        while index < len(self.skyline):
+            segment = self.skyline[index]
+            overlap = x + width - segment[0]
+            if overlap <= 0:
+                break
+
+            segment[0] += overlap
+            segment[2] -= overlap
+            if segment[2] > 0:
+                break
+
+            del self.skyline[index]
+
+        # Merge neighbouring segments at the same height.
+        index = 0
+        while index < len(self.skyline) - 1:
+            if self.skyline[index][1] == self.skyline[index + 1][1]:
+                self.skyline[index][2] += self.skyline[index + 1][2]
+                del self.skyline[index + 1]
+            else:
+                index += 1
+
+def packRects(sizes, powerOfTwo):
+    # Packs (width, height) sizes into the smallest sheet that could be found.
+    # Returns the sheet size and the position of each size, in the same order as the given sizes.
+    # Empty sizes are positioned at the origin without taking up any space.
+    order = sorted((index for index in range(len(sizes)) if sizes[index][0] > 0 and sizes[index][1] > 0),
+                   key=lambda index: (-sizes[index][1], -sizes[index][0], index))
+
+    if len(order) == 0:
+        return PackResult(1, 1, [(0, 0)] * len(sizes))
+
+    maxWidth = max(sizes[index][0] for index in order)
+    maxHeight = max(sizes[index][1] for index in order)
+    area = sum(sizes[index][0] * sizes[index][1] for index in order)
+
+    if powerOfTwo:
+        return _packIntoSmallestPowerOfTwoSheet(sizes, order, maxWidth, maxHeight, area)
+    else:
+        return _packIntoSmallestSheet(sizes, order, maxWidth, area)
+
+def _pack(sizes, order, width, height):
+    packer = SkylinePacker(width, height)
+    positions = [(0, 0)] * len(sizes)
+    usedWidth = 0
+    usedHeight = 0
+
+    for index in order:
+        position = packer.insert(sizes[index][0], sizes[index][1])
+        if position is None:
+            return None
+
+        positions[index] = position
+        usedWidth = max(usedWidth, position[0] + sizes[index][0])
+        usedHeight = max(usedHeight, position[1] + sizes[index][1])
+
+    return PackResult(usedWidth, usedHeight, positions)
+
+def _packIntoSmallestSheet(sizes, order, maxWidth, area):
+    # Try a range of sheet widths with an unbounded height and keep the result with the smallest area,
+    # preferring the squarer sheet when two results have the same area.
+    totalWidth = sum(sizes[index][0] for index in order)
+    totalHeight = sum(sizes[index][1] for index in order)
+    squareWidth = math.sqrt(area)
+    candidateWidths = {maxWidth, totalWidth}
+    for step in range(10, 21):
+        candidateWidths.add(min(totalWidth, max(maxWidth, math.ceil(squareWidth * step / 10))))
+
+    bestResult = None
+    for width in sorted(candidateWidths):
+        result = _pack(sizes, order, width, totalHeight)
+        if bestResult is None or _isBetterSheet(result, bestResult):
+            bestResult = result
+
+    return bestResult
+
+def _packIntoSmallestPowerOfTwoSheet(sizes, order, maxWidth, maxHeight, area):
+    # Try power of two sheets from the smallest area upwards and keep the first one everything fits into.
+    candidates = []
+    width = _nextPowerOfTwo(maxWidth)
+    while width <= MAX_POWER_OF_TWO_SIZE:
+        height = max(_nextPowerOfTwo(maxHeight), _nextPowerOfTwo(math.ceil(area / width)))
+        while height <= MAX_POWER_OF_TWO_SIZE:
+            candidates.append((width, height))
+            height *= 2
+        width *= 2
+
+    candidates.sort(key=lambda size: (size[0] * size[1], max(size), size[0]))
+    for width, height in candidates:
+        result = _pack(sizes, order, width, height)
+        if result is not None:
+            return PackResult(width, height, result.positions)
+
+    raise Exception(f"Unable to fit all sprites in a spritesheet of {MAX_POWER_OF_TWO_SIZE} x {MAX_POWER_OF_TWO_SIZE} pixels")
+
+def _isBetterSheet(result, bestResult):
+    area = result.width * result.height
+    bestArea = bestResult.width * bestResult.height
+    if area != bestArea:
+        return area < bestArea
+
+    return abs(result.width - result.height) < abs(bestResult.width - bestResult.height)
+
+def _nextPowerOfTwo(value):
+    return 1 << max(0, math.ceil(math.log2(max(1, value))))
+
+def packRectsIntoPages(sizes, maxPageSize, powerOfTwo):
+    # Packs (width, height) sizes into as few pages as possible, where neither side of a page is larger than maxPageSize.
+    # Returns a list of pages, each with its size, the indices of the sizes placed on it and their positions.
+    # Empty sizes are placed on the first page at the origin without taking up any space.
+    order = sorted((index for index in range(len(sizes)) if sizes[index][0] > 0 and sizes[index][1] > 0),
+                   key=lambda index: (-sizes[index][1], -sizes[index][0], index))
+
+    # Pages are rounded up to powers of two, so they have to stay within the largest power of two that fits.
+    if powerOfTwo:
+        maxPageSize = 1 << (maxPageSize.bit_length() - 1)
+
+    for index in order:
+        if sizes[index][0] > maxPageSize or sizes[index][1] > maxPageSize:
+            raise Exception(f"A sprite of {sizes[index][0]} x {sizes[index][1]} pixels doesn't fit in a page of {maxPageSize} x {maxPageSize} pixels")
+
+    # Distribute the sizes between pages, placing each size on the first page with enough room left.
+    packers = []
+    pageIndices = []
+    for index in order:
+        for packer, indices in zip(packers, pageIndices):
+            if packer.insert(sizes[index][0], sizes[index][1]) is not None:
+                indices.append(index)
+                break
+        else:
+            packer = SkylinePacker(maxPageSize, maxPageSize)
+            packer.insert(sizes[index][0], sizes[index][1])
+            packers.append(packer)
+            pageIndices.append([index])
+
+    if len(pageIndices) == 0:
+        pageIndices.append([])
+
+    emptyIndices = [index for index in range(len(sizes)) if sizes[index][0] <= 0 or sizes[index][1] <= 0]
+    pageIndices[0].extend(emptyIndices)
+    emptyIndices = set(emptyIndices)
+
+    # Pack each page again on its own, which shrinks pages that aren't full. Pages that don't fit
+    # within the maximum size this way keep the layout they were given while being distributed.
+    pages = []
+    for indices in pageIndices:
+        pageSizes = [sizes[index] for index in indices]
+        result = packRects(pageSizes, powerOfTwo)
+        if result.width > maxPageSize or result.height > maxPageSize:
+            result = _pack(pageSizes, [position for position in range(len(indices)) if indices[position] not in emptyIndices], maxPageSize, maxPageSize)
+            if powerOfTwo:
+                result = PackResult(_nextPowerOfTwo(result.width), _nextPowerOfTwo(result.height), result.positions)
+
+        pages.append(PackedPage(result.width, result.height, indices, result.positions))
+
+    return pages
@@ -0,0 +1,165 @@
+import math
+import functools
+
+from .framebuffer import resizePixelDataNearest
+from .spritesheetatlas import SpritesheetAtlas
+
+# Without NumPy, frames can only be resized with nearest neighbour sampling.
+from .optionalnumpy import numpy
+
+# NumPy types for each of Krita's color depths.
+NUMPY_TYPES = {"U8": "uint8", "U16": "<u2", "F16": "<f2", "F32": "<f4"}
+
+def _boxKernel(x):
+    return 1.0 if -0.5 <= x < 0.5 else 0.0
+
+def _triangleKernel(x):
+    x = abs(x)
+    return 1.0 - x if x < 1.0 else 0.0
+
+def _hermiteKernel(x):
+    x = abs(x)
+    return (2.0 * x - 3.0) * x * x + 1.0 if x < 1.0 else 0.0
+
+def _bellKernel(x):
+    x = abs(x)
+    if x < 0.5:
+        return 0.75 - x * x
+    elif x < 1.5:
+        return 0.5 * (x - 1.5) * (x - 1.5)
+    return 0.0
+
+def _cubicKernel(b, c):
+    # The family of cubic filters described by Mitchell and Netravali.
+    def kernel(x):
+        x = abs(x)
+        if x < 1.0:
+            return ((12.0 - 9.0 * b - 6.0 * c) * x ** 3 + (-18.0 + 12.0 * b + 6.0 * c) * x ** 2 + (6.0 - 2.0 * b)) / 6.0
+        elif x < 2.0:
+            return ((-b - 6.0 * c) * x ** 3 + (6.0 * b + 30.0 * c) * x ** 2 + (-12.0 * b - 48.0 * c) * x + (8.0 * b + 24.0 * c)) / 6.0
+        return 0.0
+
+    return kernel
+
+def _lanczos3Kernel(x):
+    if x == 0.0:
+        return 1.0
+    if abs(x) >= 3.0:
+        return 0.0
+
+    return 3.0 * math.sin(math.pi * x) * math.sin(math.pi * x / 3.0) / (math.pi * math.pi * x * x)
+
+# The kernel and its support (radius) for each of Krita's filter strategies.
+FILTER_KERNELS = {
+    "Box": (_boxKernel, 0.5),
+    "Bilinear": (_triangleKernel, 1.0),
+    "Hermite": (_hermiteKernel, 1.0),
+    "Bell": (_bellKernel, 1.5),
+    "BSpline": (_cubicKernel(1.0, 0.0), 2.0),
+    "Mitchell": (_cubicKernel(1.0 / 3.0, 1.0 / 3.0), 2.0),
+    "Bicubic": (_cubicKernel(0.0, 0.5), 2.0),
+    "Lanczos3": (_lanczos3Kernel, 3.0)
+}
+
+def _getFilterName(filterStrategy):
+    # Like Krita, the automatic strategy uses bicubic filtering.
+    return "Bicubic" if filterStrategy == "Auto" else filterStrategy
+
+def isResamplingAvailable(filterStrategy):
+    filterName = _getFilterName(filterStrategy)
+    if filterName == "NearestNeighbor":
+        return True
+
+    return numpy is not None and filterName in FILTER_KERNELS
+
+def resamplePixelData(pixelData, width, height, colorModel, colorDepth, newWidth, newHeight, filterStrategy):
+    filterName = _getFilterName(filterStrategy)
+    if width == newWidth and height == newHeight:
+        return pixelData
+
+    if filterName == "NearestNeighbor":
+        return resizePixelDataNearest(pixelData, width, height, SpritesheetAtlas.getPixelSize(colorModel, colorDepth), newWidth, newHeight)
+
+    if not isResamplingAvailable(filterStrategy):
+        raise Exception(f"Resampling frames with the {filterStrategy} filter requires NumPy")
+
+    channelCount = SpritesheetAtlas.CHANNEL_COUNTS[colorModel]
+    pixels = numpy.frombuffer(pixelData, dtype=NUMPY_TYPES[colorDepth]).reshape(height, width, channelCount).astype(numpy.float32)
+
+    # Filter premultiplied colors, so that the colors of transparent pixels don't bleed into their neighbours.
+    # Every channel is multiplied at once, which is faster than a strided view of the colors, and alpha is restored after.
+    alpha = pixels[:, :, -1].copy()
+    if colorDepth in ("U8", "U16"):
+        pixels *= (alpha / float(numpy.iinfo(NUMPY_TYPES[colorDepth]).max))[:, :, None]
+    else:
+        pixels *= alpha[:, :, None]
+
+    pixels[:, :, -1] = alpha
+
+    # Resample each axis in turn. Only the few source pixels under the kernel contribute to each destination pixel,
+    # so the cost grows with the size of the frame times the width of the kernel.
+    pixels = _resampleAxis(pixels, 0, *_createWeights(height, newHeight, filterName))
+    pixels = _resampleAxis(pixels, 1, *_createWeights(width, newWidth, filterName))
+
+    resizedAlpha = pixels[:, :, -1:]
+    if colorDepth in ("U8", "U16"):
+        resizedAlpha = resizedAlpha / float(numpy.iinfo(NUMPY_TYPES[colorDepth]).max)
+
+    pixels[:, :, :-1] = numpy.divide(pixels[:, :, :-1], resizedAlpha, out=numpy.zeros_like(pixels[:, :, :-1]), where=resizedAlpha > 0)
+
+    if colorDepth in ("U8", "U16"):
+        limits = numpy.iinfo(NUMPY_TYPES[colorDepth])
+        pixels = numpy.clip(numpy.rint(pixels), limits.min, limits.max)
+
+    return pixels.astype(NUMPY_TYPES[colorDepth]).tobytes()
+
+def _resampleAxis(pixels, axis, indices, weights):
+    # Every destination pixel is the weighted sum of the source pixels at its indices, one tap at a time.
+    shape = [1, 1, 1]
+    shape[axis] = len(weights)
+    resampledPixels = None
+    for tap in range(weights.shape[1]):
+        contribution = numpy.take(pixels, indices[:, tap], axis=axis)
+        contribution *= weights[:, tap].reshape(shape)
+        if resampledPixels is None:
+            resampledPixels = contribution
+        else:
+            resampledPixels += contribution
+
+    return resampledPixels
+
+@functools.lru_cache(maxsize=32)
+def _createWeights(size, newSize, filterName):
+    # The source indices and weights of the pixels under the kernel, for every destination pixel.
+    # When shrinking, the kernel is stretched so that every source pixel contributes to the result.
+    # Weights only depend on the sizes and the filter, so they are reused by every frame of an export.
+    kernel, support = FILTER_KERNELS[filterName]
+    scale = newSize / size
+    filterScale = max(1.0, 1.0 / scale)
+
+    taps = []
+    for destination in range(newSize):
+        center = (destination + 0.5) / scale
+        first = max(0, int(math.floor(center - support * filterScale)))
+        last = min(size, int(math.ceil(center + support * filterScale)) + 1)
+        sourceWeights = [(source, kernel((source + 0.5 - center) / filterScale)) for source in range(first, last)]
+
+        # Sources outside of the kernel are left out, so that no time is spent on them.
+        sourceWeights = [(source, weight) for source, weight in sourceWeights if weight != 0.0]
+        if sum(weight for source, weight in sourceWeights) == 0.0:
+            # The kernel missed every source pixel, so fall back to the nearest one.
+            sourceWeights = [(min(size - 1, int(center)), 1.0)]
+
+        taps.append(sourceWeights)
+
+    # Destination pixels with fewer taps than others get taps with no weight.
+    tapCount = max(len(sourceWeights) for sourceWeights in taps)
+    indices = numpy.zeros((newSize, tapCount), dtype=numpy.intp)
+    weights = numpy.zeros((newSize, tapCount), dtype=numpy.float32)
+    for destination, sourceWeights in enumerate(taps):
+        total = sum(weight for source, weight in sourceWeights)
+        for tap, (source, weight) in enumerate(sourceWeights):
+            indices[destination, tap] = source
+            weights[destination, tap] = weight / total
+
+    return indices, weights
@@ -0,0 +1,66 @@
+class SpritesheetAtlas():
+
+    # Number of channels for each of Krita's color models.
+    CHANNEL_COUNTS = {"A": 1, "GRAYA": 2, "RGBA": 4, "XYZA": 4, "LABA": 4, "CMYKA": 5, "YCbCrA": 4}
+
+    # Number of bytes used by a single channel for each of Krita's color depths.
+    CHANNEL_SIZES = {"U8": 1, "U16": 2, "F16": 2, "F32": 4}
+
+    def __init__(self, width, height, pixelSize):
+        self.width = width
+        self.height = height
+        self.pixelSize = pixelSize
+
+        # A single preallocated buffer that every frame is copied into.
+        # New bytearrays are zero filled, which is fully transparent in all of Krita's color models.
+        self.pixels = bytearray(width * height * pixelSize)
+
+    @staticmethod
+    def getPixelSize(colorModel, colorDepth):
+        if colorModel not in SpritesheetAtlas.CHANNEL_COUNTS:
+            raise Exception(f"Unsupported color model: {colorModel}")
+        if colorDepth not in SpritesheetAtlas.CHANNEL_SIZES:
+            raise Exception(f"Unsupported color depth: {colorDepth}")
+
+        return SpritesheetAtlas.CHANNEL_COUNTS[colorModel] * SpritesheetAtlas.CHANNEL_SIZES[colorDepth]
+
+    def blit(self, pixelData, x, y, width, height):
+        # Copy the frame one row at a time into its cell.
+        # Each row is a single slice assignment, so no per-pixel work is done in Python.
+        source = memoryview(pixelData)
+        sourceRowSize = width * self.pixelSize
+        destinationRowSize = self.width * self.pixelSize
+
+        for row in range(height):
+            sourceStart = row * sourceRowSize
+            destinationStart = (y + row) * destinationRowSize + x * self.pixelSize
+            self.pixels[destinationStart:destinationStart + sourceRowSize] = source[sourceStart:sourceStart + sourceRowSize]
+
+    def extrude(self, x, y, width, height, size):
+        # Repeat the edge pixels of the frame at (x, y) outwards by the given number of pixels,
+        # so that texture filtering at the edges of a sprite samples the sprite instead of its neighbours.
+        # The extruded area has to fit inside the atlas.
+        if size <= 0 or width <= 0 or height <= 0:
+            return
+
+        rowSize = self.width * self.pixelSize
+        frameRowSize = width * self.pixelSize
+        left = x * self.pixelSize
+        for row in range(y, y + height):
+            start = row * rowSize + left
+            end = start + frameRowSize
+            self.pixels[start - size * self.pixelSize:start] = self.pixels[start:start + self.pixelSize] * size
+            self.pixels[end:end + size * self.pixelSize] = self.pixels[end - self.pixelSize:end] * size
+
+        # The top and bottom rows, including their extruded pixels, are copied to the rows above and below.
+        extrudedLeft = (x - size) * self.pixelSize
+        extrudedRowSize = (width + size * 2) * self.pixelSize
+        topStart = y * rowSize + extrudedLeft
+        bottomStart = (y + height - 1) * rowSize + extrudedLeft
+        topRow = self.pixels[topStart:topStart + extrudedRowSize]
+        bottomRow = self.pixels[bottomStart:bottomStart + extrudedRowSize]
+        for offset in range(1, size + 1):
+            start = topStart - offset * rowSize
+            self.pixels[start:start + extrudedRowSize] = topRow
+            start = bottomStart + offset * rowSize
+            self.pixels[start:start + extrudedRowSize] = bottomRow
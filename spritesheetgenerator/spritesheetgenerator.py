@@ -1,255 +1,1227 @@
-import krita
+import os
+import re
 import math
+import time
+import json
+import hashlib
 from pathlib import Path
 from collections import namedtuple
+from .spritesheetatlas import SpritesheetAtlas
+from .keyframeindex import KeyframeIndex
+from .framebuffer import getContentBounds, cropPixelData
+from .resampling import resamplePixelData, isResamplingAvailable
+from .rectpacker import packRects, packRectsIntoPages, PackedPage
+from .pngfile import PngWriter, PNG_FILTER_TYPES, isSupportedColorSpace, isPngFilterAvailable
+from .rawfile import RawRgbaWriter, DdsWriter
+from .palette import createPalettedImage, isPaletteAvailable
+from .colorconversion import convertToEightBit, isEightBitConversionSupported, isLinearProfile
+from .exportcache import ExportCache
+from .exportinstrumentation import ExportInstrumentation
+
+Position = namedtuple("Position", ["x", "y"])
+Cell = namedtuple("Cell", ["x", "y", "width", "height", "offsetX", "offsetY"])
+TrimmedFrame = namedtuple("TrimmedFrame", ["pixelData", "bounds"])
+
+# A single image of the spritesheet, with the cells placed on it and their positions.
+# Columns and rows are None for packed spritesheets.
+SpritesheetPage = namedtuple("SpritesheetPage", ["filePath", "width", "height", "columns", "rows", "cellIndices", "positions"])
+
+# A size that the sprites are exported at, in addition to others, and the suffix added to its file name.
+SpriteVariant = namedtuple("SpriteVariant", ["width", "height", "fileSuffix"])
+
+# A top-level node that is exported to its own spritesheet, along with its index among the top-level nodes
+# of the document, the times of the frames in its spritesheet and the file path of its spritesheet.
+NodeSheet = namedtuple("NodeSheet", ["node", "nodeIndex", "frameTimes", "filePath"])
+
+# Approximate amount of atlas pixel data handed to the PNG writer at a time.
+ATLAS_BAND_SIZE = 1 << 22
+
+# File extension of each of the output formats.
+OUTPUT_FILE_EXTENSIONS = {"PNG": ".png", "Indexed PNG": ".png", "Raw RGBA": ".rgba", "DDS": ".dds"}
+
+# Compression level used by Krita's PNG exporter.
+DEFAULT_PNG_COMPRESSION_LEVEL = 6
+
+def parseSpriteVariants(text):
+    # Parses a comma separated list of scale factors (e.g. "2, 0.5") and sizes (e.g. "64x64")
+    # into the sprite variants accepted by SpritesheetGenerator.configure.
+    spriteVariants = []
+    for item in text.split(","):
+        item = item.strip().lower()
+        if item == "":
+            continue
+
+        try:
+            if "x" in item:
+                width, height = item.split("x")
+                spriteVariants.append((int(width), int(height)))
+            else:
+                spriteVariants.append(float(item))
+        except ValueError:
+            raise Exception(f"Invalid sprite variant: {item}")
+
+    return spriteVariants
 
 class SpritesheetGenerator():
 
-    def __init__(self):
-        pass
+    def __init__(self, backend=None, instrumentation=None):
+        # The backend used to access documents. Krita is used by default.
+        self.backend = backend
 
-    def configure(self, exportFilePath, spritesheetType, ignoreEmptyFrames, targetSpriteWidth, targetSpriteHeight, spritePadding, filterStrategy):
+        # Receives the progress of exports and allows them to be cancelled. Messages are printed by default.
+        self.instrumentation = instrumentation if instrumentation is not None else ExportInstrumentation()
+
+    def configure(self, exportFilePath, spritesheetType, ignoreEmptyFrames, targetSpriteWidth, targetSpriteHeight, spritePadding, filterStrategy, reuseHeldFrames=False, deduplicateFrames=False, powerOfTwoSize=False, streamToFile=False, compressionWorkerCount=1, incrementalExport=False, resizeFramesIndividually=False, extrudePadding=False, maxPageSize=0, spriteVariants=None, convertToEightBit=False, outputFormat="PNG", pngCompressionLevel=DEFAULT_PNG_COMPRESSION_LEVEL, pngFilter="None", nodeSheets=None, document=None):
         self.exportFilePath = exportFilePath
         self.spritesheetType = spritesheetType
         self.ignoreEmptyFrames = ignoreEmptyFrames
-        self.targetSpriteWidth = targetSpriteWidth
-        self.targetSpriteHeight = targetSpriteHeight
         self.spritePadding = spritePadding
-        self.finalSpriteWidth = self.targetSpriteWidth + (self.spritePadding * 2)
-        self.finalSpriteHeight = self.targetSpriteHeight + (self.spritePadding * 2)
+        self._setSpriteSize(targetSpriteWidth, targetSpriteHeight)
         self.filterStrategy = filterStrategy
-        self.krita = krita.Krita.instance()
-        self.activeDocument = self.krita.activeDocument()
+        self.reuseHeldFrames = reuseHeldFrames
+        self.deduplicateFrames = deduplicateFrames
+        self.powerOfTwoSize = powerOfTwoSize
+        self.streamToFile = streamToFile
+        self.compressionWorkerCount = compressionWorkerCount
+        self.incrementalExport = incrementalExport
+        self.resizeFramesIndividually = resizeFramesIndividually
+        self.extrudePadding = extrudePadding
+        self.maxPageSize = maxPageSize
+        self.spriteVariants = self._getSpriteVariants(spriteVariants)
+        self.convertToEightBit = convertToEightBit
+        self.outputFormat = outputFormat
+        self.pngCompressionLevel = pngCompressionLevel
+        self.pngFilter = pngFilter
+        self.nodeSheetNames = nodeSheets
+        if self.nodeSheetNames is not None and len(self.spriteVariants) > 0:
+            raise Exception("Sprite variants can't be exported with one spritesheet per layer")
+
+        if self.backend is None:
+            from .kritabackend import KritaBackend
+            self.backend = KritaBackend()
+
+        # The given document is exported, or the backend's active document if none is given.
+        self.activeDocument = document if document is not None else self.backend.activeDocument()
         self.animationStartTime = self.activeDocument.fullClipRangeStartTime()
         self.animationEndTime = self.activeDocument.fullClipRangeEndTime()
+        self._configureOutputFormat()
 
-        print("Spritesheet generator configuration completed")
-        print(f"Export file path: {self.exportFilePath}")
-        print(f"Spritesheet type: {self.spritesheetType}")
-        print(f"Ignore empty frames: {self.ignoreEmptyFrames}")
-        print(f"Target width: {self.targetSpriteWidth}")
-        print(f"Target height: {self.targetSpriteHeight}")
-        print(f"Filter type: {self.filterStrategy}")
-        print(f"Animation start time: {self.animationStartTime}")
-        print(f"Animation end time: {self.animationEndTime}")
+        self.instrumentation.log("Spritesheet generator configuration completed")
+        self.instrumentation.log(f"Export file path: {self.exportFilePath}")
+        self.instrumentation.log(f"Spritesheet type: {self.spritesheetType}")
+        self.instrumentation.log(f"Ignore empty frames: {self.ignoreEmptyFrames}")
+        self.instrumentation.log(f"Target width: {self.targetSpriteWidth}")
+        self.instrumentation.log(f"Target height: {self.targetSpriteHeight}")
+        self.instrumentation.log(f"Filter type: {self.filterStrategy}")
+        self.instrumentation.log(f"Reuse held frames: {self.reuseHeldFrames}")
+        self.instrumentation.log(f"Deduplicate frames: {self.deduplicateFrames}")
+        self.instrumentation.log(f"Power of two size: {self.powerOfTwoSize}")
+        self.instrumentation.log(f"Stream to file: {self.streamToFile}")
+        self.instrumentation.log(f"Compression workers: {self.compressionWorkerCount}")
+        self.instrumentation.log(f"Incremental export: {self.incrementalExport}")
+        self.instrumentation.log(f"Resize frames individually: {self.resizeFramesIndividually}")
+        self.instrumentation.log(f"Extrude padding: {self.extrudePadding}")
+        self.instrumentation.log(f"Maximum page size: {self.maxPageSize}")
+        self.instrumentation.log(f"Sprite variants: {[f'{variant.width} x {variant.height}' for variant in self.spriteVariants]}")
+        self.instrumentation.log(f"Convert to 8 bit: {self.convertToEightBit}")
+        self.instrumentation.log(f"Output format: {self.outputFormat}")
+        self.instrumentation.log(f"PNG compression level: {self.pngCompressionLevel}")
+        self.instrumentation.log(f"PNG filter: {self.pngFilter}")
+        self.instrumentation.log(f"Layer spritesheets: {self.nodeSheetNames}")
+        self.instrumentation.log(f"Animation start time: {self.animationStartTime}")
+        self.instrumentation.log(f"Animation end time: {self.animationEndTime}")
 
     def export(self):
-        # Create a temporary duplicate of the currently active document.
-        # All transformations (such as resizing) will be done on this temporary document.
-        self._createTemporaryDocument()
+        # If needed, append the correct file extension, replacing the extension of another output format.
+        fileExtension = OUTPUT_FILE_EXTENSIONS[self.outputFormat]
+        exportPath = Path(self.exportFilePath)
+        if exportPath.suffix in OUTPUT_FILE_EXTENSIONS.values():
+            self.exportFilePath = str(exportPath.with_suffix(fileExtension))
+        elif exportPath.suffix != fileExtension:
+            self.exportFilePath += fileExtension
 
-        if self._isSpriteResizeRequired():
-            print("Sprites will be resized...")
-            self._resizeSprites()
+        self.sourceDocument = None
+        self.temporaryDocument = None
+        self.spritesheetDocument = None
+        self.imageWriter = None
+        self.exportCache = None
+        self.writtenFilePaths = []
+        self.spritesheetFilePath = self.exportFilePath
+        self.prerenderedFrames = None
+        self.variantFrames = None
+        self.nodeSheetFrames = None
+        self.instrumentation.resetCancelled()
+        self.instrumentation.resetCounters()
+
+        try:
+            self._exportSpritesheet()
+        except Exception as exception:
+            # Documents created by the export are closed whether it failed or was cancelled.
+            self.instrumentation.log(f"Export stopped: {exception}")
+            self._cleanUpAfterStoppedExport()
+            self.instrumentation.exportFinished(cancelled=self.instrumentation.cancelled)
+            raise
+
+        self.instrumentation.exportFinished(cancelled=False)
+
+    def _exportSpritesheet(self):
+        # With multiple variants, frames are rendered at the largest width and height of any of them, so that no variant is upsampled.
+        if len(self.spriteVariants) > 0:
+            self._setSpriteSize(max(variant.width for variant in self.spriteVariants), max(variant.height for variant in self.spriteVariants))
+
+        if self._canResizeFramesIndividually():
+            # Read every frame from the active document, resizing each frame on its own
+            # if needed, so the document doesn't need to be cloned or transformed.
+            self._useActiveDocumentAsSource()
+        else:
+            # Create a temporary duplicate of the currently active document, so that the frames
+            # are read in batch mode without changing the time shown by the active document.
+            # If needed, the whole document is resized, which has to be done on the temporary document.
+            with self.instrumentation.phase("Create temporary document"):
+                self._createTemporaryDocument()
+
+            if self._isSpriteResizeRequired():
+                self.instrumentation.log("Sprites will be resized...")
+                with self.instrumentation.phase("Resize sprites"):
+                    self._resizeSprites()
+
+        with self.instrumentation.phase("Create keyframe index"):
+            self._createKeyframeIndex()
+
+        if self.nodeSheetNames is not None:
+            self._exportNodeSheets()
+            return
+
+        if len(self.spriteVariants) == 0:
+            self._writeSpritesheet()
+            return
+
+        with self.instrumentation.phase("Render frames"):
+            self._renderSpriteVariantFrames()
+
+        self._releaseSourceDocument()
+
+        # Each variant is laid out and written on its own, reading its frames from memory.
+        for index, variant in enumerate(self.spriteVariants):
+            self._setSpriteSize(variant.width, variant.height)
+            self.spritesheetFilePath = self._getVariantFilePath(variant)
+            self.prerenderedFrames = self.variantFrames[index]
+            self.variantFrames[index] = None
+
+            self.instrumentation.log(f"Exporting {variant.width} x {variant.height} sprites to {self.spritesheetFilePath}")
+            self._writeSpritesheet()
+
+        self.prerenderedFrames = None
+
+    def _exportNodeSheets(self):
+        with self.instrumentation.phase("Render frames"):
+            self._renderNodeSheetFrames()
+
+        self._releaseSourceDocument()
+
+        # Each spritesheet is laid out and written on its own, reading the frames of its node from memory.
+        for index, nodeSheet in enumerate(self.nodeSheets):
+            self.spritesheetFilePath = nodeSheet.filePath
+            self.prerenderedFrames = self.nodeSheetFrames[index]
+            self.nodeSheetFrames[index] = None
+
+            self.instrumentation.log(f"Exporting the {nodeSheet.node.name()} layer to {self.spritesheetFilePath}")
+            self._writeSpritesheet()
+
+        self.prerenderedFrames = None
+
+    def _writeSpritesheet(self):
+        if self._canStreamToFile():
+            # Encode the spritesheet one row of sprites at a time instead of building it in memory.
+            with self.instrumentation.phase("Stream spritesheet to file"):
+                self._streamSpritesheetToFile()
+
+            self._releaseSourceDocument()
+        else:
+            with self.instrumentation.phase("Render frames"):
+                self._prepareSpritesheetCells()
+
+            self._writeSpritesheetPages()
+
+        # The spritesheets of layers can each have different frames, so they always get a frame map to keep them in sync.
+        if self.deduplicateFrames or self.spritesheetType == "Packed" or len(self.pages) > 1 or self.nodeSheetNames is not None:
+            self._exportFrameMapToFile()
+
+    def _cleanUpAfterStoppedExport(self):
+        # Incomplete files are removed, and the export cache keeps the entry of the previous export.
+        if self.imageWriter is not None:
+            self.imageWriter.abort()
+            self.imageWriter = None
+
+        if self.exportCache is not None:
+            self.exportCache.discard()
+            self.exportCache = None
+
+        # Files that were already written, such as other pages, frame maps and the spritesheets of other
+        # variants or layers, are removed as well, since the export is incomplete without the others.
+        for filePath in self.writtenFilePaths:
+            os.remove(filePath)
+
+        self.writtenFilePaths = []
+
+        self._releaseSourceDocument()
+
+        if self.spritesheetDocument is not None:
+            self._forceCloseDocument(self.spritesheetDocument)
+            self.spritesheetDocument = None
+
+    def _configureOutputFormat(self):
+        if self.outputFormat not in OUTPUT_FILE_EXTENSIONS:
+            raise Exception(f"Invalid output format provided: {self.outputFormat}")
+
+        if not 0 <= self.pngCompressionLevel <= 9:
+            raise Exception(f"Invalid PNG compression level provided: {self.pngCompressionLevel}")
+
+        if self.pngFilter not in PNG_FILTER_TYPES:
+            raise Exception(f"Invalid PNG filter provided: {self.pngFilter}")
+
+        colorModel = self.activeDocument.colorModel()
+        colorDepth = self.activeDocument.colorDepth()
+
+        # Formats other than PNG are always written as 8 bit RGBA pixels.
+        if self.outputFormat != "PNG":
+            if colorModel != "RGBA":
+                raise Exception(f"{self.outputFormat} files can only be exported from RGBA documents, not {colorModel} documents")
+
+            self.convertToEightBit = True
+
+        if self.convertToEightBit and not isEightBitConversionSupported(colorModel, colorDepth):
+            self.instrumentation.log(f"{colorModel} {colorDepth} documents can't be converted to 8 bits, the color depth of the document will be kept")
+            self.convertToEightBit = False
+
+        if self.outputFormat == "Indexed PNG" and not isPaletteAvailable():
+            self.instrumentation.log("Indexed PNG files require NumPy, the spritesheet will be exported as a PNG file")
+            self.outputFormat = "PNG"
+
+        if not isPngFilterAvailable(self.pngFilter):
+            self.instrumentation.log(f"The {self.pngFilter} PNG filter requires NumPy, no filter will be used")
+            self.pngFilter = "None"
+
+        # Color spaces that the generator can't encode itself are exported with Krita's PNG exporter, which doesn't have these options.
+        if self.outputFormat == "PNG" and not isSupportedColorSpace(colorModel, self._getOutputColorDepth()) and \
+            (self.pngFilter != "None" or self.pngCompressionLevel != DEFAULT_PNG_COMPRESSION_LEVEL):
+            self.instrumentation.log(f"PNG filters and compression levels aren't available for {colorModel} {self._getOutputColorDepth()} documents, Krita's default PNG options will be used")
+            self.pngFilter = "None"
+            self.pngCompressionLevel = DEFAULT_PNG_COMPRESSION_LEVEL
+
+        # Linear colors are encoded as sRGB when they are converted to 8 bits.
+        self.isLinearColor = colorDepth in ("F16", "F32") and isLinearProfile(self.activeDocument.colorProfile())
+
+    def _getOutputColorDepth(self):
+        # Frames are converted to 8 bits as soon as they are rendered, so the atlas is never built at a higher color depth.
+        return "U8" if self.convertToEightBit else self.activeDocument.colorDepth()
+
+    def _setSpriteSize(self, width, height):
+        self.targetSpriteWidth = width
+        self.targetSpriteHeight = height
+        self.finalSpriteWidth = self.targetSpriteWidth + (self.spritePadding * 2)
+        self.finalSpriteHeight = self.targetSpriteHeight + (self.spritePadding * 2)
+
+    def _getSpriteVariants(self, spriteVariants):
+        # Each variant is either a scale factor of the sprite size or a (width, height) tuple.
+        # The variant with the same size as the sprites keeps the export file path.
+        variants = []
+        for spriteVariant in spriteVariants or []:
+            if isinstance(spriteVariant, (tuple, list)):
+                width, height = spriteVariant
+                if width <= 0 or height <= 0:
+                    raise Exception(f"Invalid sprite variant size: {width} x {height}")
+
+                fileSuffix = f"_{width}x{height}"
+            else:
+                if spriteVariant <= 0:
+                    raise Exception(f"Invalid sprite variant scale: {spriteVariant}")
+
+                width = max(1, round(self.targetSpriteWidth * spriteVariant))
+                height = max(1, round(self.targetSpriteHeight * spriteVariant))
+                fileSuffix = f"@{spriteVariant:g}x"
+
+            if width == self.targetSpriteWidth and height == self.targetSpriteHeight:
+                fileSuffix = ""
+
+            if fileSuffix in [variant.fileSuffix for variant in variants]:
+                raise Exception(f"The sprite variant {spriteVariant} has the same file name as another variant")
+
+            variants.append(SpriteVariant(width, height, fileSuffix))
+
+        return variants
+
+    def _getVariantFilePath(self, variant):
+        exportPath = Path(self.exportFilePath)
+        return str(exportPath.with_name(f"{exportPath.stem}{variant.fileSuffix}{exportPath.suffix}"))
+
+    def _getVariantSources(self):
+        # Each variant is downsampled from the smallest variant that is at least as large on both axes,
+        # or from the rendered frame if there isn't any. Variants are returned in the order they have to be
+        # resampled in, along with the index of the variant they are resampled from, or None for the rendered frame.
+        variantOrder = sorted(range(len(self.spriteVariants)), key=lambda index: -self.spriteVariants[index].width * self.spriteVariants[index].height)
+        variantSources = []
+        for position, index in enumerate(variantOrder):
+            variant = self.spriteVariants[index]
+            largerIndices = [otherIndex for otherIndex in variantOrder[:position]
+                             if self.spriteVariants[otherIndex].width >= variant.width and self.spriteVariants[otherIndex].height >= variant.height]
+            sourceIndex = min(largerIndices, key=lambda otherIndex: self.spriteVariants[otherIndex].width * self.spriteVariants[otherIndex].height, default=None)
+            variantSources.append((index, sourceIndex))
+
+        return variantSources
+
+    def _renderSpriteVariantFrames(self):
+        # Render every frame once, at the largest width and height of the variants, and downsample it into every
+        # variant, reusing smaller variants where possible. Held frames share the pixel data of the frame they repeat.
+        self._findFrameTimes()
+
+        filterStrategy = "Box" if isResamplingAvailable("Box") else "NearestNeighbor"
+        variantSources = self._getVariantSources()
+        self.variantFrames = [{} for variant in self.spriteVariants]
+
+        previousPixelData = None
+        previousFrameTime = None
+        for frameTime in self.frameTimes:
+            pixelData = self._renderFrame(frameTime)
+
+            if pixelData is previousPixelData:
+                for frames in self.variantFrames:
+                    frames[frameTime] = frames[previousFrameTime]
+            else:
+                for index, sourceIndex in variantSources:
+                    if sourceIndex is None:
+                        sourcePixelData = pixelData
+                        sourceWidth = self.targetSpriteWidth
+                        sourceHeight = self.targetSpriteHeight
+                    else:
+                        sourcePixelData = self.variantFrames[sourceIndex][frameTime]
+                        sourceWidth = self.spriteVariants[sourceIndex].width
+                        sourceHeight = self.spriteVariants[sourceIndex].height
+
+                    variant = self.spriteVariants[index]
+                    self.variantFrames[index][frameTime] = resamplePixelData(sourcePixelData, sourceWidth, sourceHeight, self.activeDocument.colorModel(),
+                                                                             self._getOutputColorDepth(), variant.width, variant.height, filterStrategy)
+
+            previousPixelData = pixelData
+            previousFrameTime = frameTime
+
+        self.instrumentation.log(f"Rendered {len(self.frameTimes)} frames for {len(self.spriteVariants)} sprite variants")
+
+    def _getNodeSheets(self):
+        # The named top-level nodes of the document that frames are read from, or every visible one if no names are given.
+        topLevelNodes = self.keyframeIndex.topLevelNodes
+        if len(self.nodeSheetNames) > 0:
+            nodeIndices = []
+            for name in self.nodeSheetNames:
+                matchingIndices = [index for index, node in enumerate(topLevelNodes) if node.name() == name]
+                if len(matchingIndices) == 0:
+                    raise Exception(f"The document doesn't have a top-level layer named {name}")
+                elif len(matchingIndices) > 1:
+                    raise Exception(f"The document has more than one top-level layer named {name}")
+
+                nodeIndices.append(matchingIndices[0])
+        else:
+            nodeIndices = [index for index, node in enumerate(topLevelNodes) if node.visible()]
+
+        exportPath = Path(self.exportFilePath)
+        nodeSheets = []
+        for nodeIndex in nodeIndices:
+            node = topLevelNodes[nodeIndex]
+            if not self.ignoreEmptyFrames:
+                frameTimes = list(range(self.animationStartTime, self.animationEndTime + 1, 1))
+            else:
+                # Nodes without any keyframes don't change, so a single frame is exported for them.
+                frameTimes = self.keyframeIndex.nodeKeyframeTimes(nodeIndex) or [self.animationStartTime]
+
+            # Characters that can't be used in file names are replaced.
+            fileName = re.sub(r"[^\w\-. ]", "_", node.name())
+            filePath = str(exportPath.with_name(f"{exportPath.stem}_{fileName}{exportPath.suffix}"))
+            if filePath in [nodeSheet.filePath for nodeSheet in nodeSheets]:
+                raise Exception(f"The {node.name()} layer has the same file name as another layer")
+
+            nodeSheets.append(NodeSheet(node, nodeIndex, frameTimes, filePath))
+
+        if len(nodeSheets) == 0:
+            raise Exception("The document doesn't have any visible top-level layers to export")
+
+        return nodeSheets
+
+    def _renderNodeSheetFrames(self):
+        # Make a single pass over the timeline, reading the pixel data of every selected node at each time.
+        # Each node only keeps the frames of its own spritesheet, and a node without a keyframe since
+        # its previous frame reuses that frame instead of being read again.
+        self.nodeSheets = self._getNodeSheets()
+        self.nodeSheetFrames = [{} for nodeSheet in self.nodeSheets]
+        nodeFrameTimes = [set(nodeSheet.frameTimes) for nodeSheet in self.nodeSheets]
+        lastRenderedTimes = [None for nodeSheet in self.nodeSheets]
+
+        frameTimes = sorted(set().union(*nodeFrameTimes))
+        self.instrumentation.setFrameCount(len(frameTimes))
+
+        width = self.sourceDocument.width()
+        height = self.sourceDocument.height()
+        for frameTime in frameTimes:
+            self.instrumentation.checkCancelled()
+
+            startTime = time.perf_counter()
+            byteCount = 0
+            isTimeRendered = False
+            for index, nodeSheet in enumerate(self.nodeSheets):
+                if frameTime not in nodeFrameTimes[index]:
+                    continue
+
+                frames = self.nodeSheetFrames[index]
+                lastRenderedTime = lastRenderedTimes[index]
+                if lastRenderedTime is not None and self.canReuseHeldFrames and \
+                    not self.keyframeIndex.nodeHasKeyframeBetween(nodeSheet.nodeIndex, lastRenderedTime, frameTime):
+                    frames[frameTime] = frames[lastRenderedTime]
+                    continue
+
+                # The document is only moved to a time once, however many nodes are read at it.
+                if not isTimeRendered:
+                    self.sourceDocument.setCurrentTime(frameTime)
+                    self.sourceDocument.refreshProjection()
+                    self.sourceDocument.waitForDone()
+                    isTimeRendered = True
+
+                # The projection includes the children of group layers and the masks of the node.
+                pixelData = bytes(nodeSheet.node.projectionPixelData(0, 0, width, height))
+                self._checkPixelDataSize(pixelData, width, height)
+                byteCount += len(pixelData)
+                frames[frameTime] = self._processRenderedFrame(pixelData, width, height)
+                lastRenderedTimes[index] = frameTime
+
+            self.instrumentation.frameRendered(frameTime, time.perf_counter() - startTime, byteCount, not isTimeRendered)
+
+        self.instrumentation.log(f"Rendered {len(frameTimes)} frames for {len(self.nodeSheets)} layers")
+
+    def _canResizeFramesIndividually(self):
+        if not self.resizeFramesIndividually:
+            return False
+
+        if not isResamplingAvailable(self.filterStrategy):
+            self.instrumentation.log(f"Frames can't be resized individually with the {self.filterStrategy} filter without NumPy, the document will be resized instead")
+            return False
+
+        return True
+
+    def _useActiveDocumentAsSource(self):
+        self.sourceDocument = self.activeDocument
+        self.temporaryDocument = None
+        self.originalTime = self.activeDocument.currentTime()
+        self._resetRenderedFrames()
+
+        self.instrumentation.log("Frames will be read from the active document")
 
-        if self.spritePadding > 0:
-            print("Adding padding to spritesheet frames...")
-            self._applyPaddingToSprites()
-        
-        self._createSpritesheetDocumentFromFrames()
-        self._positionFramesInSpritesheetDocument()
-        self._forceCloseDocument(self.temporaryDocument)
-        self._exportToFile()
-        self._forceCloseDocument(self.spritesheetDocument)
-        
     def _createTemporaryDocument(self):
         self.temporaryDocument = self.activeDocument.clone()
+        self.sourceDocument = self.temporaryDocument
+        self._resetRenderedFrames()
         self.temporaryDocument.setBatchmode(True)
         
-        print("Temporary document created")
+        self.instrumentation.log("Temporary document created")
+
+    def _resetRenderedFrames(self):
+        self.lastRenderedFrame = None
+        self.lastRenderedTime = None
+        self.lastHashedFrame = None
+
+    def _releaseSourceDocument(self):
+        # The temporary document is closed, while the active document is returned to the frame it was showing.
+        if self.sourceDocument is None:
+            return
+
+        if self.temporaryDocument is not None:
+            self._forceCloseDocument(self.temporaryDocument)
+            self.temporaryDocument = None
+        else:
+            self.activeDocument.setCurrentTime(self.originalTime)
+            self.activeDocument.refreshProjection()
+
+        self.sourceDocument = None
 
     def _isSpriteResizeRequired(self):
-        return self.temporaryDocument.width() != self.targetSpriteWidth or self.temporaryDocument.height() != self.targetSpriteHeight
+        return self.activeDocument.width() != self.targetSpriteWidth or self.activeDocument.height() != self.targetSpriteHeight
     
     def _resizeSprites(self):
         self.temporaryDocument.scaleImage(self.targetSpriteWidth, self.targetSpriteHeight, self.targetSpriteWidth, self.targetSpriteHeight, self.filterStrategy)
         self.temporaryDocument.refreshProjection()
 
-        print(f"Sprites resized to {self.temporaryDocument.width()} x {self.temporaryDocument.height()}")
+        self.instrumentation.log(f"Sprites resized to {self.temporaryDocument.width()} x {self.temporaryDocument.height()}")
 
-    def _applyPaddingToSprites(self):
-        # Remove excess pixels that are beyond the bounds of the visible portion of the document.
-        self.temporaryDocument.crop(0, 0, self.temporaryDocument.width(), self.temporaryDocument.height())
+    def _createKeyframeIndex(self):
+        # Scan the node tree of the document that frames are read from once
+        # to find which frames in the clip range are distinct.
+        self.keyframeIndex = KeyframeIndex(self.sourceDocument, self.animationStartTime, self.animationEndTime)
 
-        # Adjust document offset and size to apply padding.
-        self.temporaryDocument.setXOffset(-self.spritePadding)
-        self.temporaryDocument.setYOffset(-self.spritePadding)
-        self.temporaryDocument.setWidth(self.temporaryDocument.width() + (self.spritePadding * 2))
-        self.temporaryDocument.setHeight(self.temporaryDocument.height() + (self.spritePadding * 2))
-        self.temporaryDocument.refreshProjection()
+        self.instrumentation.log(f"Keyframe index created with {len(self.keyframeIndex.keyframeTimes())} keyframes")
 
-        print(f"Padding applied. New document size is {self.temporaryDocument.width()} x {self.temporaryDocument.height()}")
-
-    def _createSpritesheetDocumentFromFrames(self):
-        if not self.ignoreEmptyFrames:
-            frameCount = (self.animationEndTime + 1) - self.animationStartTime
-            print(f"Adding {frameCount} frames to the spritesheet document")
-            
-            size = self._getSpritesheetSize(frameCount)
-            self._createSpritesheetDocument(size.columns, size.rows)
-
-            # Convert all frames to spritesheet layers
-            for time in range(self.animationStartTime, self.animationEndTime + 1, 1):
-                self.temporaryDocument.setCurrentTime(time)
-                self.temporaryDocument.refreshProjection()
-                self._convertCurrentFrameToSpritesheetLayer()
+        # Clone layers, filter layers, etc. can change between frames without having any keyframes,
+        # in which case every frame has to be rendered.
+        self.canReuseHeldFrames = self.reuseHeldFrames and not self.keyframeIndex.hasUnkeyedContent
+        if self.reuseHeldFrames and not self.canReuseHeldFrames:
+            self.instrumentation.log("Held frames will be re-rendered because the document contains layers that can change without keyframes")
+
+    def _findFrameTimes(self):
+        # Frames that were already rendered are exported as they are, since they were
+        # rendered for the frame times of their own spritesheet.
+        if self.prerenderedFrames is not None:
+            self.frameTimes = list(self.prerenderedFrames)
+        elif not self.ignoreEmptyFrames:
+            self.frameTimes = list(range(self.animationStartTime, self.animationEndTime + 1, 1))
         else:
-            # Grab all of the keyframes
-            keyframeTimes = set()
-            topLevelLayers = self.temporaryDocument.topLevelNodes()
-            for layer in topLevelLayers:
-                for time in range(self.animationStartTime, self.animationEndTime + 1, 1):
-                    if self._hasKeyframeAtTime(layer, time):
-                        keyframeTimes.add(time)
-                        print(f"Found keyframe at index: {time}")
-            
-            frameCount = len(keyframeTimes)
-            print(f"Adding {frameCount} frames to the spritesheet document")
-
-            size = self._getSpritesheetSize(frameCount)
-            self._createSpritesheetDocument(size.columns, size.rows)
-            keyframeTimes = sorted(keyframeTimes)
-
-            # Convert keyframes to spritesheet layers
-            for time in keyframeTimes:
-                self.temporaryDocument.setCurrentTime(time)
-                self.temporaryDocument.refreshProjection()
-                self._convertCurrentFrameToSpritesheetLayer()
-
-    def _createSpritesheetDocument(self, columns, rows):
-        self.spritesheetColumns = columns
-        self.spritesheetRows = rows
-
-        self.spritesheetDocument = self.krita.createDocument(
-            columns * self.temporaryDocument.width(), 
-            rows * self.temporaryDocument.height(), 
-            "Spritesheet", 
-            self.temporaryDocument.colorModel(), 
-            self.temporaryDocument.colorDepth(), 
-            self.temporaryDocument.colorProfile(), 
-            self.temporaryDocument.resolution())
-        
+            self.frameTimes = self.keyframeIndex.keyframeTimes()
+            self.instrumentation.log(f"Found keyframes at indices: {self.frameTimes}")
+
+        self.instrumentation.setFrameCount(len(self.frameTimes))
+
+    def _canStreamToFile(self):
+        # Incremental exports reuse rows of sprites from the cache, so they are always streamed.
+        if not self.streamToFile and not self._canUseExportCache():
+            return False
+
+        # Packed and deduplicated spritesheets need every frame before the layout is known.
+        if self.spritesheetType == "Packed" or self.deduplicateFrames:
+            self.instrumentation.log("Low memory and incremental exports are not available for packed or deduplicated spritesheets, the spritesheet will be built in memory")
+            return False
+
+        # The palette is based on every pixel of the spritesheet, so it has to be built first.
+        if self.outputFormat == "Indexed PNG":
+            self.instrumentation.log("Low memory and incremental exports are not available for indexed PNG files, the spritesheet will be built in memory")
+            return False
+
+        if not isSupportedColorSpace(self.activeDocument.colorModel(), self._getOutputColorDepth()):
+            self.instrumentation.log(f"Low memory and incremental exports are not available for {self.activeDocument.colorModel()} {self._getOutputColorDepth()} documents, the spritesheet will be built in memory")
+            return False
+
+        return True
+
+    def _canUseExportCache(self):
+        # The export cache stores compressed rows of PNG files.
+        if self.incrementalExport and self.outputFormat != "PNG":
+            self.instrumentation.log(f"Incremental exports are not available for {self.outputFormat} files, every row of sprites will be written again")
+            return False
+
+        return self.incrementalExport
+
+    def _streamSpritesheetToFile(self):
+        self._findFrameTimes()
+
+        frameCount = len(self.frameTimes)
+        self.frameCellIndices = list(range(frameCount))
+        self._setPages(self._createGridPages(frameCount), frameCount)
+
+        for pageIndex, page in enumerate(self.pages):
+            self._streamPageToFile(pageIndex, page)
+
+    def _streamPageToFile(self, pageIndex, page):
+        cellWidth = self.finalSpriteWidth
+        cellHeight = self.finalSpriteHeight
+
+        self.instrumentation.log(f"Streaming {len(page.cellIndices)} frames to a {page.width} x {page.height} spritesheet")
+
+        if self._canUseExportCache():
+            self.exportCache = ExportCache(page.filePath, self._getLayoutParameters(page.width, page.height), log=self.instrumentation.log)
+
+        self.imageWriter = self._createImageWriter(page.filePath, page.width, page.height, independentBands=self.exportCache is not None)
+
+        # Group the cells of the page by the row of sprites they belong to.
+        rowsOfCells = [[] for row in range(page.rows)]
+        for cellIndex, position in zip(page.cellIndices, page.positions):
+            rowsOfCells[position.y // cellHeight].append((position.x, cellIndex))
+
+        # Only a single row of sprites is held in memory at a time. Frames are
+        # rendered when the row of sprites that they belong to is being encoded.
+        reusedRowCount = 0
+        for row, rowCells in enumerate(rowsOfCells):
+            rowCells.sort()
+            columns = []
+            frames = []
+            for x, cellIndex in rowCells:
+                columns.append(x // cellWidth)
+                frames.append(self._renderFrame(self.frameTimes[cellIndex]))
+                self.spritesheetCells[cellIndex] = Cell(x + self.spritePadding, row * cellHeight + self.spritePadding,
+                                                        self.targetSpriteWidth, self.targetSpriteHeight, 0, 0)
+                self.cellPages[cellIndex] = pageIndex
+
+            if self.exportCache is None:
+                band = self._createSpritesheetBand(page.width, columns, frames)
+                startTime = time.perf_counter()
+                self.imageWriter.writeRows(band, cellHeight)
+                self.instrumentation.rowsEncoded(cellHeight, time.perf_counter() - startTime)
+                continue
+
+            # Rows of sprites are only composited and compressed again if any of their frames changed.
+            frameHashes = [self._getFrameHash(pixelData) for pixelData in frames]
+            compressedBand = self.exportCache.getBand(row, frameHashes)
+            if compressedBand is None:
+                band = self._createSpritesheetBand(page.width, columns, frames)
+                startTime = time.perf_counter()
+                compressedBand = self.imageWriter.compressRows(band, cellHeight)
+                self.instrumentation.rowsEncoded(cellHeight, time.perf_counter() - startTime)
+            else:
+                reusedRowCount += 1
+
+            cells = [[column * cellWidth, row * cellHeight] for column in columns]
+            self.exportCache.storeBand(row, frameHashes, cells, compressedBand)
+            self.imageWriter.writeCompressedRows(compressedBand, cellHeight)
+
+        self.imageWriter.writeEmptyRows(page.height - (page.rows * cellHeight))
+        self.imageWriter.close()
+        self.imageWriter = None
+        self.writtenFilePaths.append(page.filePath)
+
+        if self.exportCache is not None:
+            self.exportCache.save()
+            self.exportCache = None
+            self.instrumentation.log(f"Reused {reusedRowCount} of {page.rows} rows of sprites from the export cache")
+
+        self.instrumentation.log(f"Spritesheet exported to {page.filePath}")
+
+    def _createSpritesheetBand(self, width, columns, frames):
+        band = SpritesheetAtlas(width, self.finalSpriteHeight, self._getPixelSize())
+        for column, pixelData in zip(columns, frames):
+            self._blitPaddedFrame(band, pixelData, column * self.finalSpriteWidth + self.spritePadding, self.spritePadding,
+                                  self.targetSpriteWidth, self.targetSpriteHeight)
+
+        return band.pixels
+
+    def _getFrameHash(self, pixelData):
+        # Held frames reuse the exact same buffer as the previous frame, so there's no need to hash them again.
+        if pixelData is not self.lastHashedFrame:
+            self.lastHashedFrame = pixelData
+            self.lastFrameHash = hashlib.blake2b(pixelData, digest_size=16).hexdigest()
+
+        return self.lastFrameHash
+
+    def _getLayoutParameters(self, width, height):
+        # Everything that affects where frames are placed or how their pixels are encoded.
+        return {
+            "version": 1,
+            "spritesheetType": self.spritesheetType,
+            "ignoreEmptyFrames": self.ignoreEmptyFrames,
+            "targetSpriteWidth": self.targetSpriteWidth,
+            "targetSpriteHeight": self.targetSpriteHeight,
+            "spritePadding": self.spritePadding,
+            "extrudePadding": self.extrudePadding,
+            "filterStrategy": self.filterStrategy,
+            "powerOfTwoSize": self.powerOfTwoSize,
+            "maxPageSize": self.maxPageSize,
+            "colorModel": self.activeDocument.colorModel(),
+            "colorDepth": self._getOutputColorDepth(),
+            "pngCompressionLevel": self.pngCompressionLevel,
+            "pngFilter": self.pngFilter,
+            "frameCount": len(self.frameTimes),
+            "width": width,
+            "height": height
+        }
+
+    def _canWriteAtlasToFile(self):
+        # Formats other than PNG are always written by the generator itself.
+        if self.outputFormat != "PNG":
+            return True
+
+        if not isSupportedColorSpace(self.activeDocument.colorModel(), self._getOutputColorDepth()):
+            return False
+
+        # Krita's exporter only uses a single thread and doesn't have any options for filters, so the atlas is
+        # only encoded by the generator itself when the compression can be spread across multiple workers
+        # or when the default PNG options were changed.
+        return self.compressionWorkerCount > 1 or self.pngFilter != "None" or self.pngCompressionLevel != DEFAULT_PNG_COMPRESSION_LEVEL
+
+    def _createImageWriter(self, filePath, width, height, independentBands=False, palette=None):
+        if self.outputFormat == "Raw RGBA":
+            return RawRgbaWriter(filePath, width, height)
+        elif self.outputFormat == "DDS":
+            return DdsWriter(filePath, width, height)
+
+        return PngWriter(filePath, width, height, self.activeDocument.colorModel(), self._getOutputColorDepth(),
+                         compressionLevel=self.pngCompressionLevel, workerCount=self.compressionWorkerCount,
+                         independentBands=independentBands, filterName=self.pngFilter, palette=palette)
+
+    def _writeAtlasToFile(self, filePath):
+        pixels = self.spritesheetAtlas.pixels
+        rowSize = self.spritesheetAtlas.width * self.spritesheetAtlas.pixelSize
+        palette = None
+
+        # Indexed PNG files store a palette index for every pixel.
+        if self.outputFormat == "Indexed PNG":
+            palettedImage = createPalettedImage(pixels)
+            pixels = palettedImage.indices
+            rowSize = self.spritesheetAtlas.width
+            palette = palettedImage.palette
+
+            self.instrumentation.log(f"Spritesheet reduced to a palette of {len(palette) // 4} colors")
+
+        self.imageWriter = self._createImageWriter(filePath, self.spritesheetAtlas.width, self.spritesheetAtlas.height, palette=palette)
+
+        # Hand the atlas to the writer in bands of rows, so that the compression workers
+        # can start while the following bands are being prepared.
+        bandHeight = max(1, ATLAS_BAND_SIZE // max(1, rowSize))
+        atlasPixels = memoryview(pixels)
+        for row in range(0, self.spritesheetAtlas.height, bandHeight):
+            self.instrumentation.checkCancelled()
+
+            rowCount = min(bandHeight, self.spritesheetAtlas.height - row)
+            startTime = time.perf_counter()
+            self.imageWriter.writeRows(atlasPixels[row * rowSize:(row + rowCount) * rowSize], rowCount)
+            self.instrumentation.rowsEncoded(rowCount, time.perf_counter() - startTime)
+
+        atlasPixels.release()
+        self.imageWriter.close()
+        self.imageWriter = None
+        self.spritesheetAtlas = None
+        self.writtenFilePaths.append(filePath)
+
+        self.instrumentation.log(f"Spritesheet exported to {filePath}")
+
+    def _prepareSpritesheetCells(self):
+        # Find the frames of every cell and lay out the cells on pages.
+        self._findFrameTimes()
+
+        if self.spritesheetType == "Packed":
+            self._preparePackedCells()
+            return
+
+        if self.deduplicateFrames:
+            self._prepareUniqueFrameCells()
+            return
+
+        # Frames are rendered while the page they belong to is being built,
+        # so only the frames of a single page are held in memory.
+        frameCount = len(self.frameTimes)
+        self.instrumentation.log(f"Adding {frameCount} frames to the spritesheet atlas")
+
+        self.cellFrames = None
+        self.frameCellIndices = list(range(frameCount))
+        self._setPages(self._createGridPages(frameCount), frameCount)
+
+    def _renderSpritesheetCells(self, processCell):
+        # Render every frame, calling processCell on the pixel data of each frame that needs its own cell.
+        # When deduplication is enabled, identical frames share a single cell, so only the hash of every frame
+        # and the processed pixel data of unique frames are kept in memory.
+        cells = []
+        uniqueFrameCellIndices = {}
+        self.frameCellIndices = []
+
+        for frameTime in self.frameTimes:
+            pixelData = self._renderFrame(frameTime)
+
+            if not self.deduplicateFrames:
+                self.frameCellIndices.append(len(cells))
+                cells.append(processCell(pixelData))
+                continue
+
+            # Held frames reuse the exact same buffer as the previous frame, so there's no need to hash them again.
+            if len(cells) > 0 and pixelData is self.lastHashedFrame:
+                self.frameCellIndices.append(self.frameCellIndices[-1])
+                continue
+
+            frameHash = hashlib.blake2b(pixelData, digest_size=16).digest()
+            if frameHash not in uniqueFrameCellIndices:
+                uniqueFrameCellIndices[frameHash] = len(cells)
+                cells.append(processCell(pixelData))
+
+            self.frameCellIndices.append(uniqueFrameCellIndices[frameHash])
+            self.lastHashedFrame = pixelData
+
+        self.lastHashedFrame = None
+        return cells
+
+    def _prepareUniqueFrameCells(self):
+        # Identical frames share a single cell, so all frames need to be rendered
+        # before the size of the spritesheet is known.
+        self.cellFrames = self._renderSpritesheetCells(lambda pixelData: pixelData)
+
+        frameCount = len(self.cellFrames)
+        self.instrumentation.log(f"Adding {frameCount} unique frames out of {len(self.frameTimes)} to the spritesheet atlas")
+
+        self._setPages(self._createGridPages(frameCount), frameCount)
+
+    def _preparePackedCells(self):
+        # Trim the transparent pixels around every frame as soon as it is rendered,
+        # then pack the trimmed frames as tightly as possible.
+        self.cellFrames = self._renderSpritesheetCells(self._trimFrame)
+
+        # Padding is kept as spacing around each trimmed frame.
+        sizes = []
+        for trimmedFrame in self.cellFrames:
+            if trimmedFrame.bounds is None:
+                sizes.append((0, 0))
+            else:
+                sizes.append((trimmedFrame.bounds.width + (self.spritePadding * 2), trimmedFrame.bounds.height + (self.spritePadding * 2)))
+
+        if self.maxPageSize > 0:
+            packedPages = packRectsIntoPages(sizes, self.maxPageSize, self.powerOfTwoSize)
+        else:
+            packResult = packRects(sizes, self.powerOfTwoSize)
+            packedPages = [PackedPage(packResult.width, packResult.height, list(range(len(sizes))), packResult.positions)]
+
+        pages = []
+        for pageIndex, packedPage in enumerate(packedPages):
+            positions = [Position(x, y) for x, y in packedPage.positions]
+            pages.append(SpritesheetPage(self._getPageFilePath(pageIndex, len(packedPages)), packedPage.width, packedPage.height,
+                                         None, None, packedPage.indices, positions))
+
+        self._setPages(pages, len(sizes))
+        self.instrumentation.log(f"Packed {len(sizes)} frames into {len(pages)} spritesheet pages")
+
+    def _createGridPages(self, cellCount):
+        # Spread the cells over as many pages as needed to keep every page within the maximum page size.
+        framesPerPage = self._getFramesPerPage()
+        pageCount = 1 if framesPerPage is None else max(1, math.ceil(cellCount / framesPerPage))
+
+        pages = []
+        for pageIndex in range(pageCount):
+            firstCellIndex = 0 if framesPerPage is None else pageIndex * framesPerPage
+            pageCellCount = cellCount - firstCellIndex if framesPerPage is None else min(framesPerPage, cellCount - firstCellIndex)
+
+            size = self._getSpritesheetSize(pageCellCount)
+            self.spritesheetColumns = size.columns
+            self.spritesheetRows = size.rows
+
+            width = size.columns * self.finalSpriteWidth
+            height = size.rows * self.finalSpriteHeight
+            if self.powerOfTwoSize:
+                width = self._getNextPowerOfTwo(width)
+                height = self._getNextPowerOfTwo(height)
+
+            positions = [self._getFramePosition(index) for index in range(pageCellCount)]
+            pages.append(SpritesheetPage(self._getPageFilePath(pageIndex, pageCount), width, height, size.columns, size.rows,
+                                         range(firstCellIndex, firstCellIndex + pageCellCount), positions))
+
+        return pages
+
+    def _setPages(self, pages, cellCount):
+        self.pages = pages
+        self.spritesheetCells = [None] * cellCount
+        self.cellPages = [0] * cellCount
+
+        if len(pages) > 1:
+            self.instrumentation.log(f"The spritesheet is split into {len(pages)} pages of at most {self.maxPageSize} x {self.maxPageSize} pixels")
+
+    def _getFramesPerPage(self):
+        # The number of cells that fit on a single page, or None if the size of pages is unlimited.
+        if self.maxPageSize <= 0 or self.spritesheetType == "Packed":
+            return None
+
+        columnLimit, rowLimit = self._getPageCellLimits()
+        if self.spritesheetType == "Horizontal Strip":
+            return columnLimit
+        elif self.spritesheetType == "Vertical Strip":
+            return rowLimit
+        else:
+            return columnLimit * rowLimit
+
+    def _getPageCellLimits(self):
+        # The number of columns and rows of cells that fit on a single page.
+        if self.maxPageSize <= 0:
+            return math.inf, math.inf
+
+        # Pages are rounded up to powers of two, so they have to stay within the largest power of two that fits.
+        pageSize = self.maxPageSize
+        if self.powerOfTwoSize:
+            pageSize = 1 << (pageSize.bit_length() - 1)
+
+        columnLimit = pageSize // self.finalSpriteWidth
+        rowLimit = pageSize // self.finalSpriteHeight
+        if columnLimit == 0 or rowLimit == 0:
+            raise Exception(f"Sprites of {self.finalSpriteWidth} x {self.finalSpriteHeight} pixels don't fit in a page of {pageSize} x {pageSize} pixels")
+
+        return columnLimit, rowLimit
+
+    def _getPageFilePath(self, pageIndex, pageCount):
+        # A spritesheet with a single page keeps the export file path, while pages are numbered otherwise.
+        if pageCount == 1:
+            return self.spritesheetFilePath
+
+        exportPath = Path(self.spritesheetFilePath)
+        return str(exportPath.with_name(f"{exportPath.stem}_{pageIndex}{exportPath.suffix}"))
+
+    def _writeSpritesheetPages(self):
+        # Each page is built, written and released before the next one, so only a single page is held in memory.
+        for pageIndex, page in enumerate(self.pages):
+            with self.instrumentation.phase("Build spritesheet page"):
+                self._createSpritesheetAtlasForPage(pageIndex, page)
+
+            # Every frame has been rendered once the last page is built.
+            if pageIndex == len(self.pages) - 1:
+                self._releaseSourceDocument()
+
+            if self._canWriteAtlasToFile():
+                # Encode the atlas directly, which allows it to be compressed on multiple threads.
+                with self.instrumentation.phase("Write spritesheet to file"):
+                    self._writeAtlasToFile(page.filePath)
+            else:
+                with self.instrumentation.phase("Create spritesheet document"):
+                    self._createSpritesheetDocumentFromAtlas()
+
+                with self.instrumentation.phase("Export spritesheet document"):
+                    self._exportToFile(page.filePath)
+
+                self._forceCloseDocument(self.spritesheetDocument)
+                self.spritesheetDocument = None
+
+    def _createSpritesheetAtlasForPage(self, pageIndex, page):
+        self.spritesheetAtlas = SpritesheetAtlas(page.width, page.height, self._getPixelSize())
+
+        if page.columns is not None:
+            self.instrumentation.log(f"Spritesheet atlas created with {page.columns} columns and {page.rows} rows")
+
+        self.instrumentation.log(f"Spritesheet atlas width: {self.spritesheetAtlas.width}")
+        self.instrumentation.log(f"Spritesheet atlas height: {self.spritesheetAtlas.height}")
+
+        for cellIndex, position in zip(page.cellIndices, page.positions):
+            if self.cellFrames is None:
+                # Copy each frame directly into its cell in the atlas
+                pixelData = self._renderFrame(self.frameTimes[cellIndex])
+            else:
+                # Release each frame as soon as it has been copied into the atlas.
+                pixelData = self.cellFrames[cellIndex]
+                self.cellFrames[cellIndex] = None
+
+            if self.spritesheetType == "Packed":
+                self._blitTrimmedFrameIntoSpritesheetAtlas(cellIndex, position, pixelData)
+            else:
+                self._blitFrameIntoSpritesheetAtlas(cellIndex, position, pixelData)
+
+            self.cellPages[cellIndex] = pageIndex
+
+    def _blitTrimmedFrameIntoSpritesheetAtlas(self, cellIndex, position, trimmedFrame):
+        if trimmedFrame.bounds is None:
+            self.spritesheetCells[cellIndex] = Cell(0, 0, 0, 0, 0, 0)
+            return
+
+        x = position.x + self.spritePadding
+        y = position.y + self.spritePadding
+        self._blitPaddedFrame(self.spritesheetAtlas, trimmedFrame.pixelData, x, y, trimmedFrame.bounds.width, trimmedFrame.bounds.height)
+
+        # The offsets are relative to the top left corner of the untrimmed sprite.
+        self.spritesheetCells[cellIndex] = Cell(x, y, trimmedFrame.bounds.width, trimmedFrame.bounds.height, trimmedFrame.bounds.x, trimmedFrame.bounds.y)
+
+    def _trimFrame(self, pixelData):
+        width = self.targetSpriteWidth
+        pixelSize = self._getPixelSize()
+        bounds = getContentBounds(pixelData, width, self.targetSpriteHeight, pixelSize, SpritesheetAtlas.CHANNEL_SIZES[self._getOutputColorDepth()])
+        if bounds is None:
+            return TrimmedFrame(None, None)
+
+        return TrimmedFrame(cropPixelData(pixelData, width, pixelSize, bounds), bounds)
+
+    def _getPixelSize(self):
+        return SpritesheetAtlas.getPixelSize(self.activeDocument.colorModel(), self._getOutputColorDepth())
+
+    def _createSpritesheetDocumentFromAtlas(self):
+        self.spritesheetDocument = self.backend.createDocument(
+            self.spritesheetAtlas.width,
+            self.spritesheetAtlas.height,
+            "Spritesheet",
+            self.activeDocument.colorModel(),
+            self._getOutputColorDepth(),
+            # Converted frames use the default profile, since the profile of the document is for another color depth.
+            "" if self.convertToEightBit else self.activeDocument.colorProfile(),
+            self.activeDocument.resolution())
+
         self.spritesheetDocument.setBatchmode(True)
 
         # Remove any default layers
         layers = self.spritesheetDocument.topLevelNodes()
         for layer in layers:
             layer.remove()
-        
-        print(f"Spritesheet document created with {columns} columns and {rows} rows")
-        print(f"Spritesheet document width: {self.spritesheetDocument.width()}")
-        print(f"Spritesheet document height: {self.spritesheetDocument.height()}")
+
+        # The whole atlas is written into a single layer with a single call.
+        spritesheetLayer = self.spritesheetDocument.createNode("Spritesheet", "paintlayer")
+        self.spritesheetDocument.rootNode().addChildNode(spritesheetLayer, None)
+        spritesheetLayer.setPixelData(bytes(self.spritesheetAtlas.pixels), 0, 0, self.spritesheetAtlas.width, self.spritesheetAtlas.height)
+
+        # The atlas is no longer needed once its pixels are owned by the document.
+        self.spritesheetAtlas = None
+        self.spritesheetDocument.refreshProjection()
+
+        self.instrumentation.log("Spritesheet document created")
+        self.instrumentation.log(f"Spritesheet document width: {self.spritesheetDocument.width()}")
+        self.instrumentation.log(f"Spritesheet document height: {self.spritesheetDocument.height()}")
 
     def _getSpritesheetSize(self, frameCount):
         Size = namedtuple("Size", ["columns", "rows"])
 
         if frameCount == 0:
             return Size(1, 1)
-        elif self.spritesheetType == "Rows":
-            columnCount = math.ceil(math.sqrt(frameCount))
+
+        # With a maximum page size, the number of columns or rows is increased when needed
+        # so that the other dimension stays within the page.
+        columnLimit, rowLimit = self._getPageCellLimits()
+        if self.spritesheetType == "Rows":
+            columnCount = min(columnLimit, max(math.ceil(math.sqrt(frameCount)), math.ceil(frameCount / rowLimit)))
             return Size(columnCount, math.ceil(frameCount / columnCount))
         elif self.spritesheetType == "Columns":
-            rowCount = math.ceil(math.sqrt(frameCount))
+            rowCount = min(rowLimit, max(math.ceil(math.sqrt(frameCount)), math.ceil(frameCount / columnLimit)))
             return Size(math.ceil(frameCount / rowCount), rowCount)
         elif self.spritesheetType == "Horizontal Strip":
             return Size(frameCount, 1)
         elif self.spritesheetType == "Vertical Strip":
             return Size(1, frameCount)
+        elif self.spritesheetType == "Packed":
+            raise Exception("Packed spritesheets don't have a fixed number of columns and rows")
         else:
             raise Exception(f"Invalid spritesheet type provided: {self.spritesheetType}")
 
-    def _convertCurrentFrameToSpritesheetLayer(self):
-        # Ensure that operations on the temporary document have finished
+    def _renderFrame(self, frameTime):
+        # Cancellation is checked between frames, which is where most of the time of an export is spent.
+        self.instrumentation.checkCancelled()
+
+        # Frames of sprite variants were already rendered, so they are reused.
+        if self.prerenderedFrames is not None:
+            self.instrumentation.frameRendered(frameTime, 0.0, 0, True)
+            return self.prerenderedFrames[frameTime]
+
+        # A frame without a keyframe since the last rendered frame is a held exposure,
+        # meaning that it is identical to the last rendered frame and doesn't need to be rendered again.
+        if self.lastRenderedFrame is not None and self.canReuseHeldFrames and frameTime > self.lastRenderedTime and \
+            not self.keyframeIndex.hasKeyframeBetween(self.lastRenderedTime, frameTime):
+            self.instrumentation.frameRendered(frameTime, 0.0, 0, True)
+            return self.lastRenderedFrame
+
+        startTime = time.perf_counter()
+        self.sourceDocument.setCurrentTime(frameTime)
+        self.sourceDocument.refreshProjection()
+
+        # Ensure that operations on the document have finished
         # before attempting to retrieve its pixel data.
-        self.temporaryDocument.waitForDone()
+        self.sourceDocument.waitForDone()
 
-        width = self.temporaryDocument.width()
-        height = self.temporaryDocument.height()
+        # Copy the pixel data of the current frame displayed on the document
+        width = self.sourceDocument.width()
+        height = self.sourceDocument.height()
+        pixelData = bytes(self.sourceDocument.pixelData(0, 0, width, height))
+        self._checkPixelDataSize(pixelData, width, height)
+        byteCount = len(pixelData)
 
-        # Copy the pixel data of the current frame displayed on the temporary document
-        currentFramePixelData = self.temporaryDocument.pixelData(0, 0, width, height)
+        self.lastRenderedFrame = self._processRenderedFrame(pixelData, width, height)
+        self.lastRenderedTime = frameTime
+        self.instrumentation.frameRendered(frameTime, time.perf_counter() - startTime, byteCount, False)
 
-        # Convert the pixel data of the current frame into a layer in the spritesheet document.
-        newSpritesheetLayer = self.spritesheetDocument.createNode(str(len(self.spritesheetDocument.topLevelNodes())), "paintlayer")
-        self.spritesheetDocument.rootNode().addChildNode(newSpritesheetLayer, None)
-        newSpritesheetLayer.setPixelData(currentFramePixelData, 0, 0, width, height)
+        return self.lastRenderedFrame
 
-        self.spritesheetDocument.refreshProjection()
+    def _checkPixelDataSize(self, pixelData, width, height):
+        # Krita returns an empty array when pixels can't be read, which would shift every
+        # following sprite in the atlas if it was copied into it.
+        expectedSize = width * height * SpritesheetAtlas.getPixelSize(self.sourceDocument.colorModel(), self.sourceDocument.colorDepth())
+        if len(pixelData) != expectedSize:
+            raise Exception(f"Expected {expectedSize} bytes of pixel data for a {width} x {height} frame, but got {len(pixelData)}")
 
-    def _hasKeyframeAtTime(self, layer, time):
-        if not layer.visible():
-            return False
+    def _processRenderedFrame(self, pixelData, width, height):
+        if self.temporaryDocument is None:
+            pixelData = self._resizeFrame(pixelData, width, height)
 
-        if layer.hasKeyframeAtTime(time):
-            return True
-            
-        if len(layer.childNodes()) != 0:
-            # check if any of the child nodes
-            # have a keyframe at the given time
-            for child in layer.childNodes():
-                if self._hasKeyframeAtTime(child, time):
-                    return True
-                
-        # reaching this point means that the frame
-        # is not a keyframe in the parent layer or
-        # any of its children.
-        return False
-    
-    def _positionFramesInSpritesheetDocument(self):
-        # Based on the selected spritesheet type, move all of the layers into their respective
-        # positions in the spritesheet document.
+        if self.convertToEightBit:
+            pixelData = convertToEightBit(pixelData, self.sourceDocument.colorModel(), self.sourceDocument.colorDepth(), self.isLinearColor)
+
+        return pixelData
+
+    def _resizeFrame(self, pixelData, width, height):
+        # Only the flattened frame is resampled, instead of every layer and keyframe of the document.
+        return resamplePixelData(pixelData, width, height, self.sourceDocument.colorModel(), self.sourceDocument.colorDepth(),
+                                 self.targetSpriteWidth, self.targetSpriteHeight, self.filterStrategy)
+
+    def _blitFrameIntoSpritesheetAtlas(self, cellIndex, position, pixelData):
+        self._blitPaddedFrame(self.spritesheetAtlas, pixelData, position.x + self.spritePadding, position.y + self.spritePadding,
+                              self.targetSpriteWidth, self.targetSpriteHeight)
+        # Like packed cells, grid cells are the rectangle of the sprite inside its padding.
+        self.spritesheetCells[cellIndex] = Cell(position.x + self.spritePadding, position.y + self.spritePadding,
+                                                self.targetSpriteWidth, self.targetSpriteHeight, 0, 0)
+
+    def _blitPaddedFrame(self, atlas, pixelData, x, y, width, height):
+        # Padding is added while the frame is copied into the atlas, which leaves the padding transparent
+        # unless the edges of the frame are extruded into it.
+        atlas.blit(pixelData, x, y, width, height)
+        if self.extrudePadding:
+            atlas.extrude(x, y, width, height, self.spritePadding)
+
+    def _getNextPowerOfTwo(self, value):
+        return 1 << max(0, math.ceil(math.log2(max(1, value))))
+
+    def _getFramePosition(self, index):
+        # Based on the selected spritesheet type, find the position of the frame's cell in the spritesheet.
         if self.spritesheetType == "Rows":
-            self._positionSpritesheetFramesByRows()
+            return self._getFramePositionByRows(index)
         elif self.spritesheetType == "Columns":
-            self._positionSpritesheetFramesByColumns()
+            return self._getFramePositionByColumns(index)
         elif self.spritesheetType == "Horizontal Strip":
-            self._positionSpritesheetFramesAsHorizontalStrip()
+            return self._getFramePositionInHorizontalStrip(index)
         elif self.spritesheetType == "Vertical Strip":
-            self._positionSpritesheetFramesAsVerticalStrip()
+            return self._getFramePositionInVerticalStrip(index)
         else:
             raise Exception(f"Invalid spritesheet type provided: {self.spritesheetType}")
-            
-        self.spritesheetDocument.refreshProjection()
 
-    def _positionSpritesheetFramesByRows(self):
-         # Place sprites by filling up each row before moving to the next row.
-         layers = self.spritesheetDocument.topLevelNodes()
-         for index in range(len(layers)):
-             layers[index].move(int(index % self.spritesheetColumns) * self.finalSpriteWidth, 
-                                int(index / self.spritesheetColumns) * self.finalSpriteHeight)
-
-    def _positionSpritesheetFramesByColumns(self):
-         # Place sprites by filling up each column before moving to the next column.
-         layers = self.spritesheetDocument.topLevelNodes()
-         for index in range(len(layers)):
-             layers[index].move(int(index / self.spritesheetRows) * self.finalSpriteWidth, 
-                                int(index % self.spritesheetRows) * self.finalSpriteHeight)
-
-    def _positionSpritesheetFramesAsHorizontalStrip(self):
+    def _getFramePositionByRows(self, index):
+        # Place sprites by filling up each row before moving to the next row.
+        return Position(int(index % self.spritesheetColumns) * self.finalSpriteWidth,
+                        int(index / self.spritesheetColumns) * self.finalSpriteHeight)
+
+    def _getFramePositionByColumns(self, index):
+        # Place sprites by filling up each column before moving to the next column.
+        return Position(int(index / self.spritesheetRows) * self.finalSpriteWidth,
+                        int(index % self.spritesheetRows) * self.finalSpriteHeight)
+
+    def _getFramePositionInHorizontalStrip(self, index):
         # Place sprites in a single horizontal line.
-        layers = self.spritesheetDocument.topLevelNodes()
-        for index in range(len(layers)):
-            layers[index].move(index * self.finalSpriteWidth, 0)
+        return Position(index * self.finalSpriteWidth, 0)
 
-    def _positionSpritesheetFramesAsVerticalStrip(self):
+    def _getFramePositionInVerticalStrip(self, index):
         # Place sprites in a single vertical line.
-        layers = self.spritesheetDocument.topLevelNodes()
-        for index in range(len(layers)):
-            layers[index].move(0, index * self.finalSpriteHeight)
+        return Position(0, index * self.finalSpriteHeight)
 
     def _forceCloseDocument(self, document):
-        # Set "modified" to false to prevent a popup from showing when closing the document
-        document.setModified(False)
-        document.close()
+        self.backend.closeDocument(document)
 
-    def _exportToFile(self):
+    def _exportToFile(self, filePath):
         # Ensure that operations in the spritesheet document have finished
         # before attempting to retrieve its pixel data.
         self.spritesheetDocument.waitForDone()
 
-        # If needed, append the correct file extension.
-        if Path(self.exportFilePath).suffix != ".png":
-            self.exportFilePath += ".png"
-
         # Export the spritesheet
-        self.spritesheetDocument.exportImage(self.exportFilePath, krita.InfoObject())
\ No newline at end of file
+        startTime = time.perf_counter()
+        self.backend.exportImage(self.spritesheetDocument, filePath)
+        self.instrumentation.rowsEncoded(self.spritesheetDocument.height(), time.perf_counter() - startTime)
+        self.writtenFilePaths.append(filePath)
+
+        self.instrumentation.log(f"Spritesheet exported to {filePath}")
+
+    def _exportFrameMapToFile(self):
+        # Write a file next to the spritesheet that maps every frame in the timeline to its cell,
+        # which allows the original animation to be replayed when identical frames share a cell,
+        # when frames have been trimmed and packed or when the spritesheet is split into pages.
+        cells = []
+        for cellIndex, cell in enumerate(self.spritesheetCells):
+            cellMap = cell._asdict()
+            if len(self.pages) > 1:
+                cellMap["page"] = self.cellPages[cellIndex]
+
+            cells.append(cellMap)
+
+        frames = []
+        for frameTime, cellIndex in zip(self.frameTimes, self.frameCellIndices):
+            frames.append({"time": frameTime, "cell": cellIndex})
+
+        frameMap = {
+            "image": Path(self.spritesheetFilePath).name,
+            "spriteWidth": self.targetSpriteWidth,
+            "spriteHeight": self.targetSpriteHeight,
+            "padding": self.spritePadding,
+            "cells": cells,
+            "frames": frames
+        }
+
+        # Each cell of a spritesheet split into pages has the index of the image it is on.
+        if len(self.pages) > 1:
+            del frameMap["image"]
+            frameMap["images"] = [Path(page.filePath).name for page in self.pages]
+
+        frameMapFilePath = str(Path(self.spritesheetFilePath).with_suffix(".json"))
+        with open(frameMapFilePath, "w") as frameMapFile:
+            json.dump(frameMap, frameMapFile, indent=4)
+
+        # The frame map is removed along with its spritesheet if the export is stopped.
+        self.writtenFilePaths.append(frameMapFilePath)
+        self.instrumentation.log(f"Frame map exported to {frameMapFilePath}")
\ No newline at end of file
@@ -1,20 +1,48 @@
 import krita
+import os
 from pathlib import Path
 
-from .spritesheetgenerator import SpritesheetGenerator
+from .spritesheetgenerator import SpritesheetGenerator, parseSpriteVariants, OUTPUT_FILE_EXTENSIONS, DEFAULT_PNG_COMPRESSION_LEVEL
+from .pngfile import PNG_FILTER_TYPES
+from .exportinstrumentation import ExportInstrumentation, ExportSink, LogSink, ExportCancelled
 from PyQt5.QtCore import (Qt)
 from PyQt5.QtWidgets import (QDialog, QLineEdit, QCheckBox,
                              QPushButton, QVBoxLayout, QHBoxLayout,
                              QLabel, QDialogButtonBox, QFormLayout,
                              QSpinBox, QComboBox, QGroupBox,
-                             QFrame, QFileDialog)
+                             QFrame, QFileDialog, QProgressBar,
+                             QApplication, QMessageBox)
+
+class QtProgressSink(ExportSink):
+    # Shows the progress of an export in a progress bar. Pending events are processed after
+    # every frame, which keeps the dialog responsive so that the export can be cancelled.
+
+    def __init__(self, progressBar):
+        self.progressBar = progressBar
+
+    def onPhaseStarted(self, name):
+        self.progressBar.setFormat(f"{name} - %p%")
+        QApplication.processEvents()
+
+    def onProgress(self, completedFrameCount, frameCount):
+        self.progressBar.setMaximum(max(1, frameCount))
+        self.progressBar.setValue(completedFrameCount)
+        QApplication.processEvents()
 
 class UISpritesheetGenerator(object):
 
     def __init__(self):
         self.krita = krita.Krita.instance()
         self.activeDocument = self.krita.activeDocument()
-        self.spritesheetGenerator = SpritesheetGenerator()
+
+        # Shows the progress of the export, which is also printed to the log
+        self.exportProgressBar = QProgressBar()
+        self.exportProgressBar.setToolTip("The progress of the export. Press \"Cancel\" to stop the export.")
+        self.exportProgressBar.setVisible(False)
+        self.instrumentation = ExportInstrumentation([LogSink(), QtProgressSink(self.exportProgressBar)])
+        self.isExporting = False
+
+        self.spritesheetGenerator = SpritesheetGenerator(instrumentation=self.instrumentation)
 
         # The primary dialog and vertical layout
         self.mainDialog = QDialog()
@@ -40,14 +68,73 @@ class UISpritesheetGenerator(object):
         self.spritesheetLayoutComboBox.setToolTip("<b>Rows:</b> Consecutive sprites will be placed in the same row. Once the row is full, the process will be repeated for the following rows.<br><br>" + 
                                                   "<b>Columns:</b> Consecutive sprites will be placed in the same column. Once the column is full, the process will be repeated for the following columns.<br><br>" +
                                                   "<b>Horizontal Strip:</b> Sprites will be organized into a single horizontal line.<br><br>"+
-                                                  "<b>Vertical Strip:</b> Sprites will be organized into a single vertical line.")
+                                                  "<b>Vertical Strip:</b> Sprites will be organized into a single vertical line.<br><br>" +
+                                                  "<b>Packed:</b> Transparent pixels around each sprite will be trimmed and the sprites will be packed as tightly as possible. " +
+                                                  "The position and trim offsets of each sprite will be exported to a JSON file next to the spritesheet.")
         self.spritesheetLayoutComboBox.setMaximumWidth(spritePropertiesFieldWidth)
         self.spritesheetLayoutComboBox.addItem("Rows")
         self.spritesheetLayoutComboBox.addItem("Columns")
         self.spritesheetLayoutComboBox.addItem("Horizontal Strip")
         self.spritesheetLayoutComboBox.addItem("Vertical Strip")
+        self.spritesheetLayoutComboBox.addItem("Packed")
         self.spritesheetLayoutFormLayout = QFormLayout()
 
+        # Toggle to round the size of the spritesheet up to a power of two
+        self.powerOfTwoSizeCheckBox = QCheckBox("Power of two size")
+        self.powerOfTwoSizeCheckBox.setToolTip("If enabled, the width and height of the spritesheet will be powers of two.")
+
+        # Widget for controlling the number of threads used to compress the spritesheet
+        self.compressionWorkerCountField = QSpinBox()
+        self.compressionWorkerCountField.setToolTip("The number of threads used to compress the spritesheet. " +
+                                                    "If more than one thread is used, the PNG file will be written by the Spritesheet Generator instead of Krita.")
+        self.compressionWorkerCountField.setMinimum(1)
+        self.compressionWorkerCountField.setMaximum(os.cpu_count() or 1)
+        self.compressionWorkerCountField.setMaximumWidth(spritePropertiesFieldWidth)
+        self.compressionWorkerCountField.setAlignment(Qt.AlignRight)
+
+        # Widget for controlling the maximum size of each page of the spritesheet
+        self.maxPageSizeField = QSpinBox()
+        self.maxPageSizeField.setToolTip("The maximum width and height of the spritesheet. Frames that don't fit will be placed on additional pages, " +
+                                         "which are exported as separate files numbered from 0.")
+        self.maxPageSizeField.setMinimum(0)
+        self.maxPageSizeField.setMaximum(65536)
+        self.maxPageSizeField.setSingleStep(1024)
+        self.maxPageSizeField.setSpecialValueText("Unlimited")
+        self.maxPageSizeField.setMaximumWidth(spritePropertiesFieldWidth)
+        self.maxPageSizeField.setAlignment(Qt.AlignRight)
+
+        # UI for selecting the file format of the spritesheet
+        self.outputFormatComboBox = QComboBox()
+        self.outputFormatComboBox.setToolTip("<b>PNG:</b> A PNG file with the color depth of the document.<br><br>" +
+                                             "<b>Indexed PNG:</b> A PNG file with a palette of up to 256 colors, useful for pixel art. Requires NumPy.<br><br>" +
+                                             "<b>Raw RGBA:</b> Uncompressed 8 bit RGBA pixels with premultiplied alpha after a 16 byte header, which can be memory mapped and uploaded without decoding it.<br><br>" +
+                                             "<b>DDS:</b> An uncompressed 8 bit DDS texture.")
+        self.outputFormatComboBox.setMaximumWidth(spritePropertiesFieldWidth)
+        for outputFormat in OUTPUT_FILE_EXTENSIONS:
+            self.outputFormatComboBox.addItem(outputFormat)
+
+        # Toggle to convert frames to 8 bits as they are rendered
+        self.convertToEightBitCheckBox = QCheckBox("Convert to 8 bit")
+        self.convertToEightBitCheckBox.setToolTip("If enabled, frames of 16 bit and floating point documents will be converted to 8 bit as they are rendered, " +
+                                                  "so the spritesheet is never built at a higher color depth. Formats other than PNG are always 8 bit.")
+
+        # Widget for controlling the compression level of PNG files
+        self.pngCompressionLevelField = QSpinBox()
+        self.pngCompressionLevelField.setToolTip("The compression level of PNG files, from 0 (fastest) to 9 (smallest).")
+        self.pngCompressionLevelField.setMinimum(0)
+        self.pngCompressionLevelField.setMaximum(9)
+        self.pngCompressionLevelField.setValue(DEFAULT_PNG_COMPRESSION_LEVEL)
+        self.pngCompressionLevelField.setMaximumWidth(spritePropertiesFieldWidth)
+        self.pngCompressionLevelField.setAlignment(Qt.AlignRight)
+
+        # UI for selecting the filter applied to the rows of PNG files
+        self.pngFilterComboBox = QComboBox()
+        self.pngFilterComboBox.setToolTip("The filter applied to each row of PNG files before compressing it. Sub and Up often make smooth images smaller. " +
+                                          "Average and Paeth require NumPy.")
+        self.pngFilterComboBox.setMaximumWidth(spritePropertiesFieldWidth)
+        for filterName in PNG_FILTER_TYPES:
+            self.pngFilterComboBox.addItem(filterName)
+
         # Containers for the sprite properties UI
         self.spritePropertiesContainer = QGroupBox("Sprite properties")
         self.spritePropertiesLayout = QFormLayout(self.spritePropertiesContainer)
@@ -84,15 +171,60 @@ class UISpritesheetGenerator(object):
         self.filterStrategyComboBox.addItem("Auto")
         self.filterStrategyComboBox.addItems(self.krita.filterStrategies())
         
+        # Toggle to fill the padding with the edge pixels of each sprite
+        self.extrudePaddingCheckBox = QCheckBox("Extrude padding")
+        self.extrudePaddingCheckBox.setToolTip("If enabled, the padding around each sprite will be filled with copies of the sprite's edge pixels instead of being transparent. " +
+                                               "Prevents texture filtering from blending sprites with their transparent borders.")
+
+        # Toggle to resize each rendered frame instead of the whole document
+        self.resizeFramesIndividuallyCheckBox = QCheckBox("Resize frames individually")
+        self.resizeFramesIndividuallyCheckBox.setToolTip("If enabled, each frame will be resized after it is rendered, instead of resizing every layer of a copy of the document. " +
+                                                         "Faster for documents with many layers. Filters other than NearestNeighbor require NumPy.")
+
+        # Widget for exporting the sprites at additional sizes
+        self.spriteVariantsField = QLineEdit()
+        self.spriteVariantsField.setToolTip("Comma separated scale factors (e.g. 1, 2, 0.5) or sizes (e.g. 64x64) to export the spritesheet at. " +
+                                            "Every frame is rendered once and a spritesheet is exported for each variant, with the scale or size added to its file name.")
+        self.spriteVariantsField.setPlaceholderText("e.g. 1, 2, 0.5")
+        self.spriteVariantsField.setMaximumWidth(spritePropertiesFieldWidth)
+
         # Toggle to include/exclude empty frames
         self.ignoreEmptyFramesCheckBox = QCheckBox("Ignore empty frames")
         self.ignoreEmptyFramesCheckBox.setToolTip("If enabled, empty frames in the animation timeline will not be included in the spritesheet.")
         self.ignoreEmptyFramesCheckBox.setChecked(True)
 
+        # Toggle to reuse the previous frame for held exposures instead of rendering them again
+        self.reuseHeldFramesCheckBox = QCheckBox("Reuse held frames")
+        self.reuseHeldFramesCheckBox.setToolTip("If enabled, frames without any keyframes will reuse the previously rendered frame instead of being rendered again. " +
+                                                "Only enable this if layers in the document never change without raster keyframes, e.g. through opacity keyframes or animated transform masks.")
+
+        # Toggle to store identical frames only once in the spritesheet
+        self.deduplicateFramesCheckBox = QCheckBox("Merge identical frames")
+        self.deduplicateFramesCheckBox.setToolTip("If enabled, identical frames will share a single sprite in the spritesheet. " +
+                                                  "A JSON file mapping each frame to its sprite will be exported next to the spritesheet.")
+
+        # Toggle to write the spritesheet to disk one row of sprites at a time
+        self.streamToFileCheckBox = QCheckBox("Low memory export")
+        self.streamToFileCheckBox.setToolTip("If enabled, the spritesheet will be written to the PNG file one row of sprites at a time instead of being built in memory. " +
+                                             "Useful for very large spritesheets. Not available for packed spritesheets or when merging identical frames.")
+
+        # Toggle to reuse unchanged rows of sprites from the previous export
+        self.incrementalExportCheckBox = QCheckBox("Incremental export")
+        self.incrementalExportCheckBox.setToolTip("If enabled, rows of sprites that haven't changed since the previous export will be reused instead of being encoded again. " +
+                                                  "The cache is stored in a \".spritesheetcache\" folder next to the spritesheet. Not available for packed spritesheets or when merging identical frames.")
+
+        # Toggle to export each top-level layer to its own spritesheet
+        self.nodeSheetsCheckBox = QCheckBox("One spritesheet per layer")
+        self.nodeSheetsCheckBox.setToolTip("If enabled, each selected top-level layer (or every visible top-level layer if none are selected) " +
+                                           "will be exported to its own spritesheet, named after the layer, in a single pass over the timeline.")
+
         # "OK" and "Cancel" buttons
         self.dialogButtonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         self.dialogButtonBox.accepted.connect(self._onConfirmButtonPressed)
         self.dialogButtonBox.rejected.connect(self._onCancelButtonPressed)
+
+        # Pressing Escape or closing the window rejects the dialog, which has to cancel a running export as well.
+        self.mainDialog.rejected.connect(self._onCancelButtonPressed)
         
     def show(self):
         # By default try to use the current document's file path
@@ -116,6 +248,13 @@ class UISpritesheetGenerator(object):
 
          # Add the widget for selecting the spritesheet type
         self.spritesheetLayoutFormLayout.addRow("Spritesheet layout:", self.spritesheetLayoutComboBox)
+        self.spritesheetLayoutFormLayout.addRow("", self.powerOfTwoSizeCheckBox)
+        self.spritesheetLayoutFormLayout.addRow("Compression threads:", self.compressionWorkerCountField)
+        self.spritesheetLayoutFormLayout.addRow("Max page size (px):", self.maxPageSizeField)
+        self.spritesheetLayoutFormLayout.addRow("Output format:", self.outputFormatComboBox)
+        self.spritesheetLayoutFormLayout.addRow("", self.convertToEightBitCheckBox)
+        self.spritesheetLayoutFormLayout.addRow("PNG compression:", self.pngCompressionLevelField)
+        self.spritesheetLayoutFormLayout.addRow("PNG filter:", self.pngFilterComboBox)
         self.mainLayout.addLayout(self.spritesheetLayoutFormLayout)
 
         # Add a divider
@@ -129,11 +268,32 @@ class UISpritesheetGenerator(object):
         self.spritePropertiesLayout.addRow("Height (px):", self.spriteHeightField)
         self.spritePropertiesLayout.addRow("Filter:", self.filterStrategyComboBox)
         self.spritePropertiesLayout.addRow("Padding (px):", self.spritePaddingField)
+        self.spritePropertiesLayout.addRow("", self.extrudePaddingCheckBox)
+        self.spritePropertiesLayout.addRow("", self.resizeFramesIndividuallyCheckBox)
+        self.spritePropertiesLayout.addRow("Variants:", self.spriteVariantsField)
         self.mainLayout.addWidget(self.spritePropertiesContainer)
 
         # Add the toggle for including/excluding empty frames
         self.mainLayout.addWidget(self.ignoreEmptyFramesCheckBox)
 
+        # Add the toggle for reusing held frames
+        self.mainLayout.addWidget(self.reuseHeldFramesCheckBox)
+
+        # Add the toggle for merging identical frames
+        self.mainLayout.addWidget(self.deduplicateFramesCheckBox)
+
+        # Add the toggle for low memory exports
+        self.mainLayout.addWidget(self.streamToFileCheckBox)
+
+        # Add the toggle for incremental exports
+        self.mainLayout.addWidget(self.incrementalExportCheckBox)
+
+        # Add the toggle for exporting a spritesheet per layer
+        self.mainLayout.addWidget(self.nodeSheetsCheckBox)
+
+        # Add the export progress bar
+        self.mainLayout.addWidget(self.exportProgressBar)
+
         # Add the "OK" and "Cancel" buttons
         self.mainLayout.addWidget(self.dialogButtonBox)
         
@@ -144,27 +304,94 @@ class UISpritesheetGenerator(object):
         self.mainDialog.exec()
 
     def _onConfirmButtonPressed(self):
-        self.mainDialog.setEnabled(False)
-
-        self.spritesheetGenerator.configure(
-            self.filePathField.text(),
-            self.spritesheetLayoutComboBox.currentText(),
-            self.ignoreEmptyFramesCheckBox.isChecked(),
-            self.spriteWidthField.value(),
-            self.spriteHeightField.value(),
-            self.spritePaddingField.value(),
-            self.filterStrategyComboBox.currentText())
-        
-        self.spritesheetGenerator.export()
+        # Only the "Cancel" button stays enabled while exporting.
+        self._setExportOptionsEnabled(False)
+        self.exportProgressBar.setVisible(True)
+
+        # Invalid options are reported, and the dialog is enabled again so that they can be corrected.
+        try:
+            self.spritesheetGenerator.configure(
+                self.filePathField.text(),
+                self.spritesheetLayoutComboBox.currentText(),
+                self.ignoreEmptyFramesCheckBox.isChecked(),
+                self.spriteWidthField.value(),
+                self.spriteHeightField.value(),
+                self.spritePaddingField.value(),
+                self.filterStrategyComboBox.currentText(),
+                reuseHeldFrames=self.reuseHeldFramesCheckBox.isChecked(),
+                deduplicateFrames=self.deduplicateFramesCheckBox.isChecked(),
+                powerOfTwoSize=self.powerOfTwoSizeCheckBox.isChecked(),
+                streamToFile=self.streamToFileCheckBox.isChecked(),
+                compressionWorkerCount=self.compressionWorkerCountField.value(),
+                incrementalExport=self.incrementalExportCheckBox.isChecked(),
+                resizeFramesIndividually=self.resizeFramesIndividuallyCheckBox.isChecked(),
+                extrudePadding=self.extrudePaddingCheckBox.isChecked(),
+                maxPageSize=self.maxPageSizeField.value(),
+                spriteVariants=parseSpriteVariants(self.spriteVariantsField.text()),
+                convertToEightBit=self.convertToEightBitCheckBox.isChecked(),
+                outputFormat=self.outputFormatComboBox.currentText(),
+                pngCompressionLevel=self.pngCompressionLevelField.value(),
+                pngFilter=self.pngFilterComboBox.currentText(),
+                nodeSheets=self._getSelectedTopLevelNodeNames() if self.nodeSheetsCheckBox.isChecked() else None)
+        except Exception as exception:
+            self._reportInvalidOptions(exception)
+            return
+
+        self.isExporting = True
+        try:
+            self.spritesheetGenerator.export()
+        except ExportCancelled:
+            pass
+        except Exception as exception:
+            # Some options, like a maximum page size smaller than the sprites or missing layers, are only found to be invalid during the export.
+            self._reportInvalidOptions(exception)
+            return
+        finally:
+            self.isExporting = False
+
         self.mainDialog.close()
 
+    def _reportInvalidOptions(self, exception):
+        self.exportProgressBar.setVisible(False)
+        self._setExportOptionsEnabled(True)
+        QMessageBox.warning(self.mainDialog, "Spritesheet Generator", str(exception))
+
+    def _getSelectedTopLevelNodeNames(self):
+        # Only the top-level layers selected in the layers docker get their own spritesheet.
+        # If none are selected, every visible top-level layer does.
+        selectedNodes = []
+        if self.krita.activeWindow() is not None and self.krita.activeWindow().activeView() is not None:
+            selectedNodes = self.krita.activeWindow().activeView().selectedNodes()
+
+        selectedNodeIds = [node.uniqueId() for node in selectedNodes]
+        return [node.name() for node in self.activeDocument.topLevelNodes() if node.uniqueId() in selectedNodeIds]
+
     def _onCancelButtonPressed(self):
-        self.mainDialog.close()
+        # During an export, the export is cancelled before the next frame and the dialog is closed once it has stopped.
+        if self.isExporting:
+            self.instrumentation.cancel()
+        else:
+            self.mainDialog.close()
+
+    def _setExportOptionsEnabled(self, enabled):
+        self.dialogButtonBox.button(QDialogButtonBox.Ok).setEnabled(enabled)
+        self._setLayoutEnabled(self.mainLayout, enabled)
+
+    def _setLayoutEnabled(self, layout, enabled):
+        # Widgets in nested layouts, such as the file path and the spritesheet layout options, are included.
+        for index in range(layout.count()):
+            item = layout.itemAt(index)
+            widget = item.widget()
+            if widget is not None:
+                if widget is not self.dialogButtonBox and widget is not self.exportProgressBar:
+                    widget.setEnabled(enabled)
+            elif item.layout() is not None:
+                self._setLayoutEnabled(item.layout(), enabled)
 
     def _onBrowseButtonPressed(self):
         fileDialog = QFileDialog()
         fileDialog.setWindowTitle("Exporting Spritesheet")
-        fileDialog.setNameFilter("PNG image (*.png)")
+        fileDialog.setNameFilter("PNG image (*.png);;Raw RGBA image (*.rgba);;DDS texture (*.dds)")
         
         if fileDialog.exec():
             fileNames = fileDialog.selectedFiles()
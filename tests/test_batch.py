@@ -0,0 +1,72 @@
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import contextlib
+from pathlib import Path
+
+from spritesheetgenerator import batch
+from spritesheetgenerator.pngfile import PngWriter, readPng
+
+# Runs the batch exporter on directories of PNG frames, which are opened without Krita.
+
+FRAME_WIDTH = 8
+FRAME_HEIGHT = 6
+
+def writeFrame(filePath, index):
+    pngWriter = PngWriter(str(filePath), FRAME_WIDTH, FRAME_HEIGHT, "RGBA", "U8")
+    pngWriter.writeRows(bytes([index * 40, 255 - index * 40, 0, 255]) * (FRAME_WIDTH * FRAME_HEIGHT), FRAME_HEIGHT)
+    pngWriter.close()
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+        # Two animations of four frames each, where the last frame of the walk repeats its first frame.
+        for name, frameIndices in [("walk", [0, 1, 2, 0]), ("run", [3, 4, 5, 6])]:
+            self.directory.joinpath(name).mkdir()
+            for time, index in enumerate(frameIndices):
+                writeFrame(self.directory.joinpath(name, f"{time:02}.png"), index)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runBatch(self, arguments):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return batch.main([str(argument) for argument in arguments])
+
+    def test_every_input_is_exported(self):
+        outputDirectory = self.directory.joinpath("out")
+        result = self.runBatch([self.directory.joinpath("walk"), self.directory.joinpath("run"), "--output-directory", outputDirectory,
+                                "--type", "Horizontal Strip", "--padding", "1", "--merge-identical-frames"])
+
+        self.assertEqual(result, 0)
+        self.assertEqual(sorted(path.name for path in outputDirectory.iterdir()), ["run.json", "run.png", "walk.json", "walk.png"])
+
+        # The sprites default to the size of the frames, and the repeated frame of the walk shares a cell.
+        width, height, colorModel, colorDepth, pixels = readPng(outputDirectory.joinpath("walk.png"))
+        self.assertEqual((width, height), (3 * (FRAME_WIDTH + 2), FRAME_HEIGHT + 2))
+        with open(outputDirectory.joinpath("walk.json")) as frameMapFile:
+            self.assertEqual([frame["cell"] for frame in json.load(frameMapFile)["frames"]], [0, 1, 2, 0])
+
+    def test_export_options_are_passed_to_the_generator(self):
+        self.runBatch([self.directory.joinpath("run"), "--width", "4", "--height", "3", "--output-format", "DDS", "--variants", "1,2"])
+
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir() if path.is_file()), ["run.dds", "run@2x.dds"])
+        with open(self.directory.joinpath("run@2x.dds"), "rb") as ddsFile:
+            header = ddsFile.read(20)
+
+        # The height and width of the 2x variant, with the 4 frames in 2 rows and 2 columns.
+        self.assertEqual((int.from_bytes(header[12:16], "little"), int.from_bytes(header[16:20], "little")), (2 * 6, 2 * 8))
+
+    def test_failed_jobs_dont_stop_the_batch(self):
+        outputDirectory = self.directory.joinpath("out")
+        result = self.runBatch([self.directory.joinpath("missing"), self.directory.joinpath("run"), "--output-directory", outputDirectory])
+
+        self.assertEqual(result, 1)
+        self.assertEqual(sorted(path.name for path in outputDirectory.iterdir()), ["run.png"])
+
+if __name__ == "__main__":
+    unittest.main()
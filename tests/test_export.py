@@ -0,0 +1,528 @@
+import io
+import json
+import shutil
+import tempfile
+import struct
+import unittest
+import contextlib
+from pathlib import Path
+
+from spritesheetgenerator.spritesheetgenerator import SpritesheetGenerator, parseSpriteVariants, DEFAULT_PNG_COMPRESSION_LEVEL
+from spritesheetgenerator.inmemorybackend import InMemoryBackend, InMemoryDocument, InMemoryNode
+from spritesheetgenerator.exportinstrumentation import ExportInstrumentation, ExportSink, ExportCancelled
+from spritesheetgenerator.pngfile import readPng, isPngFilterAvailable, PNG_FILTER_TYPES
+from spritesheetgenerator.rectpacker import packRects, packRectsIntoPages
+from spritesheetgenerator.resampling import resamplePixelData, isResamplingAvailable
+from spritesheetgenerator.colorconversion import convertToEightBit
+from spritesheetgenerator.palette import isPaletteAvailable
+
+# Exports documents held in memory and checks that every way of writing a spritesheet
+# produces the same pixels as building the whole atlas in memory and exporting it with the backend.
+
+SPRITE_WIDTH = 16
+SPRITE_HEIGHT = 12
+FRAME_COUNT = 10
+
+def createFrame(index, width=SPRITE_WIDTH, height=SPRITE_HEIGHT):
+    # A partly transparent frame whose content and bounds change with every index.
+    pixels = bytearray(width * height * 4)
+    for pixel in range(width * height):
+        x = pixel % width
+        y = pixel // width
+        if 2 <= x < 13 - index % 5 and 1 + index % 5 <= y < 10:
+            pixels[pixel * 4:pixel * 4 + 4] = bytes([index * 20 % 256, (pixel * 3 + index) % 256, pixel * 5 % 256, 255 if x % 3 else 128])
+
+    return bytes(pixels)
+
+def createDocument(width=SPRITE_WIDTH, height=SPRITE_HEIGHT):
+    # Every frame is held for two frames.
+    document = InMemoryDocument(width, height, endTime=FRAME_COUNT - 1)
+    keyframes = {time: createFrame(time, width, height) for time in range(0, FRAME_COUNT, 2)}
+    document.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+    return document
+
+def getStripFrames(filePath, frameWidth, frameHeight):
+    # The pixels of every sprite of a horizontal strip without padding.
+    width, height, colorModel, colorDepth, pixels = readPng(filePath)
+    frames = []
+    for x in range(0, width, frameWidth):
+        frames.append(b"".join(pixels[(y * width + x) * 4:(y * width + x + frameWidth) * 4] for y in range(frameHeight)))
+
+    return frames
+
+def readFrameMap(filePath):
+    with open(Path(filePath).with_suffix(".json")) as frameMapFile:
+        return json.load(frameMapFile)
+
+def getCellPixelData(filePath, cell):
+    # The pixels of a cell of a frame map.
+    width, height, colorModel, colorDepth, pixels = readPng(filePath)
+    return b"".join(pixels[((cell["y"] + y) * width + cell["x"]) * 4:((cell["y"] + y) * width + cell["x"] + cell["width"]) * 4] for y in range(cell["height"]))
+
+def createLayeredDocument():
+    # Two layers with keyframes at different times.
+    document = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, endTime=FRAME_COUNT - 1)
+    document.rootNode().addChildNode(InMemoryNode("Body", keyframes={time: createFrame(time) for time in range(0, FRAME_COUNT, 2)}), None)
+    document.rootNode().addChildNode(InMemoryNode("Arms", keyframes={time: createFrame(time + 1) for time in range(0, FRAME_COUNT, 3)}), None)
+    return document
+
+class CancelAfterFrames(ExportSink):
+    # Cancels the export once a number of frames were rendered or reused, counting the frames of every spritesheet it writes.
+
+    def __init__(self, instrumentation, frameCount):
+        self.instrumentation = instrumentation
+        self.frameCount = frameCount
+        self.renderedFrameCount = 0
+
+    def onFrameRendered(self, time, renderTime, byteCount, reused):
+        self.renderedFrameCount += 1
+        if self.renderedFrameCount >= self.frameCount:
+            self.instrumentation.cancel()
+
+class MessageRecorder(ExportSink):
+
+    def __init__(self):
+        self.messages = []
+
+    def onLog(self, message):
+        self.messages.append(message)
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, fileName, spritesheetType="Rows", document=None, instrumentation=None, spriteSize=(SPRITE_WIDTH, SPRITE_HEIGHT), **options):
+        document = document if document is not None else createDocument()
+        instrumentation = instrumentation if instrumentation is not None else ExportInstrumentation([])
+        spritesheetGenerator = SpritesheetGenerator(InMemoryBackend(document), instrumentation)
+        filePath = str(Path(self.directory).joinpath(fileName))
+        with contextlib.redirect_stdout(io.StringIO()):
+            spritesheetGenerator.configure(filePath, spritesheetType, options.pop("ignoreEmptyFrames", False), spriteSize[0], spriteSize[1],
+                                           options.pop("padding", 1), options.pop("filterStrategy", "NearestNeighbor"), document=document, **options)
+            spritesheetGenerator.export()
+
+        return spritesheetGenerator
+
+    def assertSamePixels(self, filePath, referenceFilePath):
+        self.assertEqual(readPng(filePath), readPng(referenceFilePath))
+
+class SpritesheetOutputTests(ExportTestCase):
+
+    def test_threaded_output_matches_atlas(self):
+        for spritesheetType in ["Rows", "Columns", "Packed"]:
+            with self.subTest(spritesheetType=spritesheetType):
+                reference = self.export("reference.png", spritesheetType)
+                threaded = self.export("threaded.png", spritesheetType, compressionWorkerCount=3)
+                self.assertSamePixels(threaded.exportFilePath, reference.exportFilePath)
+
+    def test_streamed_output_matches_atlas(self):
+        for spritesheetType in ["Rows", "Columns", "Horizontal Strip", "Vertical Strip"]:
+            for compressionWorkerCount in [1, 3]:
+                with self.subTest(spritesheetType=spritesheetType, compressionWorkerCount=compressionWorkerCount):
+                    reference = self.export("reference.png", spritesheetType)
+                    streamed = self.export("streamed.png", spritesheetType, streamToFile=True, compressionWorkerCount=compressionWorkerCount)
+                    self.assertSamePixels(streamed.exportFilePath, reference.exportFilePath)
+
+    def test_incremental_output_matches_atlas(self):
+        reference = self.export("reference.png")
+        first = self.export("incremental.png", incrementalExport=True)
+        self.assertSamePixels(first.exportFilePath, reference.exportFilePath)
+
+        # Nothing changed, so every row of sprites is reused from the cache.
+        second = self.export("incremental.png", incrementalExport=True)
+        self.assertSamePixels(second.exportFilePath, reference.exportFilePath)
+        self.assertEqual(second.instrumentation.counters["encodedRows"], 0)
+
+    def test_filtered_output_matches_atlas(self):
+        reference = self.export("reference.png")
+        for filterName in PNG_FILTER_TYPES:
+            if not isPngFilterAvailable(filterName):
+                continue
+
+            for streamToFile in [False, True]:
+                with self.subTest(filterName=filterName, streamToFile=streamToFile):
+                    filtered = self.export("filtered.png", pngFilter=filterName, pngCompressionLevel=9, streamToFile=streamToFile)
+                    self.assertSamePixels(filtered.exportFilePath, reference.exportFilePath)
+
+    def test_empty_frames_are_ignored(self):
+        # Only the frames with keyframes are exported.
+        exported = self.export("keyframes.png", "Horizontal Strip", padding=0, ignoreEmptyFrames=True)
+        self.assertEqual(getStripFrames(exported.exportFilePath, SPRITE_WIDTH, SPRITE_HEIGHT),
+                         [createFrame(time) for time in range(0, FRAME_COUNT, 2)])
+
+    def test_pages_match_single_sheet(self):
+        reference = self.export("reference.png", padding=0)
+        paged = self.export("paged.png", padding=0, maxPageSize=40)
+        referenceWidth, referenceHeight, colorModel, colorDepth, referencePixels = readPng(reference.exportFilePath)
+
+        # Every sprite on the pages is the same as the sprite of the same frame in the single spritesheet.
+        pages = [readPng(page.filePath) for page in paged.pages]
+        self.assertGreater(len(pages), 1)
+        for cellIndex, cell in enumerate(paged.spritesheetCells):
+            width, height, colorModel, colorDepth, pixels = pages[paged.cellPages[cellIndex]]
+            referenceCell = reference.spritesheetCells[cellIndex]
+            for row in range(cell.height):
+                start = ((cell.y + row) * width + cell.x) * 4
+                referenceStart = ((referenceCell.y + row) * referenceWidth + referenceCell.x) * 4
+                self.assertEqual(pixels[start:start + cell.width * 4], referencePixels[referenceStart:referenceStart + cell.width * 4])
+
+class OutputFormatTests(ExportTestCase):
+
+    def test_png_options_are_reported_for_color_spaces_exported_by_krita(self):
+        # Floating point pixels can only be encoded by Krita's PNG exporter, unless they are converted to 8 bits.
+        document = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, colorDepth="F32")
+        for convertToEightBit, expectedFilter in [(False, "None"), (True, "Sub")]:
+            with self.subTest(convertToEightBit=convertToEightBit):
+                recorder = MessageRecorder()
+                spritesheetGenerator = SpritesheetGenerator(InMemoryBackend(document), ExportInstrumentation([recorder]))
+                spritesheetGenerator.configure(str(Path(self.directory).joinpath("float.png")), "Rows", False, SPRITE_WIDTH, SPRITE_HEIGHT, 0,
+                                               "NearestNeighbor", convertToEightBit=convertToEightBit, pngFilter="Sub", pngCompressionLevel=9,
+                                               document=document)
+
+                self.assertEqual(spritesheetGenerator.pngFilter, expectedFilter)
+                self.assertEqual(spritesheetGenerator.pngCompressionLevel, 9 if convertToEightBit else DEFAULT_PNG_COMPRESSION_LEVEL)
+                self.assertEqual(any("Krita's default PNG options" in message for message in recorder.messages), not convertToEightBit)
+
+    def test_sixteen_bit_frames_are_converted_to_eight_bits(self):
+        reference = self.export("reference.png")
+
+        # Every 8 bit value v is stored as v * 257, which is converted back to v.
+        document = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, colorDepth="U16", endTime=FRAME_COUNT - 1)
+        keyframes = {time: bytes(value for value in createFrame(time) for byte in range(2)) for time in range(0, FRAME_COUNT, 2)}
+        document.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+
+        for options in [{}, {"streamToFile": True}, {"compressionWorkerCount": 3}]:
+            with self.subTest(options=options):
+                exported = self.export("converted.png", document=document, convertToEightBit=True, **options)
+                self.assertSamePixels(exported.exportFilePath, reference.exportFilePath)
+
+        self.assertEqual(readPng(self.export("sixteen.png", document=document).exportFilePath)[3], "U16")
+
+    def test_sixteen_bit_values_are_rounded(self):
+        values = list(range(65536))
+        pixelData = struct.pack(f"<{len(values)}H", *values)
+        self.assertEqual(convertToEightBit(pixelData, "RGBA", "U16"), bytes(round(value * 255 / 65535) for value in values))
+
+    def test_indexed_png_keeps_colors(self):
+        if not isPaletteAvailable():
+            self.skipTest("Indexed PNG files require NumPy")
+
+        # A few colors, which fit in a palette without being reduced.
+        document = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, endTime=FRAME_COUNT - 1)
+        colors = [bytes([0, 0, 0, 0]), bytes([255, 0, 0, 255]), bytes([0, 128, 255, 255]), bytes([10, 20, 30, 128])]
+        keyframes = {time: b"".join(colors[(pixel + time) % len(colors)] for pixel in range(SPRITE_WIDTH * SPRITE_HEIGHT)) for time in range(FRAME_COUNT)}
+        document.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+
+        reference = self.export("reference.png", document=document)
+        indexed = self.export("indexed.png", document=document, outputFormat="Indexed PNG")
+        self.assertSamePixels(indexed.exportFilePath, reference.exportFilePath)
+
+        # The color type in the header of the file is 3 for palette indices.
+        with open(indexed.exportFilePath, "rb") as indexedFile:
+            self.assertEqual(indexedFile.read(26)[25], 3)
+
+    def test_raw_rgba_files_have_premultiplied_pixels(self):
+        width, height, colorModel, colorDepth, pixels = readPng(self.export("reference.png").exportFilePath)
+        expectedPixels = bytearray()
+        for offset in range(0, len(pixels), 4):
+            blue, green, red, alpha = pixels[offset:offset + 4]
+            expectedPixels += bytes([(red * alpha + 127) // 255, (green * alpha + 127) // 255, (blue * alpha + 127) // 255, alpha])
+
+        for options in [{}, {"streamToFile": True}]:
+            with self.subTest(options=options):
+                exported = self.export("raw.png", outputFormat="Raw RGBA", **options)
+                self.assertEqual(Path(exported.exportFilePath).name, "raw.rgba")
+                with open(exported.exportFilePath, "rb") as rawFile:
+                    data = rawFile.read()
+
+                self.assertEqual(struct.unpack("<4sIII", data[:16]), (b"RGBA", width, height, 1))
+                self.assertEqual(data[16:], bytes(expectedPixels))
+
+    def test_dds_files_have_bgra_pixels(self):
+        width, height, colorModel, colorDepth, pixels = readPng(self.export("reference.png").exportFilePath)
+        for options in [{}, {"streamToFile": True}]:
+            with self.subTest(options=options):
+                exported = self.export("texture.png", outputFormat="DDS", **options)
+                self.assertEqual(Path(exported.exportFilePath).name, "texture.dds")
+                with open(exported.exportFilePath, "rb") as ddsFile:
+                    data = ddsFile.read()
+
+                # The magic number, the size of the header, its flags, the height, width and pitch, then the pixel format.
+                self.assertEqual(struct.unpack("<4s5I", data[:24]), (b"DDS ", 124, 0x100f, height, width, width * 4))
+                self.assertEqual(struct.unpack("<8I", data[76:108]), (32, 0x41, 0, 32, 0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000))
+                self.assertEqual(data[128:], pixels)
+
+class FrameMapTests(ExportTestCase):
+
+    def test_identical_frames_share_cells(self):
+        # The first keyframe is repeated at time 6, after other keyframes.
+        document = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, endTime=7)
+        keyframes = {0: createFrame(0), 2: createFrame(1), 4: createFrame(2), 6: createFrame(0)}
+        document.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+
+        for spritesheetType in ["Rows", "Packed"]:
+            with self.subTest(spritesheetType=spritesheetType):
+                exported = self.export("merged.png", spritesheetType, document=document, deduplicateFrames=True)
+                frameMap = readFrameMap(exported.exportFilePath)
+                self.assertEqual(frameMap["image"], "merged.png")
+                self.assertEqual(len(frameMap["cells"]), 3)
+                self.assertEqual([frame["time"] for frame in frameMap["frames"]], list(range(8)))
+                self.assertEqual([frame["cell"] for frame in frameMap["frames"]], [0, 0, 1, 1, 2, 2, 0, 0])
+
+    def test_cells_hold_the_pixels_of_their_frames(self):
+        exported = self.export("merged.png", deduplicateFrames=True)
+        frameMap = readFrameMap(exported.exportFilePath)
+        self.assertEqual(len(frameMap["cells"]), FRAME_COUNT // 2)
+        for frame in frameMap["frames"]:
+            cell = frameMap["cells"][frame["cell"]]
+            self.assertEqual(getCellPixelData(exported.exportFilePath, cell), createFrame(frame["time"] - frame["time"] % 2))
+
+    def test_grid_cells_are_the_sprites_inside_their_padding(self):
+        exported = self.export("merged.png", "Horizontal Strip", padding=2, deduplicateFrames=True)
+        frameMap = readFrameMap(exported.exportFilePath)
+        self.assertEqual(frameMap["padding"], 2)
+        for index, cell in enumerate(frameMap["cells"]):
+            self.assertEqual(cell, {"x": index * (SPRITE_WIDTH + 4) + 2, "y": 2, "width": SPRITE_WIDTH, "height": SPRITE_HEIGHT, "offsetX": 0, "offsetY": 0})
+
+class PackedSpritesheetTests(ExportTestCase):
+
+    def test_trimmed_cells_restore_their_frames(self):
+        document = createDocument()
+        document.rootNode().childNodes()[0].keyframes[4] = bytes(SPRITE_WIDTH * SPRITE_HEIGHT * 4)
+
+        for padding in [0, 2]:
+            with self.subTest(padding=padding):
+                exported = self.export("packed.png", "Packed", document=document, padding=padding)
+                frameMap = readFrameMap(exported.exportFilePath)
+                for frame in frameMap["frames"]:
+                    # Placing each cell at its offsets in a transparent sprite restores the untrimmed frame.
+                    cell = frameMap["cells"][frame["cell"]]
+                    cellPixelData = getCellPixelData(exported.exportFilePath, cell)
+                    pixels = bytearray(SPRITE_WIDTH * SPRITE_HEIGHT * 4)
+                    for y in range(cell["height"]):
+                        start = ((cell["offsetY"] + y) * SPRITE_WIDTH + cell["offsetX"]) * 4
+                        pixels[start:start + cell["width"] * 4] = cellPixelData[y * cell["width"] * 4:(y + 1) * cell["width"] * 4]
+
+                    keyframeTime = frame["time"] - frame["time"] % 2
+                    self.assertEqual(bytes(pixels), document.rootNode().childNodes()[0].keyframes[keyframeTime])
+
+                    # Fully transparent frames don't take up any space.
+                    if keyframeTime == 4:
+                        self.assertEqual((cell["width"], cell["height"]), (0, 0))
+                    else:
+                        self.assertLess(cell["width"] * cell["height"], SPRITE_WIDTH * SPRITE_HEIGHT)
+
+class PaddingTests(ExportTestCase):
+
+    def test_padding_is_extruded_or_transparent(self):
+        # The edges of packed sprites are opaque once they are trimmed, while grid sprites need opaque frames.
+        opaqueDocument = InMemoryDocument(SPRITE_WIDTH, SPRITE_HEIGHT, endTime=FRAME_COUNT - 1)
+        keyframes = {time: b"".join(bytes([pixel % 256, time * 20, pixel * 3 % 256, 255]) for pixel in range(SPRITE_WIDTH * SPRITE_HEIGHT))
+                     for time in range(FRAME_COUNT)}
+        opaqueDocument.rootNode().addChildNode(InMemoryNode("Frames", keyframes=keyframes), None)
+
+        padding = 2
+        for spritesheetType, document, options in [("Rows", opaqueDocument, {}), ("Rows", opaqueDocument, {"streamToFile": True}), ("Packed", createDocument(), {})]:
+            for extrudePadding in [False, True]:
+                with self.subTest(spritesheetType=spritesheetType, options=options, extrudePadding=extrudePadding):
+                    exported = self.export("padded.png", spritesheetType, document=document, padding=padding, extrudePadding=extrudePadding, **options)
+                    width, height, colorModel, colorDepth, pixels = readPng(exported.exportFilePath)
+                    for cell in exported.spritesheetCells:
+                        if cell.width == 0:
+                            continue
+
+                        # Every pixel around the sprite is a copy of the closest edge pixel of the sprite, or transparent.
+                        for y in range(cell.y - padding, cell.y + cell.height + padding):
+                            for x in range(cell.x - padding, cell.x + cell.width + padding):
+                                if cell.x <= x < cell.x + cell.width and cell.y <= y < cell.y + cell.height:
+                                    continue
+
+                                if extrudePadding:
+                                    edgeX = min(max(x, cell.x), cell.x + cell.width - 1)
+                                    edgeY = min(max(y, cell.y), cell.y + cell.height - 1)
+                                    expectedPixel = pixels[(edgeY * width + edgeX) * 4:(edgeY * width + edgeX + 1) * 4]
+                                else:
+                                    expectedPixel = bytes(4)
+
+                                self.assertEqual(pixels[(y * width + x) * 4:(y * width + x + 1) * 4], expectedPixel)
+
+class HeldFrameTests(ExportTestCase):
+
+    def test_held_frames_are_reused(self):
+        reference = self.export("reference.png")
+        self.assertEqual(reference.instrumentation.counters["reusedFrames"], 0)
+
+        for streamToFile in [False, True]:
+            with self.subTest(streamToFile=streamToFile):
+                # Every keyframe is held for two frames, so every other frame is reused.
+                exported = self.export("held.png", reuseHeldFrames=True, streamToFile=streamToFile)
+                self.assertSamePixels(exported.exportFilePath, reference.exportFilePath)
+                self.assertEqual(exported.instrumentation.counters["renderedFrames"], FRAME_COUNT // 2)
+                self.assertEqual(exported.instrumentation.counters["reusedFrames"], FRAME_COUNT // 2)
+
+    def test_documents_that_change_without_keyframes_render_every_frame(self):
+        document = createDocument()
+        document.rootNode().addChildNode(InMemoryNode("Blur", "filterlayer"), None)
+        exported = self.export("held.png", document=document, reuseHeldFrames=True)
+        self.assertEqual(exported.instrumentation.counters["renderedFrames"], FRAME_COUNT)
+        self.assertEqual(exported.instrumentation.counters["reusedFrames"], 0)
+
+class SpriteVariantTests(ExportTestCase):
+
+    def test_variants_are_resampled_from_sizes_at_least_as_large(self):
+        # Frames are rendered at 64 x 20, the 64 x 4 and 20 x 20 variants are resampled from the rendered frames,
+        # and the 10 x 10 variant from the 20 x 20 variant.
+        filterStrategy = "Box" if isResamplingAvailable("Box") else "NearestNeighbor"
+        variantSizes = [(64, 4), (20, 20), (10, 10)]
+        exported = self.export("variants.png", "Horizontal Strip", document=createDocument(64, 20), spriteSize=(64, 20), padding=0,
+                               spriteVariants=variantSizes)
+
+        for width, height in variantSizes:
+            with self.subTest(width=width, height=height):
+                frames = getStripFrames(str(Path(self.directory).joinpath(f"variants_{width}x{height}.png")), width, height)
+                self.assertEqual(len(frames), FRAME_COUNT)
+                for frameTime, pixelData in enumerate(frames):
+                    expectedPixelData = createFrame(frameTime - frameTime % 2, 64, 20)
+                    if (width, height) == (10, 10):
+                        expectedPixelData = resamplePixelData(expectedPixelData, 64, 20, "RGBA", "U8", 20, 20, filterStrategy)
+                        expectedPixelData = resamplePixelData(expectedPixelData, 20, 20, "RGBA", "U8", 10, 10, filterStrategy)
+                    else:
+                        expectedPixelData = resamplePixelData(expectedPixelData, 64, 20, "RGBA", "U8", width, height, filterStrategy)
+
+                    self.assertEqual(pixelData, expectedPixelData)
+
+    def test_variant_of_sprite_size_matches_single_spritesheet(self):
+        reference = self.export("reference.png")
+        self.export("variants.png", spriteVariants=parseSpriteVariants("1, 0.5"))
+        self.assertSamePixels(str(Path(self.directory).joinpath("variants.png")), reference.exportFilePath)
+
+        width, height, colorModel, colorDepth, pixels = readPng(str(Path(self.directory).joinpath("variants@0.5x.png")))
+        self.assertEqual((width, height), (4 * (SPRITE_WIDTH // 2 + 2), 3 * (SPRITE_HEIGHT // 2 + 2)))
+
+class LayerSpritesheetTests(ExportTestCase):
+
+    def test_each_layer_gets_a_spritesheet_of_its_keyframes(self):
+        exported = self.export("layers.png", document=createLayeredDocument(), ignoreEmptyFrames=True, nodeSheets=[])
+        self.assertEqual(sorted(path.name for path in Path(self.directory).iterdir()),
+                         ["layers_Arms.json", "layers_Arms.png", "layers_Body.json", "layers_Body.png"])
+
+        for name, keyframeTimes, frameOffset in [("Body", [0, 2, 4, 6, 8], 0), ("Arms", [0, 3, 6, 9], 1)]:
+            with self.subTest(name=name):
+                filePath = str(Path(self.directory).joinpath(f"layers_{name}.png"))
+                frameMap = readFrameMap(filePath)
+                self.assertEqual([frame["time"] for frame in frameMap["frames"]], keyframeTimes)
+                for frame in frameMap["frames"]:
+                    self.assertEqual(getCellPixelData(filePath, frameMap["cells"][frame["cell"]]), createFrame(frame["time"] + frameOffset))
+
+    def test_named_layers_and_groups(self):
+        # The spritesheet of a group layer has the pixels of its children.
+        document = createLayeredDocument()
+        document.rootNode().addChildNode(InMemoryNode("Effects", "grouplayer", children=[InMemoryNode("Spark", pixelData=createFrame(7))]), None)
+        self.export("layers.png", document=document, nodeSheets=["Effects"])
+        self.assertEqual(sorted(path.name for path in Path(self.directory).iterdir()), ["layers_Effects.json", "layers_Effects.png"])
+
+        filePath = str(Path(self.directory).joinpath("layers_Effects.png"))
+        frameMap = readFrameMap(filePath)
+        self.assertEqual(len(frameMap["frames"]), FRAME_COUNT)
+        for frame in frameMap["frames"]:
+            self.assertEqual(getCellPixelData(filePath, frameMap["cells"][frame["cell"]]), createFrame(7))
+
+    def test_invalid_layer_names(self):
+        document = createLayeredDocument()
+        document.rootNode().addChildNode(InMemoryNode("Body"), None)
+        for nodeSheets, message in [(["Legs"], "doesn't have a top-level layer named Legs"), (["Body"], "more than one top-level layer named Body")]:
+            with self.subTest(nodeSheets=nodeSheets):
+                with self.assertRaisesRegex(Exception, message):
+                    self.export("layers.png", document=document, nodeSheets=nodeSheets)
+
+class CancellationTests(ExportTestCase):
+
+    def test_cancelled_export_removes_incomplete_files(self):
+        for options in [{}, {"streamToFile": True}, {"incrementalExport": True}, {"compressionWorkerCount": 3}, {"maxPageSize": 40}]:
+            with self.subTest(options=options):
+                document = createDocument()
+                document.setCurrentTime(4)
+                instrumentation = ExportInstrumentation([])
+                instrumentation.addSink(CancelAfterFrames(instrumentation, 5))
+
+                with self.assertRaises(ExportCancelled):
+                    self.export("cancelled.png", document=document, instrumentation=instrumentation, **options)
+
+                # The document is returned to the frame it was showing, and no spritesheet is left behind.
+                self.assertEqual(document.currentTime(), 4)
+                self.assertEqual([path.name for path in Path(self.directory).iterdir() if path.is_file()], [])
+
+    def test_late_cancel_doesnt_stop_next_export(self):
+        # A cancel that arrives once the export has finished doesn't stop the next export with the same instrumentation.
+        instrumentation = ExportInstrumentation([])
+        reference = self.export("reference.png", instrumentation=instrumentation)
+        instrumentation.cancel()
+
+        exported = self.export("exported.png", instrumentation=instrumentation)
+        self.assertSamePixels(exported.exportFilePath, reference.exportFilePath)
+
+    def test_cancelled_export_removes_earlier_spritesheets_and_frame_maps(self):
+        # Each export is cancelled while its last spritesheet is written, after the others and their frame maps were written.
+        for createCancelledDocument, options, frameCount in [(createDocument, {"spriteVariants": [1, 0.5], "deduplicateFrames": True}, 25),
+                                                             (createLayeredDocument, {"nodeSheets": []}, 25)]:
+            with self.subTest(options=options):
+                document = createCancelledDocument()
+                instrumentation = ExportInstrumentation([])
+                instrumentation.addSink(CancelAfterFrames(instrumentation, frameCount))
+
+                with self.assertRaises(ExportCancelled):
+                    self.export("cancelled.png", document=document, instrumentation=instrumentation, **options)
+
+                self.assertEqual([path.name for path in Path(self.directory).iterdir() if path.is_file()], [])
+
+class PackingTests(unittest.TestCase):
+
+    def test_packed_rects_fit_without_overlapping(self):
+        sizes = [(7, 3), (5, 5), (12, 2), (1, 9), (4, 4), (0, 0), (6, 6), (3, 8)]
+        for powerOfTwo in [False, True]:
+            with self.subTest(powerOfTwo=powerOfTwo):
+                result = packRects(sizes, powerOfTwo)
+                self._assertPacked(sizes, list(range(len(sizes))), result.positions, result.width, result.height)
+
+    def test_pages_stay_within_max_page_size(self):
+        sizes = [(9, 7), (5, 12), (16, 16), (8, 3), (11, 11), (2, 2)] * 3
+        pages = packRectsIntoPages(sizes, 20, False)
+        self.assertEqual(sorted(index for page in pages for index in page.indices), list(range(len(sizes))))
+        for page in pages:
+            self.assertLessEqual(page.width, 20)
+            self.assertLessEqual(page.height, 20)
+            self._assertPacked(sizes, page.indices, page.positions, page.width, page.height)
+
+    def _assertPacked(self, sizes, indices, positions, width, height):
+        rects = []
+        for index, (x, y) in zip(indices, positions):
+            rectWidth, rectHeight = sizes[index]
+            if rectWidth == 0 or rectHeight == 0:
+                continue
+
+            self.assertLessEqual(x + rectWidth, width)
+            self.assertLessEqual(y + rectHeight, height)
+            for otherX, otherY, otherWidth, otherHeight in rects:
+                self.assertFalse(x < otherX + otherWidth and otherX < x + rectWidth and y < otherY + otherHeight and otherY < y + rectHeight)
+
+            rects.append((x, y, rectWidth, rectHeight))
+
+class ResamplingTests(unittest.TestCase):
+
+    def test_uniform_frames_stay_uniform(self):
+        pixelData = bytes([30, 60, 90, 255]) * (SPRITE_WIDTH * SPRITE_HEIGHT)
+        for filterStrategy in ["NearestNeighbor", "Box", "Bilinear", "Bicubic", "Lanczos3"]:
+            if not isResamplingAvailable(filterStrategy):
+                continue
+
+            for newWidth, newHeight in [(8, 6), (40, 30), (5, 17)]:
+                with self.subTest(filterStrategy=filterStrategy, newWidth=newWidth, newHeight=newHeight):
+                    resizedPixelData = resamplePixelData(pixelData, SPRITE_WIDTH, SPRITE_HEIGHT, "RGBA", "U8", newWidth, newHeight, filterStrategy)
+                    self.assertEqual(resizedPixelData, bytes([30, 60, 90, 255]) * (newWidth * newHeight))
+
+if __name__ == "__main__":
+    unittest.main()
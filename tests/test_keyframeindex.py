@@ -0,0 +1,59 @@
+import unittest
+
+from spritesheetgenerator.keyframeindex import KeyframeIndex
+from spritesheetgenerator.inmemorybackend import InMemoryDocument, InMemoryNode
+
+# Checks the keyframe times found by a single walk over the node tree of a document held in memory.
+
+def createKeyframes(times):
+    return {time: bytes(4) for time in times}
+
+def createDocument(*topLevelNodes):
+    document = InMemoryDocument(1, 1, endTime=9)
+    for node in topLevelNodes:
+        document.rootNode().addChildNode(node, None)
+
+    return document
+
+class KeyframeIndexTests(unittest.TestCase):
+
+    def test_keyframes_of_visible_nodes_and_their_children(self):
+        body = InMemoryNode("Body", "grouplayer", children=[
+            InMemoryNode("Torso", keyframes=createKeyframes([0, 4])),
+            InMemoryNode("Head", "grouplayer", children=[InMemoryNode("Eyes", keyframes=createKeyframes([2, 4]))])
+        ])
+        hidden = InMemoryNode("Hidden", "grouplayer", visible=False, children=[InMemoryNode("Sketch", keyframes=createKeyframes([1, 3]))])
+        arms = InMemoryNode("Arms", keyframes=createKeyframes([0, 6, 12]))
+        keyframeIndex = KeyframeIndex(createDocument(body, hidden, arms), 0, 9)
+
+        # Keyframes outside of the clip range are left out.
+        self.assertEqual(keyframeIndex.keyframeTimes(), [0, 2, 4, 6])
+        self.assertEqual(keyframeIndex.nodeKeyframeTimes(0), [0, 2, 4])
+        self.assertEqual(keyframeIndex.nodeKeyframeTimes(1), [])
+        self.assertEqual(keyframeIndex.nodeKeyframeTimes(2), [0, 6])
+        self.assertFalse(keyframeIndex.hasUnkeyedContent)
+
+    def test_keyframes_between_times(self):
+        keyframeIndex = KeyframeIndex(createDocument(InMemoryNode("Body", keyframes=createKeyframes([0, 4])),
+                                                     InMemoryNode("Arms", keyframes=createKeyframes([0, 6]))), 0, 9)
+
+        # The start time is excluded and the end time is included.
+        self.assertTrue(keyframeIndex.hasKeyframeBetween(0, 4))
+        self.assertFalse(keyframeIndex.hasKeyframeBetween(0, 3))
+        self.assertFalse(keyframeIndex.hasKeyframeBetween(4, 5))
+        self.assertFalse(keyframeIndex.hasKeyframeBetween(6, 9))
+        self.assertTrue(keyframeIndex.nodeHasKeyframeBetween(1, 4, 6))
+        self.assertFalse(keyframeIndex.nodeHasKeyframeBetween(0, 4, 6))
+
+    def test_nodes_that_change_without_keyframes(self):
+        for nodeType in KeyframeIndex.UNKEYED_NODE_TYPES:
+            with self.subTest(nodeType=nodeType):
+                node = InMemoryNode("Layer", "grouplayer", children=[InMemoryNode("Effect", nodeType)])
+                self.assertTrue(KeyframeIndex(createDocument(node), 0, 9).hasUnkeyedContent)
+
+        # Hidden nodes don't change the frames of the document.
+        hiddenNode = InMemoryNode("Effect", "filterlayer", visible=False)
+        self.assertFalse(KeyframeIndex(createDocument(hiddenNode), 0, 9).hasUnkeyedContent)
+
+if __name__ == "__main__":
+    unittest.main()